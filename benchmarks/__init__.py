@@ -0,0 +1 @@
+"""Benchmark scenarios for mono-merger."""
@@ -0,0 +1,164 @@
+"""
+Startup and manifest parsing benchmark for mono-merger.
+
+Generates a manifest with many repos, once as a single file and once split into
+files pulled in with `include:`, and measures how long importing the entry point
+and the commands, printing `--help`, parsing and building the AppConfig take,
+along with the memory the config objects hold:
+
+    python -m benchmarks.config_load --repos 10000 --branches 3 --parts 50
+"""
+
+import argparse
+import asyncio
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import yaml
+
+from benchmarks.run import RESULTS_DIR, write_results
+from mono_merger.config import AppConfig, get_yaml_loader, load_config_async
+
+PACKAGE_ROOT = Path(__file__).resolve().parent.parent
+
+
+def repo_entries(repos: int, branches: int) -> list:
+    """Repo entries of a synthetic manifest, spread over a handful of domains"""
+    return [
+        {
+            "url": f"git@git.example.com:team{idx % 97}/repo-{idx:05d}.git",
+            "branches": [
+                {"name": "main" if branch == 0 else f"release/{branch}", "domain": f"domain{idx % 8}"}
+                for branch in range(branches)
+            ],
+        }
+        for idx in range(repos)
+    ]
+
+
+def write_manifests(work_dir: Path, repos: int, branches: int, parts: int) -> tuple:
+    """Writes the same manifest as one file and as a main file including `parts` files"""
+    entries = repo_entries(repos, branches)
+    base = {
+        "output_dir": str(work_dir / "output"),
+        "domain_mapping": {f"domain{idx}": f"domains/domain{idx}" for idx in range(8)},
+    }
+
+    single = work_dir / "single.yaml"
+    single.write_text(yaml.safe_dump({**base, "repos": entries}), encoding="utf-8")
+
+    split = work_dir / "split.yaml"
+    split.write_text(yaml.safe_dump({**base, "include": ["parts/*.yaml"]}), encoding="utf-8")
+    (work_dir / "parts").mkdir()
+    for part in range(parts):
+        (work_dir / "parts" / f"part-{part:04d}.yaml").write_text(
+            yaml.safe_dump({"repos": entries[part::parts]}), encoding="utf-8"
+        )
+    return single, split
+
+
+def time_command(args: list, runs: int) -> float:
+    """Median wall time of running a command in a fresh interpreter"""
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=PACKAGE_ROOT, capture_output=True, check=False)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def measure_startup(runs: int) -> dict:
+    """Interpreter start, entry point and command imports and `--help` times, each in a fresh process"""
+    interpreter = time_command([sys.executable, "-c", "pass"], runs)
+    return {
+        "interpreter_seconds": round(interpreter, 4),
+        "import_seconds": round(
+            time_command([sys.executable, "-c", "import mono_merger.main"], runs) - interpreter, 4
+        ),
+        "commands_import_seconds": round(
+            time_command([sys.executable, "-c", "import mono_merger.commands"], runs) - interpreter, 4
+        ),
+        "help_seconds": round(
+            time_command([sys.executable, "-m", "mono_merger.main", "--help"], runs) - interpreter, 4
+        ),
+    }
+
+
+def measure_parse(single: Path, split: Path) -> dict:
+    """Times the pure Python loader against the configured one and the split manifest"""
+    content = single.read_text(encoding="utf-8")
+    start = time.perf_counter()
+    raw = yaml.load(content, Loader=yaml.SafeLoader)
+    pure_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    yaml.load(content, Loader=get_yaml_loader())
+    loader_seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    config = AppConfig.from_dict(raw)
+    build_seconds = time.perf_counter() - start
+    config_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    asyncio.run(load_config_async(str(single)))
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    split_config = asyncio.run(load_config_async(str(split)))
+    split_seconds = time.perf_counter() - start
+    assert len(split_config.repos) == len(config.repos)
+
+    return {
+        "loader": get_yaml_loader().__name__,
+        "pure_python_parse_seconds": round(pure_seconds, 3),
+        "parse_seconds": round(loader_seconds, 3),
+        "build_seconds": round(build_seconds, 3),
+        "config_bytes": config_bytes,
+        "load_single_seconds": round(single_seconds, 3),
+        "load_split_seconds": round(split_seconds, 3),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure mono-merger startup and manifest loading")
+    parser.add_argument("--repos", type=int, default=10000, help="Repos in the manifest")
+    parser.add_argument("--branches", type=int, default=3, help="Branches per repo")
+    parser.add_argument("--parts", type=int, default=50, help="Files the split manifest includes")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per startup measurement")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results")
+    return parser.parse_args()
+
+
+def run(args: argparse.Namespace) -> None:
+    work_dir = Path(tempfile.mkdtemp(prefix="mono-merger-config-bench-"))
+    try:
+        single, split = write_manifests(work_dir, args.repos, args.branches, args.parts)
+        result = {
+            "repos": args.repos,
+            "branches": args.branches,
+            "parts": args.parts,
+            "manifest_bytes": single.stat().st_size,
+            **measure_startup(args.runs),
+            **measure_parse(single, split),
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    print(json.dumps(result, indent=2), flush=True)
+
+    write_results(
+        args.output or RESULTS_DIR / f"config-load-{time.strftime('%Y%m%d-%H%M%S')}.json", [result]
+    )
+
+
+if __name__ == "__main__":
+    run(parse_args())
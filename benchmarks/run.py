@@ -0,0 +1,377 @@
+"""
+Reproducible throughput benchmarks for mono-merger.
+
+Synthetic source repositories are generated locally with `git fast-import` and
+served over file:// so every scenario runs offline. Each scenario runs the full
+`main()` workflow and records wall time, git process spawns, peak RSS and disk
+usage as JSON, so results can be compared between versions:
+
+    python -m benchmarks.run --scenario small --scenario wide
+    python -m benchmarks.run --scenario small --compare benchmarks/results/baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from mono_merger.async_git import AsyncGitRepo
+from mono_merger.commands import main
+from mono_merger.config import AppConfig
+from mono_merger.planner import directory_size
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+GIT_IDENTITY = {
+    "GIT_AUTHOR_NAME": "mono-merger bench",
+    "GIT_AUTHOR_EMAIL": "bench@example.com",
+    "GIT_COMMITTER_NAME": "mono-merger bench",
+    "GIT_COMMITTER_EMAIL": "bench@example.com",
+}
+
+
+@dataclass
+class HistoryShape:
+    """Branches, commits and files of each synthetic source repository"""
+
+    branches: int
+    commits: int
+    files: int = 20
+    files_per_commit: int = 3
+    file_size: int = 1024
+    seed: int = 42
+
+
+@dataclass
+class MergeOptions:
+    """How a scenario merges its source repositories"""
+
+    import_engine: str = "subtree"
+    git_backend: str = "subprocess"
+    # "none", "mirrors" to fetch through the mirror cache, or "alternates" to borrow from it
+    cache: str = "none"
+    finalize: bool = False
+    dedupe: bool = False
+    analyze: bool = False
+    max_workers: int = 8
+
+
+@dataclass
+class Scenario:
+    """The synthetic source repositories of a benchmark and how they are merged"""
+
+    name: str
+    repos: int
+    history: HistoryShape
+    forks: int = 0
+    # how the merge reads the sources: file:// URLs, local directories or bundle files
+    source_format: str = "url"
+    merge: MergeOptions = field(default_factory=MergeOptions)
+
+
+SMALL = HistoryShape(branches=3, commits=10)
+WIDE = HistoryShape(branches=10, commits=5)
+DEEP = HistoryShape(branches=2, commits=2000)
+LARGE_FILES = HistoryShape(branches=2, commits=5, file_size=1024 * 1024)
+FORKED = HistoryShape(branches=4, commits=5)
+
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario(name="small", repos=3, history=SMALL),
+        Scenario(name="wide", repos=20, history=WIDE),
+        Scenario(name="deep", repos=2, history=DEEP),
+        Scenario(name="large-files", repos=4, history=LARGE_FILES),
+        Scenario(
+            name="large-files-analyzed", repos=4, history=LARGE_FILES, merge=MergeOptions(analyze=True)
+        ),
+        Scenario(
+            name="small-plumbing", repos=3, history=SMALL, merge=MergeOptions(import_engine="plumbing")
+        ),
+        Scenario(
+            name="wide-plumbing", repos=20, history=WIDE, merge=MergeOptions(import_engine="plumbing")
+        ),
+        Scenario(
+            name="wide-plumbing-batch",
+            repos=20,
+            history=WIDE,
+            merge=MergeOptions(import_engine="plumbing", git_backend="batch"),
+        ),
+        Scenario(name="wide-local", repos=20, history=WIDE, source_format="path"),
+        Scenario(name="wide-bundles", repos=20, history=WIDE, source_format="bundle"),
+        Scenario(name="wide-cached", repos=20, history=WIDE, merge=MergeOptions(cache="mirrors")),
+        Scenario(
+            name="wide-alternates", repos=20, history=WIDE, merge=MergeOptions(cache="alternates")
+        ),
+        Scenario(name="wide-finalized", repos=20, history=WIDE, merge=MergeOptions(finalize=True)),
+        Scenario(name="forks", repos=5, history=FORKED, forks=3),
+        Scenario(name="forks-dedupe", repos=5, history=FORKED, forks=3, merge=MergeOptions(dedupe=True)),
+        Scenario(
+            name="deep-history", repos=2, history=DEEP, merge=MergeOptions(import_engine="history")
+        ),
+    )
+}
+
+
+def _fast_import_stream(history: HistoryShape, rng: random.Random):
+    """Yields a fast-import stream with `branches` branches forked from main"""
+    mark = 0
+    timestamp = 1_700_000_000
+    main_root: Optional[int] = None
+
+    for branch_idx in range(history.branches):
+        branch = "main" if branch_idx == 0 else f"branch-{branch_idx:03d}"
+        parent = main_root
+        for commit_idx in range(history.commits):
+            changes = []
+            for _ in range(history.files_per_commit):
+                mark += 1
+                content = rng.randbytes(history.file_size)
+                yield b"blob\nmark :%d\ndata %d\n%s\n" % (mark, len(content), content)
+                changes.append((mark, rng.randrange(history.files)))
+
+            mark += 1
+            timestamp += 60
+            message = f"{branch} commit {commit_idx}\n".encode()
+            yield b"commit refs/heads/%s\nmark :%d\n" % (branch.encode(), mark)
+            yield b"committer bench <bench@example.com> %d +0000\n" % timestamp
+            yield b"data %d\n%s" % (len(message), message)
+            if parent is not None:
+                yield b"from :%d\n" % parent
+            for blob_mark, file_idx in changes:
+                yield b"M 100644 :%d src/file_%04d.bin\n" % (blob_mark, file_idx)
+            yield b"\n"
+
+            parent = mark
+            if branch_idx == 0 and commit_idx == 0:
+                main_root = mark
+    yield b"done\n"
+
+
+def source_location(path: Path, source_format: str) -> str:
+    """How the merge reads a generated bare repo, writing a bundle of it when asked to"""
+    if source_format == "bundle":
+        bundle = path.with_suffix(".bundle")
+        subprocess.run(["git", "bundle", "create", "--quiet", str(bundle), "--all"], cwd=path, check=True)
+        return str(bundle)
+    if source_format == "path":
+        return str(path)
+    return path.as_uri()
+
+
+def generate_source_repos(root: Path, scenario: Scenario) -> List[str]:
+    """Creates the synthetic bare source repos, and `forks` copies of each, and returns their locations"""
+    rng = random.Random(scenario.history.seed)
+    urls = []
+    for repo_idx in range(scenario.repos):
+        path = root / f"repo-{repo_idx:03d}.git"
+        subprocess.run(["git", "init", "--bare", "--quiet", str(path)], check=True)
+        with subprocess.Popen(
+            ["git", "fast-import", "--quiet", "--done"], cwd=path, stdin=subprocess.PIPE
+        ) as process:
+            for chunk in _fast_import_stream(scenario.history, rng):
+                process.stdin.write(chunk)
+            process.stdin.close()
+            if process.wait() != 0:
+                raise RuntimeError(f"fast-import failed for {path}")
+        subprocess.run(["git", "symbolic-ref", "HEAD", "refs/heads/main"], cwd=path, check=True)
+        urls.append(source_location(path, scenario.source_format))
+        for fork_idx in range(scenario.forks):
+            fork = root / f"repo-{repo_idx:03d}-fork-{fork_idx}.git"
+            subprocess.run(["git", "clone", "--mirror", "--quiet", str(path), str(fork)], check=True)
+            urls.append(source_location(fork, scenario.source_format))
+    return urls
+
+
+def build_config(merge: MergeOptions, urls: List[str], work_dir: Path) -> dict:
+    """Builds the YAML-equivalent config dictionary for a scenario"""
+    config = {
+        "repos": [
+            {"url": url, "branches": [{"name": "all", "domain": f"domain{idx % 3}"}]}
+            for idx, url in enumerate(urls)
+        ],
+        "domain_mapping": {f"domain{idx}": f"domains/domain{idx}" for idx in range(3)},
+        "output_dir": str(work_dir / "output"),
+        "import_engine": merge.import_engine,
+        "git_backend": merge.git_backend,
+        "concurrency": {"max_workers": merge.max_workers, "per_host": merge.max_workers},
+        "dedupe": merge.dedupe,
+    }
+    if merge.cache != "none":
+        config["cache_dir"] = str(work_dir / "cache")
+    if merge.cache == "alternates":
+        config["alternates"] = {"enabled": True}
+    if merge.analyze:
+        config["analysis"] = {"enabled": True}
+    if merge.finalize:
+        config["finalize"] = {"enabled": True, "measure": True}
+    return config
+
+
+class SpawnCounter:
+    """Counts git processes started through asyncio while installed"""
+
+    def __init__(self):
+        self.count = 0
+        self._original = None
+
+    def __enter__(self):
+        self._original = asyncio.create_subprocess_exec
+
+        async def counting_exec(program, *args, **kwargs):
+            if program == "git":
+                self.count += 1
+            return await self._original(program, *args, **kwargs)
+
+        asyncio.create_subprocess_exec = counting_exec
+        return self
+
+    def __exit__(self, *exc_info):
+        asyncio.create_subprocess_exec = self._original
+
+
+async def run_scenario(scenario: Scenario, keep: bool = False) -> dict:
+    """Generates the sources for a scenario, runs the merge and returns its measurements"""
+    work_dir = Path(tempfile.mkdtemp(prefix=f"mono-merger-bench-{scenario.name}-"))
+    try:
+        generate_start = time.perf_counter()
+        urls = generate_source_repos(work_dir / "sources", scenario)
+        generate_time = time.perf_counter() - generate_start
+
+        config = AppConfig.from_dict(build_config(scenario.merge, urls, work_dir))
+        with SpawnCounter() as spawns:
+            start = time.perf_counter()
+            async_git = AsyncGitRepo(config.output_dir, backend=config.git_backend)
+            try:
+                await main(config, async_git)
+            finally:
+                await async_git.close()
+            wall_time = time.perf_counter() - start
+
+        return {
+            "scenario": asdict(scenario),
+            "generate_seconds": round(generate_time, 3),
+            "wall_seconds": round(wall_time, 3),
+            "git_spawns": spawns.count,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "peak_child_rss_kb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+            "output_bytes": directory_size(work_dir / "output"),
+            "cache_bytes": directory_size(work_dir / "cache"),
+            "source_bytes": directory_size(work_dir / "sources"),
+        }
+    finally:
+        if keep:
+            print(f"Kept scenario files in {work_dir}")
+        else:
+            await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
+
+
+def run_scenario_isolated(scenario: Scenario, keep: bool = False) -> dict:
+    """Runs a scenario in the current process, used as a fresh worker so RSS is per scenario"""
+    return asyncio.run(run_scenario(scenario, keep))
+
+
+def write_results(output: Path, results: List[dict], **environment: str) -> None:
+    """Writes results as JSON along with the Python version, the platform and `environment`"""
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(
+        json.dumps(
+            {
+                "created_at": time.time(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                **environment,
+                "results": results,
+            },
+            indent=2,
+        ),
+        encoding="utf-8",
+    )
+    print(f"Results written to {output}")
+
+
+def compare(results: List[dict], baseline_path: Path) -> None:
+    """Prints the relative change of every scenario against a previous result file"""
+    baseline = {
+        result["scenario"]["name"]: result
+        for result in json.loads(baseline_path.read_text(encoding="utf-8"))["results"]
+    }
+    for result in results:
+        previous = baseline.get(result["scenario"]["name"])
+        if previous is None:
+            continue
+        for metric in ("wall_seconds", "git_spawns", "peak_child_rss_kb", "output_bytes"):
+            before, after = previous[metric], result[metric]
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{result['scenario']['name']:>16} {metric:>18}: {before} -> {after} ({change:+.1f}%)")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run mono-merger benchmark scenarios")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="Scenario to run, can be repeated (default: small)",
+    )
+    parser.add_argument("--repos", type=int, help="Override the number of repos")
+    parser.add_argument("--branches", type=int, help="Override the number of branches per repo")
+    parser.add_argument("--commits", type=int, help="Override the number of commits per branch")
+    parser.add_argument("--file-size", type=int, help="Override the size in bytes of each file version")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON results")
+    parser.add_argument("--compare", type=Path, help="Previous JSON results to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated repositories")
+    return parser.parse_args()
+
+
+async def run(args: argparse.Namespace) -> None:
+    # inherited by the scenario worker processes
+    for name, value in GIT_IDENTITY.items():
+        os.environ.setdefault(name, value)
+
+    overrides = {
+        name: getattr(args, name)
+        for name in ("branches", "commits", "file_size")
+        if getattr(args, name) is not None
+    }
+    results = []
+    for name in args.scenario or ["small"]:
+        scenario = SCENARIOS[name]
+        scenario = replace(
+            scenario,
+            repos=args.repos or scenario.repos,
+            history=replace(scenario.history, **overrides),
+        )
+        print(f"Running scenario {scenario.name}...", flush=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            result = await asyncio.get_running_loop().run_in_executor(
+                pool, run_scenario_isolated, scenario, args.keep
+            )
+        print(json.dumps(result, indent=2), flush=True)
+        results.append(result)
+
+    write_results(
+        args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json",
+        results,
+        git=subprocess.run(["git", "--version"], capture_output=True, text=True, check=False).stdout.strip(),
+    )
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -1,15 +1,61 @@
 import asyncio
+import logging
+import os
+import re
 import time
+from collections import deque
 from pathlib import Path
+from asyncio.subprocess import Process
+from typing import AsyncIterator, Callable, Deque, Dict, List, Optional, Sequence
+
+import aiofiles
+import aiofiles.os
+
 from mono_merger.config import logger
+from mono_merger.history import HistoryMarks
+from mono_merger.tracing import tracer
 
 FATAL_ERR_EXIT_CODE = 128
+STDERR_TAIL_LINES = 50
+STREAM_LINE_LIMIT = 1024 * 1024
+# Paths or objects looked up per git invocation or batch request
+BATCH_SIZE = 500
+
+
+class GitCommandError(Exception):
+    """A git command that failed or timed out, with the tail of its stderr"""
+
+    def __init__(
+        self,
+        message: str,
+        command: Sequence[str] = (),
+        *,
+        returncode: Optional[int] = None,
+        stderr: str = "",
+        timed_out: bool = False,
+    ):
+        super().__init__(message)
+        self.command = list(command)
+        self.returncode = returncode
+        self.stderr = stderr
+        self.timed_out = timed_out
 
 
-class AsyncGitRepo:
-    def __init__(self, repo_path: str):
+# a thin wrapper with one method per git command the merger runs
+class AsyncGitRepo:  # pylint: disable=too-many-public-methods
+    def __init__(self, repo_path: str, backend: str = "subprocess"):
         self.repo_path = Path(repo_path).resolve()
-        logger.debug("AsyncGitRepo initialized with path: %s", self.repo_path)
+        if backend not in BACKENDS:
+            raise Exception(f"Unknown git backend '{backend}', expected one of {tuple(BACKENDS)}")
+        # ref and object operations go through the backend, everything else runs git directly
+        self.backend = BACKENDS[backend](self)
+        # shallow fetches rewrite .git/shallow behind a lock file git fails on instead of waiting
+        self._shallow_lock = asyncio.Lock()
+        logger.debug("AsyncGitRepo initialized with path: %s, backend: %s", self.repo_path, backend)
+
+    async def close(self) -> None:
+        """Stop the long-lived git processes of the backend, if it has any"""
+        await self.backend.close()
 
     async def init(self) -> str:
         """Initialize a git repository"""
@@ -23,33 +69,40 @@ class AsyncGitRepo:
         logger.debug("Adding files to staging area: %s", ', '.join(files))
         return await self._run_git_command("add", *files)
 
-    async def commit(self, message: str) -> str:
-        """Create a commit with message"""
+    async def commit(self, message: str, env: Optional[Dict[str, str]] = None) -> str:
+        """Create a commit with message, env overriding the identity or dates it records"""
         logger.debug("Creating commit with message: %s", message)
-        result = await self._run_git_command("commit", "-m", message)
+        result = await self._run_git_command("commit", "-m", message, env=env)
         logger.info("Commit created successfully: %s", message)
         return result
 
-    async def list_branches(self, url: str) -> str:
-        """Create a commit with message"""
+    async def list_branches(self, url: str) -> Dict[str, str]:
+        """List the branches of a repository with their head commits"""
         logger.debug("Listing branches for repo: %s", url)
-        result = await self._run_git_command("ls-remote", "--heads", url)
-        print(result)
-        return result
+        heads = {}
+        async for line in self._stream_git_command("ls-remote", "--heads", url):
+            sha, _, ref = line.partition("\t")
+            if ref.startswith("refs/heads/"):
+                heads[ref.removeprefix("refs/heads/")] = sha.strip()
+        logger.debug("Found %s branches in %s", len(heads), url)
+        return heads
 
     async def subtree_add(
         self,
         prefix: str,
-        repository: str,
+        repository: Optional[str],
         ref: str = "main",
         squash: bool = False,
     ) -> str:
-        """Add a subtree"""
+        """Add a subtree, from a local commit when no repository is given"""
         logger.info(
             "Adding subtree - Repository: %s, Branch: %s, Prefix: %s", repository, ref, prefix
         )
 
-        args = ["subtree", "add", "--prefix", prefix, repository, ref]
+        args = ["subtree", "add", "--prefix", prefix]
+        if repository:
+            args.append(repository)
+        args.append(ref)
 
         if squash:
             args.append("--squash")
@@ -59,14 +112,400 @@ class AsyncGitRepo:
         logger.info("Subtree add completed successfully for %s:%s", repository, ref)
         return result
 
-    async def _run_git_command(self, *args, timeout: int = 300) -> str:
-        """Run a git command asynchronously"""
+    async def subtree_merge(self, prefix: str, ref: str, squash: bool = False) -> str:
+        """Merge a new revision of a subtree into its prefix"""
+        logger.info("Merging subtree - Ref: %s, Prefix: %s", ref, prefix)
+
+        args = ["subtree", "merge", "--prefix", prefix, ref]
+        if squash:
+            args.append("--squash")
+
+        result = await self._run_git_command(*args, timeout=600)
+        logger.info("Subtree merge completed successfully for %s", prefix)
+        return result
+
+    async def unmerged_paths(self) -> List[str]:
+        """Paths of the index left with merge conflicts"""
+        result = await self._run_git_command("diff", "--name-only", "--diff-filter=U")
+        return result.splitlines()
+
+    async def clone_mirror(self, url: str, destination: str) -> str:
+        """Clone a repository as a bare mirror"""
+        logger.info("Cloning mirror of %s into %s", url, destination)
+        return await self._run_git_command(
+            "clone",
+            "--mirror",
+            "--progress",
+            url,
+            destination,
+            timeout=1800,
+            on_progress=ProgressLogger(f"Mirror clone of {url}"),
+        )
+
+    async def clone_shared(self, source: str, destination: str) -> str:
+        """Clone a local repository borrowing its objects through alternates"""
+        logger.debug("Cloning %s into %s with shared objects", source, destination)
+        return await self._run_git_command("clone", "--shared", "--quiet", source, destination)
+
+    async def remote_update(self) -> str:
+        """Incrementally refresh a mirror from its remote"""
+        logger.debug("Updating mirror at %s", self.repo_path)
+        return await self._run_git_command(
+            "fetch",
+            "--prune",
+            "--progress",
+            "origin",
+            timeout=1800,
+            on_progress=ProgressLogger(f"Mirror update of {self.repo_path.name}"),
+        )
+
+    async def fetch(
+        self,
+        repository: str,
+        *refspecs: str,
+        depth: Optional[int] = None,
+        shallow_since: Optional[str] = None,
+        filter_spec: Optional[str] = None,
+    ) -> str:
+        """Fetch refs from a repository without touching FETCH_HEAD, so fetches can run concurrently.
+
+        `depth` and `shallow_since` make a shallow fetch, `filter_spec` a partial one whose
+        missing objects are fetched on demand from the repository. Shallow fetches into the
+        repository run one at a time.
+        """
+        options = []
+        if depth is not None:
+            options.append(f"--depth={depth}")
+        if shallow_since is not None:
+            options.append(f"--shallow-since={shallow_since}")
+        if filter_spec is not None:
+            options.append(f"--filter={filter_spec}")
+            # git names the promisor remote after the repository, which must not be a path
+            local_path = self.repo_path / repository
+            if await aiofiles.os.path.isdir(local_path):
+                repository = local_path.resolve().as_uri()
+        logger.debug("Fetching %s from %s %s", ", ".join(refspecs), repository, " ".join(options))
+        args = ["fetch", "--quiet", "--no-tags", "--no-write-fetch-head", *options, repository, *refspecs]
+        if depth is None and shallow_since is None:
+            return await self._run_git_command(*args, timeout=600)
+        async with self._shallow_lock:
+            return await self._run_git_command(*args, timeout=600)
+
+    async def bundle_create(self, path: str, *refs: str) -> str:
+        """Write the history of refs into a bundle file, which can be fetched from like a repo"""
+        logger.info("Creating bundle %s of %s", path, ", ".join(refs))
+        return await self._run_git_command("bundle", "create", "--quiet", str(path), *refs, timeout=1800)
+
+    async def add_alternate(self, objects_dir: str) -> None:
+        """Lets the repository read objects from another object directory instead of copying them"""
+        info_dir = self.repo_path / ".git" / "objects" / "info"
+        alternates_path = info_dir / "alternates"
+        await aiofiles.os.makedirs(info_dir, exist_ok=True)
+        existing = []
+        if await aiofiles.os.path.isfile(alternates_path):
+            async with aiofiles.open(alternates_path, "r", encoding="utf-8") as file:
+                existing = (await file.read()).splitlines()
+        if str(objects_dir) in existing:
+            return
+        async with aiofiles.open(alternates_path, "a", encoding="utf-8") as file:
+            await file.write(f"{objects_dir}\n")
+        logger.debug("Added alternate object directory %s", objects_dir)
+
+    async def remove_alternates(self) -> None:
+        """Stops reading objects from alternate object directories"""
+        alternates_path = self.repo_path / ".git" / "objects" / "info" / "alternates"
+        if await aiofiles.os.path.isfile(alternates_path):
+            await aiofiles.os.remove(alternates_path)
+
+    async def dissociate(self) -> str:
+        """Copies every borrowed object into the repository's own pack and drops its alternates"""
+        logger.info("Repacking %s to stop depending on alternate object directories", self.repo_path)
+        result = await self.repack()
+        await self.remove_alternates()
+        return result
+
+    async def repack(
+        self,
+        *,
+        window: Optional[int] = None,
+        depth: Optional[int] = None,
+        threads: Optional[int] = None,
+        bitmaps: bool = False,
+        local: bool = False,
+        aggressive: bool = False,
+    ) -> str:
+        """Repack all objects into a single pack.
+
+        Objects borrowed from alternates are copied into the pack unless `local` is set,
+        `aggressive` recomputes every delta instead of reusing the existing ones.
+        """
+        args = ["repack", "-a", "-d", "--quiet"]
+        if local:
+            args.append("-l")
+        if aggressive:
+            args.append("-f")
+        if window is not None:
+            args.append(f"--window={window}")
+        if depth is not None:
+            args.append(f"--depth={depth}")
+        if threads is not None:
+            args.append(f"--threads={threads}")
+        if bitmaps:
+            args.append("--write-bitmap-index")
+        return await self._run_git_command(*args, timeout=3600)
+
+    async def prune(self) -> str:
+        """Delete every unreachable loose object right away"""
+        return await self._run_git_command("prune", "--expire=now", timeout=1800)
+
+    async def is_shallow(self) -> bool:
+        """Whether shallow fetches left commits whose parents are missing"""
+        return await aiofiles.os.path.isfile(self.repo_path / ".git" / "shallow")
+
+    async def promisor_remotes(self) -> List[str]:
+        """Remotes that partial fetches recorded as able to provide the objects they left out"""
+        names = await self._run_git_command(
+            "config", "--name-only", "--get-regexp", r"^remote\..*\.promisor$", ok_returncodes=(0, 1)
+        )
+        return [name[len("remote."):-len(".promisor")] for name in names.splitlines()]
+
+    async def missing_objects(self, rev: str = "--all") -> List[str]:
+        """Ids of the objects reachable from a revision that are not in the repository"""
+        missing = []
+        async for line in self._stream_git_command(
+            "rev-list", "--objects", "--missing=print", rev, timeout=1800
+        ):
+            if line.startswith("?"):
+                missing.append(line[1:])
+        return missing
+
+    async def object_sizes(self, object_ids: List[str]) -> Dict[str, int]:
+        """Sizes in bytes of objects, which must be in the repository so none is fetched lazily"""
+        sizes: Dict[str, int] = {}
+        batch = BatchProcess(self.repo_path, "cat-file", "--batch-check=%(objectname) %(objectsize)")
+        try:
+            for idx in range(0, len(object_ids), BATCH_SIZE):
+                chunk = object_ids[idx:idx + BATCH_SIZE]
+                for line in await batch.request("".join(f"{oid}\n" for oid in chunk), len(chunk)):
+                    oid, _, size = line.partition(" ")
+                    if size.isdigit():
+                        sizes[oid] = int(size)
+        finally:
+            await batch.close()
+        return sizes
+
+    async def drop_promisor_remotes(self, remotes: List[str]) -> None:
+        """Turns a partial clone back into a full one, only safe once it has every object it reaches.
+
+        The promisor remotes and the `.promisor` marks of the packs fetched from them are
+        removed, and the repository format is lowered again when no extension needs it.
+        """
+        logger.info("Dropping the promisor remotes of %s: %s", self.repo_path, ", ".join(remotes))
+        for remote in remotes:
+            await self._run_git_command("config", "--remove-section", f"remote.{remote}")
+        await self._run_git_command("config", "--unset", "extensions.partialclone", ok_returncodes=(0, 5))
+        extensions = await self._run_git_command(
+            "config", "--get-regexp", r"^extensions\.", ok_returncodes=(0, 1)
+        )
+        if not extensions:
+            await self._run_git_command("config", "core.repositoryformatversion", "0")
+
+        pack_dir = self.repo_path / ".git" / "objects" / "pack"
+        for name in await aiofiles.os.listdir(pack_dir):
+            if name.endswith(".promisor"):
+                await aiofiles.os.remove(pack_dir / name)
+
+    async def write_commit_graph(self) -> str:
+        """Write a commit-graph of every reachable commit, with changed-path Bloom filters"""
+        return await self._run_git_command(
+            "commit-graph", "write", "--reachable", "--changed-paths", timeout=1800
+        )
+
+    async def write_multi_pack_index(self, bitmap: bool = False) -> str:
+        """Write a multi-pack-index over the packs of the repository"""
+        args = ["multi-pack-index", "write"]
+        if bitmap:
+            args.append("--bitmap")
+        return await self._run_git_command(*args, timeout=1800)
+
+    async def count_objects(self) -> Dict[str, int]:
+        """Return the numeric statistics of `git count-objects -v`, sizes in KiB"""
+        stats = {}
+        for line in (await self._run_git_command("count-objects", "-v")).splitlines():
+            name, _, value = line.partition(": ")
+            if value.isdigit():
+                stats[name] = int(value)
+        return stats
+
+    async def walk_history(self, rev: str = "HEAD") -> int:
+        """Walk the whole history of a revision like `git log` does and return its commit count"""
+        count = 0
+        async for _ in self._stream_git_command("log", "--format=%H", rev, timeout=1800):
+            count += 1
+        return count
+
+    async def clone_bare(self, source: str, dest: str) -> str:
+        """Clone a repository through the pack protocol, the way a remote clone would"""
+        return await self._run_git_command(
+            "clone", "--bare", "--no-local", "--quiet", str(source), str(dest), timeout=3600
+        )
+
+    async def rev_parse(self, rev: str) -> str:
+        """Resolve a revision to an object id, empty if it does not exist"""
+        return await self.backend.rev_parse(rev)
+
+    async def list_tree_paths(self, treeish: str, paths: List[str]) -> List[str]:
+        """Return which of the given paths exist in a tree"""
+        return await self.backend.list_tree_paths(treeish, paths)
+
+    async def read_tree(
+        self, *treeishes: str, prefix: Optional[str] = None, index_file: Optional[str] = None
+    ) -> str:
+        """Read trees into an index, optionally under a prefix or into a private index file"""
+        args = ["read-tree"]
+        if prefix:
+            args.append(f"--prefix={prefix}")
+        return await self._run_git_command(*args, *treeishes, env=_index_env(index_file))
+
+    async def write_tree(self, index_file: Optional[str] = None) -> str:
+        """Write an index out as a tree object"""
+        return await self._run_git_command("write-tree", env=_index_env(index_file))
+
+    async def commit_tree(self, tree: str, message: str, *parents: str) -> str:
+        """Create a commit object for a tree without touching HEAD"""
+        args = ["commit-tree", tree, "-m", message]
+        for parent in parents:
+            args.extend(["-p", parent])
+        return await self._run_git_command(*args)
+
+    async def update_ref(self, ref: str, new_value: str, old_value: Optional[str] = None) -> str:
+        """Point a ref at a new object, guarded by its expected old value"""
+        logger.debug("Updating %s to %s", ref, new_value)
+        return await self.backend.update_ref(ref, new_value, old_value)
+
+    async def remove_paths(self, paths: List[str], index_file: Optional[str] = None) -> None:
+        """Remove files from an index by their literal paths"""
+        for idx in range(0, len(paths), BATCH_SIZE):
+            await self._run_git_command(
+                "--literal-pathspecs", "rm", "--cached", "--quiet", "--ignore-unmatch", "--",
+                *paths[idx:idx + BATCH_SIZE],
+                env=_index_env(index_file),
+            )
+
+    async def rm_cached(self, path: str, index_file: Optional[str] = None) -> str:
+        """Remove a path recursively from an index, leaving the working tree alone"""
+        return await self._run_git_command(
+            "rm", "-r", "--cached", "--quiet", "--ignore-unmatch", "--", path,
+            env=_index_env(index_file),
+        )
+
+    async def rewrite_history(
+        self,
+        rev: str,
+        rewrite: Callable[[asyncio.StreamReader], AsyncIterator[bytes]],
+        timeout: int = 3600,
+        *,
+        marks: Optional[HistoryMarks] = None,
+    ) -> None:
+        """Re-imports the history of a revision through a fast-export stream rewriter.
+
+        Blobs are not exported, the rewritten stream refers to them by id and fast-import
+        finds them in the same repository. With `marks`, the commits an earlier rewrite
+        recorded in them are neither exported nor imported again.
+        """
+        export_args: List[str] = []
+        import_args: List[str] = []
+        if marks is not None:
+            incremental = await marks.load()
+            export_args = marks.fast_export_args(incremental)
+            import_args = marks.fast_import_args(incremental)
+        await self._pipe_git_commands(
+            ["fast-export", "--no-data", "--use-done-feature", "--signed-tags=strip", *export_args, rev],
+            ["fast-import", "--quiet", "--force", "--done", *import_args],
+            rewrite,
+            timeout=timeout,
+        )
+
+    async def delete_ref(self, ref: str) -> str:
+        """Delete a ref"""
+        return await self.backend.delete_ref(ref)
+
+    async def reset_hard(self, ref: str = "HEAD") -> str:
+        """Reset the index and working tree to a commit"""
+        logger.info("Checking out %s into %s", ref, self.repo_path)
+        return await self._run_git_command("reset", "--hard", "--quiet", ref, timeout=1800)
+
+    async def clean(self, paths: List[str]) -> None:
+        """Delete the untracked files below paths, ignored ones included"""
+        for idx in range(0, len(paths), BATCH_SIZE):
+            await self._run_git_command(
+                "clean", "-f", "-f", "-d", "-x", "--quiet", "--", *paths[idx:idx + BATCH_SIZE], timeout=1800
+            )
+
+    async def run_git_command(
+        self,
+        *args,
+        timeout: int = 300,
+        env: Optional[Dict[str, str]] = None,
+        ok_returncodes: Sequence[int] = (0,),
+    ) -> str:
+        """Run any git command in the repository and return its whole stdout.
+
+        The entry point for backends and helpers that run commands this class has no
+        method for.
+        """
+        return await self._run_git_command(
+            *args, timeout=timeout, env=env, ok_returncodes=ok_returncodes
+        )
+
+    async def _run_git_command(
+        self,
+        *args,
+        timeout: int = 300,
+        env: Optional[Dict[str, str]] = None,
+        on_progress: Optional[Callable[[str], None]] = None,
+        ok_returncodes: Sequence[int] = (0,),
+    ) -> str:
+        """Run a git command asynchronously and return its whole stdout"""
+        lines = [
+            line
+            async for line in self._stream_git_command(
+                *args,
+                timeout=timeout,
+                env=env,
+                on_progress=on_progress,
+                ok_returncodes=ok_returncodes,
+            )
+        ]
+        return "\n".join(lines).strip()
+
+    async def _stream_git_command(
+        self,
+        *args,
+        timeout: int = 300,
+        env: Optional[Dict[str, str]] = None,
+        on_progress: Optional[Callable[[str], None]] = None,
+        ok_returncodes: Sequence[int] = (0,),
+    ) -> AsyncIterator[str]:
+        """Run a git command asynchronously and yield its stdout line by line.
+
+        Only the last STDERR_TAIL_LINES lines of stderr are kept for error reporting,
+        every stderr line (including `\\r` separated progress updates) is passed to
+        `on_progress` as it arrives. Any exit code outside `ok_returncodes` raises a
+        GitCommandError, commands that answer with their exit code, like
+        `rev-parse --verify --quiet`, list the codes they expect.
+        """
         command_str = f"git {' '.join(args)}"
         start_time = time.time()
+        started = time.monotonic()
+        deadline = start_time + timeout
 
-        logger.debug("Executing git command: %s", command_str)
-        logger.debug("Working directory: %s", self.repo_path)
+        logger.debug("Executing git command in %s: %s", self.repo_path, command_str)
 
+        process = None
+        stderr_tail: Deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+        stderr_task = None
+        output_bytes = 0
         try:
             process = await asyncio.create_subprocess_exec(
                 "git",
@@ -74,42 +513,411 @@ class AsyncGitRepo:
                 cwd=self.repo_path,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
+                env={**os.environ, **env} if env else None,
+                limit=STREAM_LINE_LIMIT,
             )
-
-            stdout, stderr = await asyncio.wait_for(
-                process.communicate(), timeout=timeout
+            stderr_task = asyncio.create_task(
+                _drain_stderr(process.stderr, stderr_tail, on_progress)
             )
 
+            while True:
+                line = await asyncio.wait_for(
+                    process.stdout.readline(), deadline - time.time()
+                )
+                if not line:
+                    break
+                output_bytes += len(line)
+                yield line.decode(errors="replace").rstrip("\n")
+
+            await asyncio.wait_for(
+                asyncio.gather(stderr_task, process.wait()), max(deadline - time.time(), 0)
+            )
             execution_time = time.time() - start_time
 
-            # Log command output for debugging
-            if stdout:
-                logger.debug("Git command stdout: %s", stdout.decode().strip())
-            if stderr:
-                logger.debug("Git command stderr: %s", stderr.decode().strip())
+            if stderr_tail and logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Git command stderr (tail): %s", "\n".join(stderr_tail))
 
-            if process.returncode == FATAL_ERR_EXIT_CODE:
+            if process.returncode not in ok_returncodes:
+                stderr_text = "\n".join(stderr_tail)
                 error_msg = (
-                    f"Git command failed: {command_str}\nError: {stderr.decode()}"
+                    f"Git command failed with exit code {process.returncode}: {command_str}\n"
+                    f"Error: {stderr_text}"
                 )
                 logger.error(error_msg)
-                raise Exception(error_msg)
-            if process.returncode != 0:
-                warning_msg = f"Git command returned non-zero exit code {process.returncode}: {command_str}"
-                logger.warning(warning_msg)
+                raise GitCommandError(
+                    error_msg, args, returncode=process.returncode, stderr=stderr_text
+                )
 
             logger.debug(
-                "Git command completed in %.2fs: %s", execution_time, command_str
+                "Git command completed in %.2fs with %s bytes of output: %s",
+                execution_time,
+                output_bytes,
+                command_str,
             )
-            return stdout.decode().strip()
 
         except asyncio.TimeoutError:
-            if process.returncode is None:
-                process.kill()
-                await process.wait()
             error_msg = f"Git command timed out after {timeout}s: {command_str}"
             logger.error(error_msg)
-            raise Exception(error_msg) from None
+            raise GitCommandError(error_msg, args, timed_out=True) from None
         except Exception as e:
             logger.error("Git command failed: %s - %s", command_str, e)
             raise
+        finally:
+            # also reached when the consumer stops iterating early
+            if process is not None and process.returncode is None:
+                process.kill()
+                await process.wait()
+            if stderr_task is not None and not stderr_task.done():
+                stderr_task.cancel()
+            tracer.record(
+                args,
+                started,
+                time.monotonic() - started,
+                exit_code=process.returncode if process is not None else -1,
+                output_bytes=output_bytes,
+            )
+
+    async def _pipe_git_commands(
+        self,
+        source_args: Sequence[str],
+        sink_args: Sequence[str],
+        transform: Callable[[asyncio.StreamReader], AsyncIterator[bytes]],
+        timeout: int = 300,
+    ) -> None:
+        """Streams the stdout of one git command through `transform` into the stdin of another.
+
+        Every write waits for the sink to drain, so memory stays bounded by the pipe buffers
+        whatever the size of the stream. A non-zero exit of either command is an error.
+        """
+        command_str = f"git {' '.join(source_args)} | git {' '.join(sink_args)}"
+        started = time.monotonic()
+        logger.debug("Executing git pipeline: %s", command_str)
+
+        source = sink = None
+        tails: List[Deque[str]] = [deque(maxlen=STDERR_TAIL_LINES), deque(maxlen=STDERR_TAIL_LINES)]
+        drain_tasks: List[asyncio.Task] = []
+        streamed_bytes = 0
+
+        async def feed() -> None:
+            nonlocal streamed_bytes
+            try:
+                async for chunk in transform(source.stdout):
+                    streamed_bytes += len(chunk)
+                    sink.stdin.write(chunk)
+                    await sink.stdin.drain()
+                sink.stdin.close()
+                await sink.stdin.wait_closed()
+            except (BrokenPipeError, ConnectionResetError):
+                # the sink exited early, its exit code and stderr tell why
+                source.kill()
+
+        try:
+            source = await asyncio.create_subprocess_exec(
+                "git",
+                *source_args,
+                cwd=self.repo_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=STREAM_LINE_LIMIT,
+            )
+            sink = await asyncio.create_subprocess_exec(
+                "git",
+                *sink_args,
+                cwd=self.repo_path,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            drain_tasks = [
+                asyncio.create_task(_drain_stderr(process.stderr, tail, None))
+                for process, tail in zip((source, sink), tails)
+            ]
+            await asyncio.wait_for(
+                asyncio.gather(feed(), source.wait(), sink.wait(), *drain_tasks), timeout
+            )
+
+            failed = [
+                (args, process, tail)
+                for args, process, tail in zip((source_args, sink_args), (source, sink), tails)
+                if process.returncode != 0
+            ]
+            if failed:
+                # a source killed because the sink went away is not the cause of the failure
+                args, process, tail = next(
+                    (failure for failure in failed if failure[1].returncode > 0), failed[0]
+                )
+                stderr_text = "\n".join(tail)
+                error_msg = (
+                    f"Git command exited with {process.returncode} in pipeline {command_str}\n"
+                    f"Command: git {' '.join(args)}\nError: {stderr_text}"
+                )
+                logger.error(error_msg)
+                raise GitCommandError(
+                    error_msg, args, returncode=process.returncode, stderr=stderr_text
+                )
+
+            logger.debug(
+                "Git pipeline completed in %.2fs streaming %s bytes: %s",
+                time.monotonic() - started,
+                streamed_bytes,
+                command_str,
+            )
+
+        except asyncio.TimeoutError:
+            error_msg = f"Git pipeline timed out after {timeout}s: {command_str}"
+            logger.error(error_msg)
+            raise GitCommandError(error_msg, source_args, timed_out=True) from None
+        finally:
+            for process in (source, sink):
+                if process is not None and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            for task in drain_tasks:
+                if not task.done():
+                    task.cancel()
+            duration = time.monotonic() - started
+            for args, process in zip((source_args, sink_args), (source, sink)):
+                tracer.record(
+                    args,
+                    started,
+                    duration,
+                    exit_code=process.returncode if process is not None else -1,
+                    output_bytes=streamed_bytes if args is source_args else 0,
+                )
+
+
+class SubprocessBackend:
+    """Runs every ref and object operation as a git process of its own"""
+
+    def __init__(self, repo: AsyncGitRepo):
+        self.repo = repo
+
+    async def rev_parse(self, rev: str) -> str:
+        # exits with 1 and prints nothing when the revision does not exist
+        return await self.repo.run_git_command(
+            "rev-parse", "--verify", "--quiet", rev, ok_returncodes=(0, 1)
+        )
+
+    async def list_tree_paths(self, treeish: str, paths: List[str]) -> List[str]:
+        found = []
+        for idx in range(0, len(paths), BATCH_SIZE):
+            result = await self.repo.run_git_command(
+                "ls-tree", "-z", "--name-only", treeish, "--", *paths[idx:idx + BATCH_SIZE]
+            )
+            found.extend(path for path in result.split("\0") if path)
+        return found
+
+    async def update_ref(self, ref: str, new_value: str, old_value: Optional[str] = None) -> str:
+        args = ["update-ref", ref, new_value]
+        if old_value:
+            args.append(old_value)
+        return await self.repo.run_git_command(*args)
+
+    async def delete_ref(self, ref: str) -> str:
+        return await self.repo.run_git_command("update-ref", "-d", ref)
+
+    async def close(self) -> None:
+        pass
+
+
+class BatchBackend(SubprocessBackend):
+    """Answers ref and object operations from two long-lived git processes.
+
+    Lookups are written to `git cat-file --batch-check` and ref changes are sent as
+    single transactions to `git update-ref --stdin`, so a run with thousands of them
+    only starts two processes instead of one per operation.
+    """
+
+    def __init__(self, repo: AsyncGitRepo):
+        super().__init__(repo)
+        self.objects = BatchProcess(repo.repo_path, "cat-file", "--batch-check")
+        self.refs = BatchProcess(repo.repo_path, "update-ref", "--stdin")
+
+    async def rev_parse(self, rev: str) -> str:
+        if "\n" in rev:
+            return await super().rev_parse(rev)
+        (line,) = await self.objects.request(f"{rev}\n", 1)
+        return _batch_object_id(line)
+
+    async def list_tree_paths(self, treeish: str, paths: List[str]) -> List[str]:
+        if any("\n" in path for path in paths):
+            return await super().list_tree_paths(treeish, paths)
+        found = []
+        for idx in range(0, len(paths), BATCH_SIZE):
+            chunk = paths[idx:idx + BATCH_SIZE]
+            lines = await self.objects.request(
+                "".join(f"{treeish}:{path}\n" for path in chunk), len(chunk)
+            )
+            found.extend(path for path, line in zip(chunk, lines) if _batch_object_id(line))
+        return found
+
+    async def update_ref(self, ref: str, new_value: str, old_value: Optional[str] = None) -> str:
+        command = f"update {ref} {new_value} {old_value}" if old_value else f"update {ref} {new_value}"
+        await self.refs.request(f"start\n{command}\ncommit\n", 2)
+        return ""
+
+    async def delete_ref(self, ref: str) -> str:
+        await self.refs.request(f"start\ndelete {ref}\ncommit\n", 2)
+        return ""
+
+    async def close(self) -> None:
+        await asyncio.gather(self.objects.close(), self.refs.close())
+
+
+class BatchProcess:
+    """A long-lived git process answering requests written to its stdin line by line.
+
+    Requests are serialized, the process is started on first use and started again
+    after it exits, which `update-ref --stdin` does when a transaction fails.
+    """
+
+    def __init__(self, repo_path: Path, *args: str):
+        self.repo_path = repo_path
+        self.args = args
+        self.process: Optional[Process] = None
+        self.stderr_tail: Deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+        self.stderr_task: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, data: str, responses: int, timeout: int = 300) -> List[str]:
+        """Writes a request and returns the given number of response lines"""
+        command_str = f"git {' '.join(self.args)}"
+        async with self.lock:
+            started = time.monotonic()
+            lines: List[str] = []
+            output_bytes = 0
+            returncode = 0
+            try:
+                if self.process is None or self.process.returncode is not None:
+                    await self._start()
+                self.process.stdin.write(data.encode())
+                await self.process.stdin.drain()
+                while len(lines) < responses:
+                    line = await asyncio.wait_for(self.process.stdout.readline(), timeout)
+                    if not line:
+                        break
+                    output_bytes += len(line)
+                    lines.append(line.decode(errors="replace").rstrip("\n"))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            except asyncio.TimeoutError:
+                returncode = -1
+                self.process.kill()
+                await self._stop()
+                error_msg = f"Git command timed out after {timeout}s: {command_str}"
+                logger.error(error_msg)
+                raise GitCommandError(error_msg, self.args, timed_out=True) from None
+            finally:
+                if len(lines) < responses and returncode == 0:
+                    returncode = await self._stop()
+                tracer.record(
+                    self.args,
+                    started,
+                    time.monotonic() - started,
+                    exit_code=returncode,
+                    output_bytes=output_bytes,
+                )
+
+            if len(lines) < responses:
+                stderr_text = "\n".join(self.stderr_tail)
+                error_msg = f"Git command failed: {command_str}\nError: {stderr_text}"
+                logger.error(error_msg)
+                raise GitCommandError(
+                    error_msg, self.args, returncode=returncode, stderr=stderr_text
+                )
+            return lines
+
+    async def close(self) -> None:
+        """Closes stdin so the process exits on its own"""
+        async with self.lock:
+            if self.process is not None and self.process.returncode is None:
+                self.process.stdin.close()
+            await self._stop()
+
+    async def _start(self) -> None:
+        logger.debug("Starting git command: git %s", " ".join(self.args))
+        self.stderr_tail.clear()
+        self.process = await asyncio.create_subprocess_exec(
+            "git",
+            *self.args,
+            cwd=self.repo_path,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LINE_LIMIT,
+        )
+        self.stderr_task = asyncio.create_task(
+            _drain_stderr(self.process.stderr, self.stderr_tail, None)
+        )
+
+    async def _stop(self) -> int:
+        """Waits for the process to exit, killing it if it does not, and returns its exit code"""
+        if self.process is None:
+            return -1
+        try:
+            await asyncio.wait_for(self.process.wait(), 10)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+        if self.stderr_task is not None:
+            await self.stderr_task
+        return self.process.returncode
+
+
+BACKENDS = {"subprocess": SubprocessBackend, "batch": BatchBackend}
+
+
+def _batch_object_id(line: str) -> str:
+    """Object id of a `cat-file --batch-check` answer, empty for a missing object"""
+    parts = line.rsplit(" ", 2)
+    if len(parts) == 3 and parts[2].isdigit():
+        return parts[0]
+    return ""
+
+
+async def _drain_stderr(
+    stream: asyncio.StreamReader,
+    tail: Deque[str],
+    on_progress: Optional[Callable[[str], None]],
+) -> None:
+    """Reads stderr as it arrives, keeping a bounded tail and reporting progress lines"""
+    pending = b""
+    while chunk := await stream.read(4096):
+        *lines, pending = re.split(rb"[\r\n]", pending + chunk)
+        for raw in lines:
+            if raw:
+                line = raw.decode(errors="replace")
+                tail.append(line)
+                if on_progress:
+                    on_progress(line)
+    if pending:
+        tail.append(pending.decode(errors="replace"))
+
+
+# a callable for on_progress, a class only to remember the last phase it logged
+class ProgressLogger:  # pylint: disable=too-few-public-methods
+    """Logs git transfer progress each time a phase starts or advances by a step"""
+
+    PATTERN = re.compile(r"^(?:remote: )?(?P<phase>[A-Za-z ]+):\s+(?P<percent>\d+)%")
+
+    def __init__(self, label: str, step: int = 25):
+        self.label = label
+        self.step = step
+        self._phase = None
+        self._percent = -1
+
+    def __call__(self, line: str) -> None:
+        match = self.PATTERN.match(line)
+        if not match:
+            return
+        phase, percent = match["phase"], int(match["percent"])
+        if phase != self._phase or percent >= self._percent + self.step or (
+            percent == 100 and self._percent != 100
+        ):
+            self._phase, self._percent = phase, percent
+            logger.info("%s: %s %s%%", self.label, phase, percent)
+
+
+def _index_env(index_file: Optional[str]) -> Optional[Dict[str, str]]:
+    """Environment pointing git at a private index file"""
+    return {"GIT_INDEX_FILE": str(index_file)} if index_file else None
@@ -0,0 +1,166 @@
+import argparse
+from typing import List, Optional, Tuple
+
+# Kept free of the rest of the package, so --help and usage errors do not pay for
+# importing git, asyncio or yaml support
+IMPORT_ENGINES = ("subtree", "plumbing", "history")
+GIT_BACKENDS = ("subprocess", "batch")
+COMMANDS = ("merge", "sync", "assemble", "verify")
+
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parses a `--shard i/N` value into the 1-based shard index and the shard count"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a shard as i/N, got '{value}'") from None
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"shard index must be between 1 and {count}, got {index}")
+    return index, count
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Consolidate multiple GitHub repos into a single mono-repo"
+    )
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=COMMANDS,
+        default="merge",
+        help=(
+            "merge (default) builds the mono-repo, sync re-imports only the branches that moved upstream, "
+            "assemble combines shard bundles into the mono-repo, verify checks every prefix against "
+            "the tree of its upstream branch"
+        ),
+    )
+    parser.add_argument(
+        "bundles",
+        nargs="*",
+        help="Shard bundles to combine with the assemble command",
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        required=True,
+        help=(
+            "The full path of the configuration YAML file, please see the sample config in the README for an example."
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        default=None,
+        help="Directory holding bare mirrors of the source repositories, overrides cache_dir in the config",
+    )
+    parser.add_argument(
+        "--discovery-ttl",
+        type=int,
+        default=None,
+        help="Seconds a cached branch listing stays valid, 0 always lists branches remotely",
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=None,
+        help="Maximum number of git operations running at once, overrides concurrency.max_workers",
+    )
+    parser.add_argument(
+        "--per-host-limit",
+        type=int,
+        default=None,
+        help="Maximum number of git operations running at once against one remote host, overrides concurrency.per_host",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=None,
+        help="Attempts for remote operations that fail transiently, 1 disables retries",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        choices=IMPORT_ENGINES,
+        default=None,
+        help="How branches are imported, overrides import_engine in the config",
+    )
+    parser.add_argument(
+        "--git-backend",
+        type=str,
+        choices=GIT_BACKENDS,
+        default=None,
+        help="How ref and object operations run, overrides git_backend in the config",
+    )
+    parser.add_argument(
+        "--staging",
+        action="store_true",
+        help="Build each domain in its own staging repository with a process pool and merge them in one commit",
+    )
+    parser.add_argument(
+        "--staging-workers",
+        type=int,
+        default=None,
+        help="Number of staging worker processes, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--alternates",
+        action="store_true",
+        help="Borrow objects from the mirror cache through alternates while importing",
+    )
+    parser.add_argument(
+        "--no-dissociate",
+        action="store_true",
+        help="Keep depending on the mirror cache after an --alternates run instead of repacking",
+    )
+    parser.add_argument(
+        "--finalize",
+        action="store_true",
+        help="Repack the output repository and write its commit-graph, multi-pack-index and bitmaps",
+    )
+    parser.add_argument(
+        "--measure",
+        action="store_true",
+        help="Time a full git log and a clone of the output repository before and after finalizing",
+    )
+    parser.add_argument(
+        "--analyze",
+        action="store_true",
+        help="Report the unpacked size and the largest files of every imported branch",
+    )
+    parser.add_argument(
+        "--dedupe",
+        action="store_true",
+        help="Fetch branches pointing at the same commit once and reuse the commit for every prefix",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue a previous run in output_dir, skipping the imports recorded in its state file",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        help="Only import the i-th of N deterministic slices of the repos and write it as a bundle, e.g. 2/4",
+    )
+    parser.add_argument(
+        "--bundle",
+        type=str,
+        default=None,
+        help="Where a --shard run writes its bundle, defaults to next to output_dir",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the import plan with estimated times without touching output_dir",
+    )
+    parser.add_argument(
+        "--trace-file",
+        type=str,
+        default=None,
+        help="Write a Chrome/Perfetto trace of every git command to this file",
+    )
+    args = parser.parse_args(argv)
+    if args.dry_run and args.command != "merge":
+        parser.error(f"--dry-run plans a merge and cannot be combined with {args.command}")
+    return args
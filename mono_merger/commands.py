@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import os
+from typing import List
+
+import aiofiles.os
+
+from mono_merger.config import (
+    AppConfig,
+    load_config_async,
+    apply_cli_overrides,
+    logger,
+)
+from mono_merger.merge_repos import RepoMerger, get_bundle_path
+from mono_merger.async_git import AsyncGitRepo
+from mono_merger.log_pipeline import LogPipeline
+from mono_merger.planner import format_plan
+from mono_merger.tracing import tracer
+from mono_merger.verify import FAILED_STATUSES, format_report
+
+
+async def get_planning_repo(async_git_svc: AsyncGitRepo) -> AsyncGitRepo:
+    """The output repo, or the working directory while the output directory does not exist"""
+    if await aiofiles.os.path.isdir(async_git_svc.repo_path):
+        return async_git_svc
+    # ls-remote runs in any directory, and there is no earlier run to read state from
+    return AsyncGitRepo(os.getcwd())
+
+
+async def main(config: AppConfig, async_git_svc: AsyncGitRepo) -> None:
+    logger.info("Starting mono-merger workflow")
+    logger.info("Output directory: %s", str(config.output_dir))
+    logger.info("Processing %s repositories", len(config.repos))
+
+    # planning checks the prefixes, so conflicts are reported before anything is written,
+    # the output directory included
+    logger.info("Planning imports")
+    mono_merger = RepoMerger(config, async_git_svc)
+    planning_git = await get_planning_repo(async_git_svc)
+    planner = mono_merger if planning_git is async_git_svc else RepoMerger(config, planning_git)
+    units = await planner.plan_units()
+    await aiofiles.os.makedirs(config.output_dir, exist_ok=True)
+
+    logger.info("Preparing mono repository")
+    await mono_merger.prepare_mono_repo(shared_root=config.shard_count > 1)
+
+    logger.info("Starting repository branch cloning")
+    await mono_merger.clone_repo_branches(units)
+
+    if config.shard_count > 1:
+        await mono_merger.export_bundle(get_bundle_path(config))
+
+    logger.info("Mono-merger workflow completed successfully")
+
+
+async def sync(config: AppConfig, async_git_svc: AsyncGitRepo) -> None:
+    logger.info("Starting mono-merger sync")
+    logger.info("Output directory: %s", str(config.output_dir))
+
+    mono_merger = RepoMerger(config, async_git_svc)
+    await mono_merger.sync_repo_branches()
+
+    logger.info("Mono-merger sync completed successfully")
+
+
+async def assemble(config: AppConfig, async_git_svc: AsyncGitRepo, bundles: List[str]) -> None:
+    logger.info("Assembling %s shard bundles into %s", len(bundles), str(config.output_dir))
+
+    mono_merger = RepoMerger(config, async_git_svc)
+    await mono_merger.prepare_mono_repo(shared_root=True)
+    await mono_merger.assemble_bundles(bundles)
+
+    logger.info("Mono-merger assemble completed successfully")
+
+
+async def verify(config: AppConfig, async_git_svc: AsyncGitRepo) -> None:
+    logger.info("Verifying %s against the upstream branches", str(config.output_dir))
+
+    mono_merger = RepoMerger(config, async_git_svc)
+    checks = await mono_merger.verify_repo_branches()
+    print(format_report(checks))
+
+    failed = [check for check in checks if check.status in FAILED_STATUSES]
+    if failed:
+        raise Exception(f"{len(failed)} of {len(checks)} prefixes do not match their upstream branch")
+    logger.info("Mono-merger verify completed successfully")
+
+
+async def dry_run(config: AppConfig, async_git_svc: AsyncGitRepo) -> None:
+    logger.info("Planning mono-merger run without touching %s", str(config.output_dir))
+
+    mono_merger = RepoMerger(config, await get_planning_repo(async_git_svc))
+    estimates = await mono_merger.plan_run()
+    print(format_plan(estimates, config.concurrency.max_workers))
+
+
+async def report_run(config: AppConfig) -> None:
+    tracer.log_summary()
+    if config.trace_file:
+        await tracer.write_chrome_trace(config.trace_file)
+
+
+async def bootstrap(args: argparse.Namespace) -> None:
+    try:
+        logger.info("Starting mono-merger application")
+        logger.info("Loading configuration from: %s", args.config)
+
+        config: AppConfig = apply_cli_overrides(
+            await load_config_async(args.config), args
+        )
+        logger.info("Configuration loaded successfully")
+
+        async_git: AsyncGitRepo = AsyncGitRepo(config.output_dir, backend=config.git_backend)
+        log_pipeline = LogPipeline(config.log).start()
+        try:
+            command = getattr(args, "command", "merge")
+            if command == "sync":
+                await sync(config, async_git)
+            elif command == "verify":
+                await verify(config, async_git)
+            elif command == "assemble":
+                await assemble(config, async_git, getattr(args, "bundles", []))
+            elif config.dry_run:
+                await dry_run(config, async_git)
+            else:
+                await main(config, async_git)
+        finally:
+            await async_git.close()
+            await report_run(config)
+            log_pipeline.stop()
+
+    except Exception as e:
+        logger.exception("Application failed with error: %s", e)
+        raise
+
+
+def run(args: argparse.Namespace) -> None:
+    asyncio.run(bootstrap(args))
@@ -1,38 +1,270 @@
-from dataclasses import dataclass
-from typing import List, Dict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Dict, Optional, Set
 import argparse
 import asyncio
+import glob
 import logging
-import yaml
+import os
+import re
+import sys
 import aiofiles
+import yaml
 from pybiztools.logger import setup_logger
 
+from mono_merger.cli import GIT_BACKENDS, IMPORT_ENGINES
+
 logger = setup_logger("mono-merger", logging.INFO)
 
+# Top-level keys an included manifest file may set
+INCLUDABLE_KEYS = ("repos", "domain_mapping", "include")
+BUDGET_ACTIONS = ("warn", "fail")
+SIZE_UNITS = {"": 1, "k": 1024, "m": 1024**2, "g": 1024**3}
+SIZE_PATTERN = re.compile(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?\s*", re.IGNORECASE)
+
+
+def parse_size(value) -> int:
+    """Reads a size in bytes, or with a K, M or G unit such as `512K`, `50MB` or `1GiB`"""
+    match = SIZE_PATTERN.fullmatch(str(value))
+    if match is None:
+        raise ValueError(f"Invalid size {value!r}, expected bytes or a number with a K, M or G unit")
+    return int(float(match[1]) * SIZE_UNITS[match[2].lower()])
+
+
+def parse_history_options(data: dict) -> dict:
+    """Reads the options bounding how much history is fetched for a repo or branch"""
+    options = {}
+    if data.get("depth") is not None:
+        depth = int(data["depth"])
+        if depth < 1:
+            raise ValueError(f"depth must be a positive number of commits, got {depth}")
+        options["depth"] = depth
+    if data.get("shallow_since") is not None:
+        # YAML reads unquoted dates as date objects
+        options["shallow_since"] = str(data["shallow_since"])
+    if data.get("filter") is not None:
+        options["filter"] = str(data["filter"])
+    return options
+
+
+def parse_size_options(data: dict) -> dict:
+    """Reads the size budget and blob size limit of a repo or branch"""
+    return {
+        name: parse_size(data[name])
+        for name in ("size_budget", "max_blob_size")
+        if data.get(name) is not None
+    }
 
-@dataclass
-class BranchConfig:
-    """Represents a git branch with its associated domain"""
+
+@dataclass(slots=True)
+class BranchConfig:  # pylint: disable=too-many-instance-attributes
+    """Represents a git branch with its associated domain.
+
+    The name can also select several branches: `all`, a glob such as `release/*`
+    or a regular expression prefixed with `re:`, minus the `exclude` patterns.
+    `include_paths` and `exclude_paths` filter the imported files, like `max_blob_size`.
+    """
+
+    # one field per key of a branch entry in the config file
 
     name: str
     domain: str
+    exclude: List[str] = field(default_factory=list)
+    include_paths: List[str] = field(default_factory=list)
+    exclude_paths: List[str] = field(default_factory=list)
+    depth: Optional[int] = None
+    shallow_since: Optional[str] = None
+    filter: Optional[str] = None
+    size_budget: Optional[int] = None
+    max_blob_size: Optional[int] = None
 
 
-@dataclass
+@dataclass(slots=True)
 class RepoConfig:
     """Represents a GitHub repository with its URL and branches"""
 
     url: str
     branches: List[BranchConfig]
+    depth: Optional[int] = None
+    shallow_since: Optional[str] = None
+    filter: Optional[str] = None
+    size_budget: Optional[int] = None
+    max_blob_size: Optional[int] = None
+
+
+@dataclass
+class ConcurrencyConfig:
+    """Limits for the number of git operations running at the same time"""
+
+    max_workers: int = 8
+    per_host: int = 4
+    hosts: Dict[str, int] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ConcurrencyConfig":
+        """Creates a ConcurrencyConfig from the optional `concurrency` section"""
+        return cls(
+            max_workers=int(data.get("max_workers", cls.max_workers)),
+            per_host=int(data.get("per_host", cls.per_host)),
+            hosts={host: int(limit) for host, limit in data.get("hosts", {}).items()},
+        )
+
+
+@dataclass
+class RetryConfig:
+    """Retries of transient remote failures and adaptive per-host concurrency"""
+
+    attempts: int = 4
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    adaptive: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RetryConfig":
+        """Creates a RetryConfig from the optional `retry` section"""
+        return cls(
+            attempts=max(1, int(data.get("attempts", cls.attempts))),
+            base_delay=float(data.get("base_delay", cls.base_delay)),
+            max_delay=float(data.get("max_delay", cls.max_delay)),
+            adaptive=bool(data.get("adaptive", cls.adaptive)),
+        )
+
+
+@dataclass
+class LogConfig:
+    """Settings for keeping logging off the event loop and bounding its volume"""
+
+    queued: bool = True
+    max_message: int = 4096
+    budget: int = 64 * 1024 * 1024
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "LogConfig":
+        """Creates a LogConfig from the optional `log` section"""
+        return cls(
+            queued=bool(data.get("queued", cls.queued)),
+            max_message=max(0, int(data.get("max_message", cls.max_message))),
+            budget=max(0, int(data.get("budget", cls.budget))),
+        )
+
+
+@dataclass
+class AnalysisConfig:
+    """Settings for reporting the size of every import and enforcing the size budgets"""
+
+    enabled: bool = False
+    top: int = 10
+    on_budget: str = "warn"
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AnalysisConfig":
+        """Creates an AnalysisConfig from the optional `analysis` section"""
+        on_budget = data.get("on_budget", cls.on_budget)
+        if on_budget not in BUDGET_ACTIONS:
+            raise ValueError(f"Unknown on_budget '{on_budget}', expected one of {BUDGET_ACTIONS}")
+        return cls(
+            enabled=bool(data.get("enabled", True)),
+            top=max(1, int(data.get("top", cls.top))),
+            on_budget=on_budget,
+        )
+
+
+@dataclass
+class StagingConfig:
+    """Settings for building groups of branches in parallel staging repositories"""
+
+    enabled: bool = False
+    group_size: int = 0
+    workers: int = 0
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StagingConfig":
+        """Creates a StagingConfig from the optional `staging` section"""
+        return cls(
+            enabled=bool(data.get("enabled", True)),
+            group_size=int(data.get("group_size", cls.group_size)),
+            workers=int(data.get("workers", cls.workers)),
+        )
+
+
+@dataclass
+class AlternatesConfig:
+    """Settings for borrowing objects from the mirror cache instead of copying them"""
+
+    enabled: bool = False
+    dissociate: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AlternatesConfig":
+        """Creates an AlternatesConfig from the optional `alternates` section"""
+        return cls(
+            enabled=bool(data.get("enabled", True)),
+            dissociate=bool(data.get("dissociate", cls.dissociate)),
+        )
+
+
+@dataclass
+class FinalizeConfig:  # pylint: disable=too-many-instance-attributes
+    """Settings for optimizing the output repository once every branch is imported"""
+
+    # one field per key of the `finalize` section
+
+    enabled: bool = False
+    window: Optional[int] = None
+    depth: Optional[int] = None
+    threads: Optional[int] = None
+    aggressive: bool = False
+    prune: bool = True
+    bitmaps: bool = True
+    commit_graph: bool = True
+    multi_pack_index: bool = True
+    measure: bool = False
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "FinalizeConfig":
+        """Creates a FinalizeConfig from the optional `finalize` section"""
+        return cls(
+            enabled=bool(data.get("enabled", True)),
+            window=data.get("window"),
+            depth=data.get("depth"),
+            threads=data.get("threads"),
+            aggressive=bool(data.get("aggressive", cls.aggressive)),
+            prune=bool(data.get("prune", cls.prune)),
+            bitmaps=bool(data.get("bitmaps", cls.bitmaps)),
+            commit_graph=bool(data.get("commit_graph", cls.commit_graph)),
+            multi_pack_index=bool(data.get("multi_pack_index", cls.multi_pack_index)),
+            measure=bool(data.get("measure", cls.measure)),
+        )
 
 
 @dataclass
-class AppConfig:
+class AppConfig:  # pylint: disable=too-many-instance-attributes
     """Configuration class for the YAML config file"""
 
+    # one field per top-level key of the config file or run option, grouped options
+    # already live in their own config classes
+
     repos: List[RepoConfig]
     domain_mapping: Dict[str, str]
     output_dir: str
+    cache_dir: Optional[str] = None
+    discovery_ttl: int = 600
+    concurrency: ConcurrencyConfig = field(default_factory=ConcurrencyConfig)
+    retry: RetryConfig = field(default_factory=RetryConfig)
+    log: LogConfig = field(default_factory=LogConfig)
+    import_engine: str = "subtree"
+    git_backend: str = "subprocess"
+    staging: StagingConfig = field(default_factory=StagingConfig)
+    alternates: AlternatesConfig = field(default_factory=AlternatesConfig)
+    finalize: FinalizeConfig = field(default_factory=FinalizeConfig)
+    analysis: AnalysisConfig = field(default_factory=AnalysisConfig)
+    dedupe: bool = False
+    resume: bool = False
+    dry_run: bool = False
+    shard_index: int = 1
+    shard_count: int = 1
+    bundle_file: Optional[str] = None
+    trace_file: Optional[str] = None
 
     @classmethod
     def from_dict(cls, data: dict) -> "AppConfig":
@@ -43,18 +275,66 @@ class AppConfig:
             repos = []
             for repo_data in data["repos"]:
                 branches = [
-                    BranchConfig(name=branch["name"], domain=branch["domain"])
+                    BranchConfig(
+                        name=branch["name"],
+                        # manifests repeat a handful of domains across thousands of branches
+                        domain=sys.intern(branch["domain"]),
+                        exclude=list(branch.get("exclude", [])),
+                        include_paths=list(branch.get("include_paths", [])),
+                        exclude_paths=list(branch.get("exclude_paths", [])),
+                        **parse_history_options(branch),
+                        **parse_size_options(branch),
+                    )
                     for branch in repo_data["branches"]
                 ]
-                repos.append(RepoConfig(url=repo_data["url"], branches=branches))
-                logger.debug(
-                    "Processed repo: %s with %s branches", repo_data['url'], len(branches)
+                repos.append(
+                    RepoConfig(
+                        url=repo_data["url"],
+                        branches=branches,
+                        **parse_history_options(repo_data),
+                        **parse_size_options(repo_data),
+                    )
+                )
+
+            import_engine = data.get("import_engine", "subtree")
+            if import_engine not in IMPORT_ENGINES:
+                raise ValueError(
+                    f"Unknown import_engine '{import_engine}', expected one of {IMPORT_ENGINES}"
+                )
+            git_backend = data.get("git_backend", "subprocess")
+            if git_backend not in GIT_BACKENDS:
+                raise ValueError(
+                    f"Unknown git_backend '{git_backend}', expected one of {GIT_BACKENDS}"
                 )
 
             config = cls(
                 repos=repos,
                 domain_mapping=data["domain_mapping"],
                 output_dir=data["output_dir"],
+                cache_dir=data.get("cache_dir"),
+                discovery_ttl=int(data.get("discovery_ttl", cls.discovery_ttl)),
+                concurrency=ConcurrencyConfig.from_dict(data.get("concurrency") or {}),
+                retry=RetryConfig.from_dict(data.get("retry") or {}),
+                log=LogConfig.from_dict(data.get("log") or {}),
+                import_engine=import_engine,
+                git_backend=git_backend,
+                staging=StagingConfig.from_dict(data["staging"]) if data.get("staging") else StagingConfig(),
+                alternates=(
+                    AlternatesConfig.from_dict(data["alternates"])
+                    if data.get("alternates")
+                    else AlternatesConfig()
+                ),
+                finalize=(
+                    FinalizeConfig.from_dict(data["finalize"])
+                    if data.get("finalize")
+                    else FinalizeConfig()
+                ),
+                analysis=(
+                    AnalysisConfig.from_dict(data["analysis"])
+                    if data.get("analysis")
+                    else AnalysisConfig()
+                ),
+                dedupe=bool(data.get("dedupe", cls.dedupe)),
             )
 
             logger.info(
@@ -70,24 +350,92 @@ class AppConfig:
             raise
 
 
+def get_yaml_loader():
+    """The libyaml based safe loader when PyYAML was built with it, the pure Python one otherwise"""
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def is_local_source(url: str) -> bool:
+    """Tells a local directory or bundle file from a URL, scp-like `host:path` remotes included"""
+    url = url.strip()
+    return "://" not in url and ":" not in url.split("/", 1)[0]
+
+
+def resolve_local_sources(repos: List[dict], base_dir: Path) -> None:
+    """Makes relative local sources absolute, git runs them from inside output_dir"""
+    for repo in repos:
+        url = repo.get("url") if isinstance(repo, dict) else None
+        if isinstance(url, str) and is_local_source(url):
+            repo["url"] = os.path.normpath(os.path.join(base_dir, os.path.expanduser(url.strip())))
+
+
+def merge_manifests(base: dict, parts: List[dict]) -> dict:
+    """Appends the repos of included manifests and merges their domain mappings into `base`"""
+    merged = dict(base)
+    merged["repos"] = list(base.get("repos") or [])
+    merged["domain_mapping"] = dict(base.get("domain_mapping") or {})
+    for part in parts:
+        merged["repos"].extend(part.get("repos") or [])
+        for domain, path in (part.get("domain_mapping") or {}).items():
+            if merged["domain_mapping"].setdefault(domain, path) != path:
+                raise ValueError(
+                    f"Domain '{domain}' is mapped to both '{merged['domain_mapping'][domain]}' and '{path}'"
+                )
+    return merged
+
+
+async def load_manifest(path: Path, seen: Optional[Set[Path]] = None, included: bool = False) -> dict:
+    """Reads a YAML manifest and, concurrently, the files it includes, merged into one dictionary.
+
+    `include` lists files or globs relative to the including file. They may only set
+    `repos`, `domain_mapping` and further includes. Relative local sources are
+    relative to the file listing them as well.
+    """
+    path = Path(path).resolve()
+    seen = set() if seen is None else seen
+    if path in seen:
+        raise ValueError(f"Configuration file {path} is included more than once")
+    seen.add(path)
+
+    async with aiofiles.open(path, "r", encoding="utf-8") as file:
+        content = await file.read()
+    raw = await asyncio.to_thread(yaml.load, content, Loader=get_yaml_loader()) or {}
+    if included and set(raw) - set(INCLUDABLE_KEYS):
+        raise ValueError(
+            f"Included file {path} may only set {', '.join(INCLUDABLE_KEYS)}, "
+            f"found {', '.join(sorted(set(raw) - set(INCLUDABLE_KEYS)))}"
+        )
+
+    resolve_local_sources(raw.get("repos") or [], path.parent)
+
+    includes = raw.pop("include", None) or []
+    if isinstance(includes, str):
+        includes = [includes]
+    paths = []
+    for pattern in includes:
+        pattern = str(path.parent / pattern)
+        # a pattern without matches is opened as is, so it fails like a missing file
+        matches = sorted(glob.glob(pattern)) or [pattern]
+        paths.extend(Path(match) for match in matches)
+
+    parts = await asyncio.gather(*(load_manifest(part, seen, included=True) for part in paths))
+    return merge_manifests(raw, parts) if parts else raw
+
+
 async def load_config_async(path: str) -> AppConfig:
-    """Load and parse configuration from a YAML file"""
+    """Load and parse configuration from a YAML file and the files it includes"""
     logger.info("Loading configuration from: %s", path)
 
     try:
-        async with aiofiles.open(path, "r", encoding="utf-8") as file:
-            content = await file.read()
-        logger.debug("Successfully read %s characters from config file", len(content))
-
-        raw = await asyncio.to_thread(yaml.safe_load, content)
+        raw = await load_manifest(Path(path))
         logger.debug("YAML parsing completed successfully")
 
         config = AppConfig.from_dict(raw)
         logger.info("Configuration loaded and validated successfully")
         return config
 
-    except FileNotFoundError:
-        logger.error("Configuration file not found: %s", path)
+    except FileNotFoundError as e:
+        logger.error("Configuration file not found: %s", e.filename or path)
         raise
     except yaml.YAMLError as e:
         logger.error("YAML parsing error in %s: %s", path, e)
@@ -97,16 +445,46 @@ async def load_config_async(path: str) -> AppConfig:
         raise
 
 
-def parse_args():
-    parser = argparse.ArgumentParser(
-        description="Consolidate multiple GitHub repos into a single mono-repo"
-    )
-    parser.add_argument(
-        "--config",
-        type=str,
-        required=True,
-        help=(
-            "The full path of the configuration YAML file, please see the sample config in the README for an example."
-        ),
-    )
-    return parser.parse_args()
+def apply_cli_overrides(config: AppConfig, args: argparse.Namespace) -> AppConfig:
+    """Applies command line options on top of the values loaded from the YAML file"""
+    if getattr(args, "cache_dir", None):
+        config.cache_dir = args.cache_dir
+    if getattr(args, "discovery_ttl", None) is not None:
+        config.discovery_ttl = args.discovery_ttl
+    if getattr(args, "max_workers", None):
+        config.concurrency.max_workers = args.max_workers
+    if getattr(args, "per_host_limit", None):
+        config.concurrency.per_host = args.per_host_limit
+    if getattr(args, "retries", None):
+        config.retry.attempts = max(1, args.retries)
+    if getattr(args, "engine", None):
+        config.import_engine = args.engine
+    if getattr(args, "git_backend", None):
+        config.git_backend = args.git_backend
+    if getattr(args, "staging", False):
+        config.staging.enabled = True
+    if getattr(args, "staging_workers", None):
+        config.staging.workers = args.staging_workers
+    if getattr(args, "alternates", False):
+        config.alternates.enabled = True
+    if getattr(args, "no_dissociate", False):
+        config.alternates.dissociate = False
+    if getattr(args, "finalize", False):
+        config.finalize.enabled = True
+    if getattr(args, "measure", False):
+        config.finalize.measure = True
+    if getattr(args, "analyze", False):
+        config.analysis.enabled = True
+    if getattr(args, "dedupe", False):
+        config.dedupe = True
+    if getattr(args, "resume", False):
+        config.resume = True
+    if getattr(args, "dry_run", False):
+        config.dry_run = True
+    if getattr(args, "shard", None):
+        config.shard_index, config.shard_count = args.shard
+    if getattr(args, "bundle", None):
+        config.bundle_file = args.bundle
+    if getattr(args, "trace_file", None):
+        config.trace_file = args.trace_file
+    return config
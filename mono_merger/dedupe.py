@@ -0,0 +1,81 @@
+import asyncio
+from collections.abc import Hashable
+from typing import Awaitable, Callable, Dict, Iterable, Set, Tuple
+
+from mono_merger.config import logger
+
+
+class TipIndex:
+    """Shares the fetch of a branch tip between every unit whose branch points at it.
+
+    Forks and long-lived branches often sit on the same commit as another branch, the
+    first unit of a tip fetches it and the others only point their import ref at the
+    commit it brought in.
+    """
+
+    def __init__(self):
+        self._leaders: Dict[Hashable, asyncio.Future] = {}
+        self.fetched_urls: Set[str] = set()
+        self.shared_urls: Set[str] = set()
+        self.fetches = 0
+        self.skipped = 0
+
+    @staticmethod
+    def summarize(keys: Iterable[Hashable]) -> Tuple[int, int]:
+        """Logs and returns how many units have a known tip and how many distinct tips they have"""
+        keys = [key for key in keys if key[0]]
+        unique = len(set(keys))
+        logger.info(
+            "%s branches point at %s distinct tips, %s fetches can be skipped",
+            len(keys),
+            unique,
+            len(keys) - unique,
+        )
+        return len(keys), unique
+
+    async def fetch(self, key: Hashable, url: str, fetch: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """Fetches a tip once per key and returns the commit and whether it was shared.
+
+        The key starts with the expected tip commit, an empty one is never shared. When
+        the leader brings in another commit, because the branch moved since it was listed,
+        or fails, the waiting units fetch on their own.
+        """
+        if not key[0]:
+            return await self._fetch(url, fetch), False
+
+        leader = self._leaders.get(key)
+        if leader is None:
+            leader = asyncio.get_running_loop().create_future()
+            self._leaders[key] = leader
+            try:
+                commit = await self._fetch(url, fetch)
+            except BaseException:
+                # the next unit of this tip gets to try again
+                del self._leaders[key]
+                leader.set_result("")
+                raise
+            leader.set_result(commit)
+            return commit, False
+
+        commit = await leader
+        if commit != key[0]:
+            return await self._fetch(url, fetch), False
+        self.skipped += 1
+        self.shared_urls.add(url)
+        return commit, True
+
+    async def _fetch(self, url: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        commit = await fetch()
+        self.fetches += 1
+        self.fetched_urls.add(url)
+        return commit
+
+    def log_stats(self, mirrored: bool) -> None:
+        """Reports the fetch, and with a mirror cache the mirror, work shared between units"""
+        skipped_mirrors = len(self.shared_urls - self.fetched_urls) if mirrored else 0
+        logger.info(
+            "Tip dedupe stats: %s fetches, %s skipped, %s mirror updates skipped",
+            self.fetches,
+            self.skipped,
+            skipped_mirrors,
+        )
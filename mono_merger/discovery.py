@@ -0,0 +1,102 @@
+import asyncio
+import fnmatch
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import aiofiles
+import aiofiles.os
+
+from mono_merger.config import BranchConfig, is_local_source, logger
+from mono_merger.async_git import AsyncGitRepo
+
+REGEX_PREFIX = "re:"
+
+
+def is_branch_pattern(name: str) -> bool:
+    """Checks whether a configured branch name selects several branches"""
+    return name == "all" or name.startswith(REGEX_PREFIX) or any(char in name for char in "*?[")
+
+
+def branch_matches(pattern: str, name: str) -> bool:
+    """Matches a branch name against `all`, a glob, or a `re:` regular expression"""
+    if pattern == "all":
+        return True
+    if pattern.startswith(REGEX_PREFIX):
+        return re.fullmatch(pattern[len(REGEX_PREFIX):], name) is not None
+    return fnmatch.fnmatchcase(name, pattern)
+
+
+def select_branches(selector: BranchConfig, names: Iterable[str]) -> List[str]:
+    """Returns the branch names picked by a selector, minus its exclude patterns"""
+    return [
+        name
+        for name in names
+        if branch_matches(selector.name, name)
+        and not any(branch_matches(exclude, name) for exclude in selector.exclude)
+    ]
+
+
+class BranchDiscovery:
+    """Lists remote branches with ls-remote, caching the results on disk for a TTL"""
+
+    def __init__(self, mono_repo: AsyncGitRepo, cache_dir: Optional[str] = None, ttl: int = 0):
+        self.mono_repo = mono_repo
+        self.cache_path = Path(cache_dir) / "ls-remote.json" if cache_dir else None
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[str, dict] = {}
+
+    async def load(self) -> None:
+        """Reads the cached listings, ignoring a missing or unreadable cache"""
+        if self.cache_path is None or not await aiofiles.os.path.isfile(self.cache_path):
+            return
+        try:
+            async with aiofiles.open(self.cache_path, "r", encoding="utf-8") as file:
+                self._entries = json.loads(await file.read())
+            logger.debug("Loaded %s cached branch listings", len(self._entries))
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable discovery cache %s: %s", self.cache_path, e)
+            self._entries = {}
+
+    async def list_heads(self, url: str, use_cache: bool = True) -> Dict[str, str]:
+        """Returns branch -> head SHA for a repo, from the cache while it is fresh.
+
+        Local directories and bundles are cheap to list and may be replaced between
+        runs, they are always read directly.
+        """
+        entry = self._entries.get(url)
+        if (
+            use_cache
+            and self.ttl > 0
+            and entry
+            and time.time() - entry["fetched_at"] < self.ttl
+            and not is_local_source(url)
+        ):
+            self.hits += 1
+            return dict(entry["heads"])
+
+        self.misses += 1
+        heads = await self.mono_repo.list_branches(url)
+        self._entries[url] = {"fetched_at": time.time(), "heads": heads}
+        return heads
+
+    def known_heads(self, url: str) -> Optional[Dict[str, str]]:
+        """Returns the last listing of a repo, fresh or not, without going remote"""
+        entry = self._entries.get(url)
+        return dict(entry["heads"]) if entry else None
+
+    async def save(self) -> None:
+        """Atomically writes the listings back to the cache"""
+        logger.info("Branch discovery: %s cached, %s listed remotely", self.hits, self.misses)
+        if self.cache_path is None:
+            return
+        await aiofiles.os.makedirs(self.cache_path.parent, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".tmp")
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as file:
+            await file.write(json.dumps(self._entries))
+        await asyncio.to_thread(os.replace, tmp_path, self.cache_path)
@@ -0,0 +1,181 @@
+import asyncio
+import fnmatch
+import os
+from pathlib import Path
+from typing import AsyncIterator, Collection, List, Sequence
+
+import aiofiles
+import aiofiles.os
+
+DATA_CHUNK_SIZE = 64 * 1024
+
+# C-style escapes used by git when it quotes a path
+UNESCAPES = {
+    ord("a"): b"\a",
+    ord("b"): b"\b",
+    ord("t"): b"\t",
+    ord("n"): b"\n",
+    ord("v"): b"\v",
+    ord("f"): b"\f",
+    ord("r"): b"\r",
+    ord('"'): b'"',
+    ord("\\"): b"\\",
+}
+ESCAPES = {value[0]: b"\\" + bytes([key]) for key, value in UNESCAPES.items()}
+
+
+def unquote_path(raw: bytes) -> bytes:
+    """Decodes a path as written by fast-export, unquoting C-style quoted paths"""
+    if not raw.startswith(b'"'):
+        return raw
+
+    path = bytearray()
+    idx = 1
+    while idx < len(raw) - 1:
+        char = raw[idx]
+        if char != ord("\\"):
+            path.append(char)
+            idx += 1
+        elif raw[idx + 1] in UNESCAPES:
+            path += UNESCAPES[raw[idx + 1]]
+            idx += 2
+        else:
+            path.append(int(raw[idx + 1:idx + 4], 8))
+            idx += 4
+    return bytes(path)
+
+
+def quote_path(path: bytes) -> bytes:
+    """Encodes a path for fast-import, quoting it only when it has to be"""
+    if not path.startswith(b'"') and not any(char < 0x20 for char in path):
+        return path
+
+    quoted = bytearray(b'"')
+    for char in path:
+        if char in ESCAPES:
+            quoted += ESCAPES[char]
+        elif char < 0x20 or char == 0x7F:
+            quoted += b"\\%03o" % char
+        else:
+            quoted.append(char)
+    return bytes(quoted + b'"')
+
+
+def path_matches(pattern: str, path: str) -> bool:
+    """Matches a path against a glob, a pattern naming a directory matches all below it"""
+    directory = pattern.rstrip("/")
+    return fnmatch.fnmatchcase(path, pattern) or path.startswith(directory + "/")
+
+
+def path_selected(path: str, include: Sequence[str], exclude: Sequence[str]) -> bool:
+    """Checks whether a path passes the include and exclude filters of a branch"""
+    if include and not any(path_matches(pattern, path) for pattern in include):
+        return False
+    return not any(path_matches(pattern, path) for pattern in exclude)
+
+
+async def rewrite_fast_export(
+    stream: asyncio.StreamReader,
+    prefix: str,
+    ref: str,
+    *,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    drop_blobs: Collection[str] = (),
+) -> AsyncIterator[bytes]:
+    """Rewrites a `fast-export --no-data` stream so every path lives under a prefix.
+
+    Commits are redirected to `ref` and file changes outside the include and exclude
+    filters, or adding one of the `drop_blobs`, are dropped. Commit messages are
+    copied through in bounded chunks, so the memory used does not depend on the size
+    of the history. fast-export is expected to run without rename or copy detection,
+    so only M, D and deleteall changes occur.
+    """
+    prefix_bytes = prefix.encode() + b"/"
+    ref_bytes = ref.encode()
+    drop = {sha.encode() for sha in drop_blobs}
+
+    def rewrite(raw_path: bytes):
+        path = unquote_path(raw_path)
+        if not path_selected(path.decode(errors="surrogateescape"), include, exclude):
+            return None
+        return quote_path(prefix_bytes + path)
+
+    while line := await stream.readline():
+        if line.startswith(b"data "):
+            yield line
+            remaining = int(line[5:])
+            while remaining:
+                chunk = await stream.readexactly(min(remaining, DATA_CHUNK_SIZE))
+                remaining -= len(chunk)
+                yield chunk
+        elif line.startswith(b"M "):
+            mode, dataref, raw_path = line[2:].rstrip(b"\n").split(b" ", 2)
+            path = rewrite(raw_path)
+            if path is not None and dataref not in drop:
+                yield b"M %s %s %s\n" % (mode, dataref, path)
+        elif line.startswith(b"D "):
+            path = rewrite(line[2:].rstrip(b"\n"))
+            if path is not None:
+                yield b"D %s\n" % path
+        elif line.startswith((b"commit ", b"reset ")):
+            yield line.split(b" ", 1)[0] + b" " + ref_bytes + b"\n"
+        elif line.startswith((b"C ", b"R ")):
+            raise Exception(f"Unexpected copy or rename in fast-export stream: {line!r}")
+        else:
+            yield line
+
+
+class HistoryMarks:
+    """Mark files that make the history rewrite of a prefix incremental.
+
+    fast-export numbers the source commits it exports and fast-import records the
+    rewritten commit of every number. Loading both files in the next rewrite exports
+    only the source commits that are new, and parents their rewrites on the commits
+    rewritten before. The `settings` of the rewrite, such as its path filters, are
+    stored alongside, marks written with other settings are not loaded.
+    """
+
+    def __init__(self, directory: Path, settings: str):
+        self.directory = Path(directory)
+        self.settings = settings
+        self.source = self.directory / "source.marks"
+        self.rewritten = self.directory / "rewritten.marks"
+        self.settings_file = self.directory / "settings"
+        self.incremental = False
+
+    async def load(self) -> bool:
+        """Prepares the directory for a rewrite and tells whether earlier marks apply to it"""
+        await aiofiles.os.makedirs(self.directory, exist_ok=True)
+        self.incremental = False
+        for path in (self.source, self.rewritten, self.settings_file):
+            if not await aiofiles.os.path.isfile(path):
+                return False
+        async with aiofiles.open(self.settings_file, "r", encoding="utf-8") as file:
+            self.incremental = await file.read() == self.settings
+        return self.incremental
+
+    def fast_export_args(self, incremental: bool) -> List[str]:
+        """Options of fast-export, writing the marks next to the ones in use until `save`"""
+        args = [f"--export-marks={self.source}.new"]
+        return [f"--import-marks={self.source}", *args] if incremental else args
+
+    def fast_import_args(self, incremental: bool) -> List[str]:
+        """Options of fast-import, writing the marks next to the ones in use until `save`"""
+        args = [f"--export-marks={self.rewritten}.new"]
+        return [f"--import-marks={self.rewritten}", *args] if incremental else args
+
+    async def save(self) -> None:
+        """Replaces the marks in use with the ones of the last rewrite, once its commits are kept"""
+        async with aiofiles.open(self.settings_file, "w", encoding="utf-8") as file:
+            await file.write(self.settings)
+        for path in (self.source, self.rewritten):
+            await asyncio.to_thread(os.replace, f"{path}.new", path)
+
+    async def clear(self) -> None:
+        """Forgets the marks, so the next rewrite exports the whole history again"""
+        for path in (self.source, self.rewritten, self.settings_file):
+            try:
+                await aiofiles.os.remove(path)
+            except FileNotFoundError:
+                pass
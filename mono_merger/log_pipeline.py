@@ -0,0 +1,89 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Optional
+
+from mono_merger.config import LogConfig, logger
+
+
+def truncate_message(message: str, limit: int) -> str:
+    """Shortens a message to about `limit` characters, keeping its head and its tail"""
+    if not limit or len(message) <= limit:
+        return message
+    keep = limit // 2
+    return f"{message[:keep]} ... [{len(message) - 2 * keep} characters omitted] ... {message[-keep:]}"
+
+
+# logging.Filter subclasses implement filter alone, the counters are read as attributes
+class LogVolumeFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """Truncates long messages and drops records below WARNING once a run logged `budget` bytes"""
+
+    def __init__(self, max_message: int, budget: int):
+        super().__init__()
+        self.max_message = max_message
+        self.budget = budget
+        self.logged = 0
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.budget and self.logged >= self.budget and record.levelno < logging.WARNING:
+            self.dropped += 1
+            return False
+
+        message = record.getMessage()
+        if self.max_message and len(message) > self.max_message:
+            record.msg, record.args = truncate_message(message, self.max_message), None
+            message = record.msg
+        self.logged += len(message)
+        if self.budget and self.logged >= self.budget and self.dropped == 0:
+            record.msg, record.args = f"{message} (log budget reached, dropping records below WARNING)", None
+        return True
+
+
+class LogPipeline:
+    """Moves the handlers of the mono-merger logger onto a background thread.
+
+    Records are put on an unbounded queue by the logging call and written out by a
+    QueueListener, so a slow disk or rotating file handler never blocks the event loop.
+    """
+
+    def __init__(self, settings: LogConfig, target: logging.Logger = logger):
+        self.settings = settings
+        self.target = target
+        self.filter = LogVolumeFilter(settings.max_message, settings.budget)
+        self.listener: Optional[QueueListener] = None
+        self._handlers: List[logging.Handler] = []
+        self._queue_handler: Optional[QueueHandler] = None
+
+    def start(self) -> "LogPipeline":
+        """Installs the volume filter and, when enabled, the queue in front of the handlers"""
+        self.target.addFilter(self.filter)
+        if not self.settings.queued or not self.target.handlers:
+            return self
+
+        self._handlers = list(self.target.handlers)
+        self._queue_handler = QueueHandler(queue.SimpleQueue())
+        self.listener = QueueListener(
+            self._queue_handler.queue, *self._handlers, respect_handler_level=True
+        )
+        for handler in self._handlers:
+            self.target.removeHandler(handler)
+        self.target.addHandler(self._queue_handler)
+        self.listener.start()
+        return self
+
+    def stop(self) -> None:
+        """Flushes the queue and puts the original handlers back"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.target.removeHandler(self._queue_handler)
+            for handler in self._handlers:
+                self.target.addHandler(handler)
+            self.listener = None
+        self.target.removeFilter(self.filter)
+        if self.filter.dropped:
+            logger.warning(
+                "Dropped %s log records below WARNING after reaching the log budget of %s bytes",
+                self.filter.dropped,
+                self.settings.budget,
+            )
@@ -1,26 +1,260 @@
+# pylint: disable=too-many-lines
+# RepoMerger drives every engine and command, and the staging workers that build a
+# RepoMerger of their own cannot move to a module it imports
 import asyncio
+import contextlib
+import dataclasses
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
 import aiofiles
 import aiofiles.os
 
-from mono_merger.config import AppConfig, RepoConfig, BranchConfig, logger
-from mono_merger.async_git import AsyncGitRepo
+from mono_merger.config import (
+    AlternatesConfig,
+    AppConfig,
+    BranchConfig,
+    FinalizeConfig,
+    RepoConfig,
+    StagingConfig,
+    is_local_source,
+    logger,
+)
+from mono_merger.async_git import AsyncGitRepo, GitCommandError
+from mono_merger.dedupe import TipIndex
+from mono_merger.mirror_cache import MirrorCache
+from mono_merger.discovery import BranchDiscovery, is_branch_pattern, select_branches
+from mono_merger.history import HistoryMarks, rewrite_fast_export
+from mono_merger.prefixes import find_prefix_conflicts
+from mono_merger.planner import CostPlanner, DurationHistory, UnitEstimate, estimate_makespan
+from mono_merger.log_pipeline import LogPipeline
+from mono_merger.retry import RemoteRetry
+from mono_merger.scheduler import LOCAL_HOST, WorkScheduler
+from mono_merger.sizes import (
+    SizeReport,
+    analyze_blobs,
+    describe_report,
+    format_size,
+    format_size_summary,
+    list_blobs,
+    list_large_blobs,
+    save_size_reports,
+)
+from mono_merger.state import MergeState
+from mono_merger.verify import FAILED_STATUSES, FILTERED, PrefixCheck, classify_prefix
+from mono_merger import tracing
 
+# Seconds the current unit spent waiting for the HEAD lock, left out of its recorded duration
+head_lock_wait: ContextVar[float] = ContextVar("head_lock_wait", default=0.0)
 
-def get_branch_name(ref_str: str) -> str:
-    """Extracts branch name from ref string"""
-    return ref_str.split('refs/heads/')[-1]
+# Fixed identity and dates of the first commit of shard and assembled repos, so every
+# shard is built on the same root commit and the assembled history has a single root
+SHARED_ROOT_ENV = {
+    "GIT_AUTHOR_NAME": "mono-merger",
+    "GIT_AUTHOR_EMAIL": "mono-merger@localhost",
+    "GIT_AUTHOR_DATE": "1970-01-01T00:00:00+0000",
+    "GIT_COMMITTER_NAME": "mono-merger",
+    "GIT_COMMITTER_EMAIL": "mono-merger@localhost",
+    "GIT_COMMITTER_DATE": "1970-01-01T00:00:00+0000",
+    "GIT_CONFIG_COUNT": "1",
+    "GIT_CONFIG_KEY_0": "commit.gpgSign",
+    "GIT_CONFIG_VALUE_0": "false",
+}
 
 
 def get_repo_name(url: str) -> str:
-    """Extracts repository name from repo URL (SSH)"""
-    repo = url.strip().split("/")[-1]
-    return repo.removesuffix(".git")
+    """Extracts repository name from repo URL (SSH), local directory or bundle file"""
+    path = url.strip().rstrip("/")
+    # a clone given by its .git directory is named after the directory holding it
+    path = path.removesuffix("/.git").rstrip("/")
+    repo = path.split("/")[-1]
+    return repo.removesuffix(".git").removesuffix(".bundle")
 
 
-class RepoMerger:
+def get_unit_prefix(domain_mapping: Dict[str, str], url: str, branch: BranchConfig) -> str:
+    """Directory a branch is imported into, below the path its domain is mapped to"""
+    domain_path = domain_mapping.get(branch.domain, branch.domain).strip("/")
+    return f"{domain_path}/{get_repo_name(url)}/{branch.name}"
+
+
+def get_import_ref(prefix: str) -> str:
+    """Private ref a branch is fetched into before it is imported at a prefix"""
+    return f"refs/mono-merger/imports/{prefix}"
+
+
+def get_history_ref(prefix: str) -> str:
+    """Private ref the rewritten history of a branch is imported into"""
+    return f"refs/mono-merger/history/{prefix}"
+
+
+def get_marks_dir(repo_path: Path, prefix: str) -> Path:
+    """Where the history engine keeps the fast-export and fast-import marks of a prefix"""
+    return Path(os.path.abspath(repo_path)) / ".git" / "mono-merger" / "marks" / prefix
+
+
+def get_repo_host(url: str) -> str:
+    """Extracts the remote host from a repo URL (HTTPS or SSH), `local` for paths"""
+    url = url.strip()
+    if "://" in url:
+        netloc = url.split("://", 1)[1].split("/", 1)[0]
+        return netloc.rsplit("@", 1)[-1].split(":")[0] or LOCAL_HOST
+    if ":" in url.split("/", 1)[0]:
+        return url.split(":", 1)[0].rsplit("@", 1)[-1]
+    return LOCAL_HOST
+
+
+def get_fetch_options(repo: RepoConfig, branch: BranchConfig) -> Dict[str, object]:
+    """History options of a branch for `AsyncGitRepo.fetch`, falling back on its repo's"""
+    options = {
+        "depth": branch.depth if branch.depth is not None else repo.depth,
+        "shallow_since": branch.shallow_since if branch.shallow_since is not None else repo.shallow_since,
+        "filter_spec": branch.filter if branch.filter is not None else repo.filter,
+    }
+    return {name: value for name, value in options.items() if value is not None}
+
+
+def get_size_options(repo: RepoConfig, branch: BranchConfig) -> Tuple[Optional[int], Optional[int]]:
+    """Size budget and blob size limit of a branch, falling back on its repo's"""
+    return (
+        branch.size_budget if branch.size_budget is not None else repo.size_budget,
+        branch.max_blob_size if branch.max_blob_size is not None else repo.max_blob_size,
+    )
+
+
+def has_file_filters(unit: "ImportUnit") -> bool:
+    """Checks whether path or size filters may leave files of a branch out of its import"""
+    _, max_blob_size = get_size_options(unit.repo, unit.branch)
+    return bool(unit.branch.include_paths or unit.branch.exclude_paths) or max_blob_size is not None
+
+
+def get_tip_key(unit: "ImportUnit") -> Tuple[str, Tuple[Tuple[str, object], ...]]:
+    """Units with the same tip and history options can share one fetch"""
+    return unit.sha, tuple(sorted(get_fetch_options(unit.repo, unit.branch).items()))
+
+
+def get_shard_repos(repos: List[RepoConfig], index: int, count: int) -> List[RepoConfig]:
+    """Deterministic 1-based slice `index` of `count` of the repos, dealt out by URL"""
+    if count <= 1:
+        return list(repos)
+    return sorted(repos, key=lambda repo: repo.url)[index - 1::count]
+
+
+def get_bundle_path(config: AppConfig) -> str:
+    """Where a shard run writes its bundle, next to the output directory by default"""
+    if config.bundle_file:
+        return config.bundle_file
+    output_dir = str(config.output_dir).rstrip("/")
+    return f"{output_dir}-shard-{config.shard_index}-of-{config.shard_count}.bundle"
+
+
+def get_bundle_state_path(bundle_path: str) -> str:
+    """State file travelling with a shard bundle"""
+    return f"{bundle_path}.state.jsonl"
+
+
+@dataclass(slots=True)
+class ImportUnit:
+    """A single branch of a source repo and the prefix it is imported into"""
+
+    repo: RepoConfig
+    branch: BranchConfig
+    prefix: str
+    source: str
+    host: str
+    sha: str = ""
+
+
+def group_staging_units(units: List[ImportUnit], group_size: int) -> Dict[str, List[ImportUnit]]:
+    """Splits units into staging groups, by domain or in shards of `group_size` units"""
+    groups: Dict[str, List[ImportUnit]] = {}
+    if group_size > 0:
+        for idx in range(0, len(units), group_size):
+            groups[f"shard-{idx // group_size:04d}"] = units[idx:idx + group_size]
+        return groups
+
+    for unit in units:
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", unit.branch.domain)
+        groups.setdefault(name, []).append(unit)
+    return groups
+
+
+def build_staging_repo(
+    config: AppConfig, staging_path: str, units: List[ImportUnit]
+) -> Tuple[str, List[str]]:
+    """Process pool entry point, imports units into a staging clone.
+
+    Returns the staging HEAD and the imported source commit of every unit.
+    """
+    log_pipeline = LogPipeline(config.log).start()
+    try:
+        return asyncio.run(_build_staging_repo(config, staging_path, units))
+    finally:
+        log_pipeline.stop()
+
+
+async def _build_staging_repo(
+    config: AppConfig, staging_path: str, units: List[ImportUnit]
+) -> Tuple[str, List[str]]:
+    """Clones the output repo with shared objects and imports the units on top of it"""
+    staging_config = dataclasses.replace(
+        config,
+        output_dir=staging_path,
+        cache_dir=None,
+        staging=StagingConfig(),
+        alternates=AlternatesConfig(),
+        finalize=FinalizeConfig(),
+        resume=False,
+    )
+    await AsyncGitRepo(os.path.dirname(staging_path)).clone_shared(config.output_dir, staging_path)
+    staging_repo = AsyncGitRepo(staging_path, backend=config.git_backend)
+    merger = RepoMerger(staging_config, staging_repo)
+
+    try:
+        shas = await merger.scheduler.run(units, merger.import_unit, key=lambda unit: unit.host)
+        head = await staging_repo.rev_parse("HEAD")
+    finally:
+        await staging_repo.close()
+    logger.info("Staging repository %s built with %s branches", staging_path, len(units))
+    return head, shas
+
+
+# one attribute per collaborator of a run: mirror cache, scheduler, retry, tip index,
+# discovery, state, durations and planner, next to the config and the output repo
+class RepoMerger:  # pylint: disable=too-many-instance-attributes
     def __init__(self, config: AppConfig, mono_repo: AsyncGitRepo):
         self.config: AppConfig = config
         self.mono_repo: AsyncGitRepo = mono_repo
+        self.mirror_cache: MirrorCache | None = (
+            MirrorCache(config.cache_dir) if config.cache_dir else None
+        )
+        self.scheduler = WorkScheduler(
+            config.concurrency.max_workers,
+            config.concurrency.per_host,
+            config.concurrency.hosts,
+            adaptive=config.retry.adaptive,
+        )
+        self.retry = RemoteRetry(config.retry, self.scheduler)
+        self.tips: TipIndex | None = TipIndex() if config.dedupe else None
+        self.size_reports: List[SizeReport] = []
+        self.discovery = BranchDiscovery(mono_repo, config.cache_dir, config.discovery_ttl)
+        self.state = MergeState.for_repo(mono_repo.repo_path)
+        self.durations = DurationHistory(
+            Path(config.cache_dir) / "durations.json"
+            if config.cache_dir
+            else mono_repo.repo_path / ".git" / "mono-merger" / "durations.json"
+        )
+        self.planner = CostPlanner(self.durations, self.discovery, self.mirror_cache)
+        self._head_lock = asyncio.Lock()
+        self._alternates_lock = asyncio.Lock()
+        if config.alternates.enabled and self.mirror_cache is None:
+            logger.warning("Alternates need a cache_dir to borrow objects from, copying objects instead")
 
         total_branches = sum(len(repo.branches) for repo in config.repos)
         logger.info(
@@ -28,10 +262,18 @@ class RepoMerger:
         )
         logger.debug("Domain mapping: %s", config.domain_mapping)
 
-    async def prepare_mono_repo(self) -> None:
-        """Initialize a new repo at the directory specified in the config and prepare for merging"""
+    async def prepare_mono_repo(self, shared_root: bool = False) -> None:
+        """Initialize a new repo at the directory specified in the config and prepare for merging.
+
+        With `shared_root` the first commit is the same commit in every repo, as shards and
+        the repo they are assembled into need.
+        """
         logger.info("Preparing mono repository at: %s", self.config.output_dir)
 
+        if self.config.resume and await aiofiles.os.path.isdir(self.mono_repo.repo_path / ".git"):
+            logger.info("Resuming into existing repository, skipping preparation")
+            return
+
         logger.debug("Creating output directory")
         await aiofiles.os.makedirs(self.config.output_dir, exist_ok=True)
 
@@ -46,81 +288,867 @@ class RepoMerger:
 
         logger.debug("Adding README.md to staging and creating initial commit")
         await self.mono_repo.add("README.md")
-        await self.mono_repo.commit("first commit")
+        await self.mono_repo.commit("first commit", env=SHARED_ROOT_ENV if shared_root else None)
 
         logger.info("Mono repository preparation completed successfully")
 
-    async def clone_repo_branches(self) -> None:
-        """Clone the specified branches from a repo into their own sub directories, grouped together by domain"""
+    async def clone_repo_branches(self, units: Optional[List[ImportUnit]] = None) -> None:
+        """Clone the specified branches from a repo into their own sub directories, grouped together by domain.
+
+        `units` is the import plan when it was made up front, it is planned here otherwise.
+        """
         total_repos = len(self.config.repos)
         logger.info(
             "Starting repository branch cloning for %s repositories", total_repos
         )
 
-        repo_idx = 0
-        batch_num = 1
+        if units is None:
+            units = await self.plan_units()
+        if self.config.resume:
+            units = await self._skip_completed_units(units)
+        units = await self._order_by_cost(units)
+        logger.info("Importing %s branches from %s repositories", len(units), total_repos)
+        if self.tips:
+            self.tips.summarize(get_tip_key(unit) for unit in units)
 
-        while repo_idx < total_repos:
-            batch_end = min(repo_idx + 5, total_repos)
-            repos = self.config.repos[repo_idx:batch_end]
+        if self.config.staging.enabled:
+            await self._import_via_staging(units)
+        else:
+            await self.scheduler.run(units, self._import_and_record, key=lambda unit: unit.host)
+            if self.config.import_engine != "subtree":
+                await self.mono_repo.reset_hard()
 
+        await self._complete_partial_fetches()
+        await self._report_sizes()
+        await self.finalize_repo()
+        await self.durations.save()
+        if self.mirror_cache:
+            self.mirror_cache.log_stats()
+        if self.tips:
+            self.tips.log_stats(self.mirror_cache is not None)
+        logger.info("All repository branches cloned successfully")
+
+    async def _get_source(self, url: str) -> str:
+        """Returns where to read a repo from, its local mirror when caching is enabled.
+
+        With alternates the output repo reads the mirror's objects in place, so fetching
+        from the mirror only has to write refs. Local directories and bundles are read
+        directly, a mirror of them would only be another local copy.
+        """
+        if self.mirror_cache is None or is_local_source(url):
+            return url
+        mirror = await self.retry.run(
+            get_repo_host(url), f"Mirroring {url}", lambda: self.mirror_cache.ensure(url)
+        )
+        if self.config.alternates.enabled:
+            async with self._alternates_lock:
+                await self.mono_repo.add_alternate(os.path.join(os.path.abspath(mirror), "objects"))
+        return mirror
+
+    async def _resolve_sources(self, units: List[ImportUnit]) -> None:
+        """Points every unit at where to read its repo from, getting each repo's source once.
+
+        Mirrors are brought up to date concurrently, within the per-host limits of the
+        scheduler.
+        """
+        urls = list(dict.fromkeys(unit.repo.url for unit in units))
+        sources = dict(zip(urls, await self.scheduler.run(urls, self._get_source, key=get_repo_host)))
+        for unit in units:
+            unit.source = sources[unit.repo.url]
+
+    async def _complete_partial_fetches(self) -> None:
+        """Makes the output repo a full clone again after shallow or partial fetches.
+
+        Only the fetched source commits are shallow or lack blobs, and nothing reaches
+        them once their import refs are deleted. The imported trees are checked out by
+        now, so the promisor remotes can go and pruning drops the shallow source
+        commits, after which the output repo no longer depends on the source URLs.
+        """
+        remotes = await self.mono_repo.promisor_remotes()
+        if not remotes and not await self.mono_repo.is_shallow():
+            return
+
+        missing = await self.mono_repo.missing_objects() if remotes else []
+        if missing:
+            logger.warning(
+                "%s objects of %s are only in the partially fetched sources, it stays a partial clone of %s",
+                len(missing),
+                self.mono_repo.repo_path,
+                ", ".join(remotes),
+            )
+        elif remotes:
+            await self.mono_repo.drop_promisor_remotes(remotes)
+        await self.mono_repo.prune()
+
+    async def finalize_repo(self) -> None:
+        """Optimizes the output repo for downstream clones and history walks.
+
+        Everything is repacked into a single pack with bitmaps, unreachable loose
+        objects are pruned, then the commit-graph and multi-pack-index are written.
+        Borrowed objects are copied in by the same repack when the run dissociates
+        from its alternates, and left out otherwise.
+        """
+        dissociate = bool(
+            self.mirror_cache and self.config.alternates.enabled and self.config.alternates.dissociate
+        )
+        settings = self.config.finalize
+        if not settings.enabled:
+            if dissociate:
+                await self.mono_repo.dissociate()
+            return
+
+        logger.info("Finalizing output repository %s", self.mono_repo.repo_path)
+        before = await self.mono_repo.count_objects()
+        timings_before = await self._measure_access() if settings.measure else None
+
+        # bitmaps need every reachable object in the pack, borrowed ones included
+        local = bool(self.mirror_cache and self.config.alternates.enabled and not dissociate)
+        bitmaps = settings.bitmaps and not local
+        await self.mono_repo.repack(
+            window=settings.window,
+            depth=settings.depth,
+            threads=settings.threads,
+            bitmaps=bitmaps,
+            local=local,
+            aggressive=settings.aggressive,
+        )
+        if dissociate:
+            await self.mono_repo.remove_alternates()
+        if settings.prune:
+            # the import refs are gone, so the rest of every fetched history is unreachable
+            await self.mono_repo.prune()
+        if settings.commit_graph:
+            await self.mono_repo.write_commit_graph()
+        if settings.multi_pack_index:
+            await self.mono_repo.write_multi_pack_index(bitmap=bitmaps)
+
+        after = await self.mono_repo.count_objects()
+        for label, stats in (("before", before), ("after", after)):
             logger.info(
-                "Processing repository batch %s (%s repositories): %s-%s of %s", batch_num, len(repos), repo_idx + 1, batch_end, total_repos
+                "Objects %s finalizing: %s loose (%s KiB), %s packed in %s packs (%s KiB)",
+                label,
+                stats.get("count", 0),
+                stats.get("size", 0),
+                stats.get("in-pack", 0),
+                stats.get("packs", 0),
+                stats.get("size-pack", 0),
             )
+        if timings_before is not None:
+            timings_after = await self._measure_access()
+            for name in timings_before:
+                logger.info(
+                    "%s: %.2fs before, %.2fs after finalizing",
+                    name,
+                    timings_before[name],
+                    timings_after[name],
+                )
 
-            tasks = [self._subtree_add_branches(repo) for repo in repos]
-            await asyncio.gather(*tasks)
+    async def _measure_access(self) -> Dict[str, float]:
+        """Times a full history walk and a clone of the output repo"""
+        started = time.monotonic()
+        commits = await self.mono_repo.walk_history()
+        log_seconds = time.monotonic() - started
 
-            repo_idx += 5
-            batch_num += 1
+        with tempfile.TemporaryDirectory(prefix="mono-merger-") as tmp_dir:
+            started = time.monotonic()
+            await self.mono_repo.clone_bare(str(self.mono_repo.repo_path), os.path.join(tmp_dir, "clone.git"))
+            clone_seconds = time.monotonic() - started
 
-        logger.info("All repository branches cloned successfully")
+        logger.debug("Walked %s commits in %.2fs", commits, log_seconds)
+        return {"git log": log_seconds, "git clone": clone_seconds}
+
+    async def plan_units(self, resolve_heads: bool = False) -> List[ImportUnit]:
+        """Discovers the branches of every repo concurrently and returns the full import plan.
 
-    async def _subtree_add_branches(self, repo: RepoConfig):
-        """Copies a repo and it's specified branch using subtree add"""
-        all_branches: BranchConfig = next((branch for branch in repo.branches if branch.name == 'all'), None)
-
-        if all_branches:
-            list_branches_result = await self.mono_repo.list_branches(repo.url)
-            print(list_branches_result.split())
-            branch_list = [
-                BranchConfig(name=get_branch_name(result), domain=all_branches.domain)
-                for result in list_branches_result.split()
-                if 'refs/heads/' in result
+        With `resolve_heads` every repo is listed remotely, bypassing the discovery cache,
+        so each unit carries the current head commit of its branch.
+        """
+        if self.config.import_engine == "history":
+            partial = [
+                f"{repo.url} {branch.name}"
+                for repo in self.config.repos
+                for branch in repo.branches
+                if "filter_spec" in get_fetch_options(repo, branch)
             ]
+            if partial:
+                raise Exception(
+                    "The history engine imports every blob of the history, which a partial fetch "
+                    f"leaves out, remove the filter of {', '.join(partial)}"
+                )
+        repos = get_shard_repos(self.config.repos, self.config.shard_index, self.config.shard_count)
+        if self.config.shard_count > 1:
+            logger.info(
+                "Shard %s/%s: %s of %s repositories",
+                self.config.shard_index,
+                self.config.shard_count,
+                len(repos),
+                len(self.config.repos),
+            )
+        await self.discovery.load()
+        repo_units = await self.scheduler.run(
+            repos,
+            lambda repo: self._plan_repo_units(repo, resolve_heads),
+            key=lambda repo: get_repo_host(repo.url),
+        )
+        await self.discovery.save()
+        units = [unit for units in repo_units for unit in units]
+        self._check_prefixes(units, repos)
+        return units
+
+    def _check_prefixes(self, units: List[ImportUnit], planned_repos: List[RepoConfig]) -> None:
+        """Fails before any work when two imports target the same or nested directories.
+
+        Repos of other shards are checked by their explicitly listed branches, the
+        branches their selectors pick are only known to the shard importing them.
+        """
+        targets = [(unit.prefix, f"{unit.repo.url} {unit.branch.name}") for unit in units]
+        planned_urls = {repo.url for repo in planned_repos}
+        for repo in self.config.repos:
+            if repo.url in planned_urls:
+                continue
+            targets.extend(
+                (get_unit_prefix(self.config.domain_mapping, repo.url, branch), f"{repo.url} {branch.name}")
+                for branch in repo.branches
+                if not is_branch_pattern(branch.name)
+            )
+
+        conflicts = find_prefix_conflicts(targets)
+        for conflict in conflicts:
+            logger.error("Prefix conflict: %s", conflict.describe())
+        if conflicts:
+            raise Exception(
+                f"{len(conflicts)} conflicting import prefixes, rename the branches or adjust "
+                "domain_mapping before running"
+            )
+
+    async def plan_run(self) -> List[UnitEstimate]:
+        """Plans a merge without writing to the output repo, returns the estimates in run order"""
+        units = await self.plan_units()
+        if self.config.resume:
+            await self.state.load()
+            units = [unit for unit in units if not self.state.is_complete(unit.prefix)]
+        await self.durations.load()
+        estimates = await self.planner.estimate(units)
+        return sorted(estimates, key=lambda estimate: estimate.seconds, reverse=True)
+
+    async def _order_by_cost(self, units: List[ImportUnit]) -> List[ImportUnit]:
+        """Orders units largest first, so the longest imports do not start last"""
+        await self.durations.load()
+        estimates = await self.planner.estimate(units)
+        durations = [estimate.seconds for estimate in estimates]
+        workers = self.config.concurrency.max_workers
+        logger.info(
+            "Estimated import time: %.1fs in config order, %.1fs largest first",
+            estimate_makespan(durations, workers),
+            estimate_makespan(sorted(durations, reverse=True), workers),
+        )
+        return self.planner.order(units, estimates)
+
+    async def _plan_repo_units(self, repo: RepoConfig, resolve_heads: bool = False) -> List[ImportUnit]:
+        """Resolves the branches of a repo, expanding `all`, globs and regexes, into import units.
+
+        With `resolve_heads` branches missing upstream are left out.
+        """
+        tracing.current_unit.set((repo.url, None))
+        selectors = [branch for branch in repo.branches if is_branch_pattern(branch.name)]
+        branch_list = [branch for branch in repo.branches if not is_branch_pattern(branch.name)]
+        heads: Dict[str, str] = {}
+
+        # tip dedupe needs the head of every branch, a cached listing is good enough for it
+        if selectors or resolve_heads or self.config.dedupe:
+            heads = await self.retry.run(
+                get_repo_host(repo.url),
+                f"Listing branches of {repo.url}",
+                lambda: self.discovery.list_heads(repo.url, use_cache=not resolve_heads),
+            )
+
+        if resolve_heads:
+            for branch in branch_list:
+                if branch.name not in heads:
+                    logger.warning("Branch %s no longer exists in %s", branch.name, repo.url)
+            branch_list = [branch for branch in branch_list if branch.name in heads]
+
+        # explicitly listed branches win over the ones picked by a pattern
+        selected = {branch.name for branch in branch_list}
+        for selector in selectors:
+            for name in select_branches(selector, heads):
+                if name not in selected:
+                    selected.add(name)
+                    branch_list.append(dataclasses.replace(selector, name=name, exclude=[]))
+
+        logger.info("Planned repository: %s (%s branches)", repo.url, len(branch_list))
+        return [
+            ImportUnit(
+                repo=repo,
+                branch=branch,
+                prefix=get_unit_prefix(self.config.domain_mapping, repo.url, branch),
+                source=repo.url,
+                host=get_repo_host(repo.url),
+                sha=heads.get(branch.name, ""),
+            )
+            for branch in branch_list
+        ]
+
+    async def sync_repo_branches(self) -> None:
+        """Brings an existing monorepo up to date, only touching branches that moved upstream"""
+        await self.state.load()
+        if not self.state.units:
+            raise Exception(
+                f"No completed imports recorded in {self.state.path}, run a full merge first"
+            )
+
+        units = await self.plan_units(resolve_heads=True)
+
+        new_units = [unit for unit in units if not self.state.is_complete(unit.prefix)]
+        moved_units = [
+            unit
+            for unit in units
+            if self.state.is_complete(unit.prefix) and self.state.get(unit.prefix).sha != unit.sha
+        ]
+
+        urls = {repo.url for repo in self.config.repos}
+        planned = {unit.prefix for unit in units}
+        for prefix, unit_state in self.state.units.items():
+            if unit_state.url in urls and prefix not in planned:
+                logger.warning("Upstream branch for %s is gone, leaving it untouched", prefix)
+
+        logger.info(
+            "Sync plan: %s moved, %s new, %s unchanged branches",
+            len(moved_units),
+            len(new_units),
+            len(units) - len(moved_units) - len(new_units),
+        )
+
+        if self.tips:
+            self.tips.summarize(get_tip_key(unit) for unit in moved_units + new_units)
+
+        # subtree merges need an up to date worktree, so they run before any plumbing import
+        await self.scheduler.run(moved_units, self._update_and_record, key=lambda unit: unit.host)
+        await self.scheduler.run(new_units, self._import_and_record, key=lambda unit: unit.host)
+        if (new_units or moved_units) and self.config.import_engine != "subtree":
+            await self.mono_repo.reset_hard()
+
+        await self._complete_partial_fetches()
+        await self._report_sizes()
+        await self.finalize_repo()
+        await self.durations.save()
+        if self.mirror_cache:
+            self.mirror_cache.log_stats()
+        if self.tips:
+            self.tips.log_stats(self.mirror_cache is not None)
+        logger.info("Sync completed successfully")
+
+    async def verify_repo_branches(self) -> List[PrefixCheck]:
+        """Compares the tree at every prefix of HEAD with the tree of its upstream branch tip.
+
+        Tips are listed remotely once per repo and looked up in the output repo, which
+        already has them unless the branch moved since the import. Only the tips it does
+        not have are fetched, from the mirror when there is one.
+        """
+        await self.state.load()
+        units = await self.plan_units(resolve_heads=True)
+        checks = await self.scheduler.run(units, self._verify_unit, key=lambda unit: unit.host)
+        await self._complete_partial_fetches()
+        failed = [check for check in checks if check.status in FAILED_STATUSES]
+        logger.info("Verified %s prefixes, %s do not match upstream", len(checks), len(failed))
+        return checks
+
+    async def _verify_unit(self, unit: ImportUnit) -> PrefixCheck:
+        tracing.current_unit.set((unit.repo.url, unit.branch.name))
+        actual = await self.mono_repo.rev_parse(f"HEAD:{unit.prefix}")
+        recorded = self.state.get(unit.prefix)
+        upstream_moved = recorded is not None and recorded.sha != unit.sha
+
+        if has_file_filters(unit):
+            # path and size filters leave files out, the upstream tree is not expected
+            expected, status = "", FILTERED
         else:
-            branch_list = repo.branches
+            expected = await self.mono_repo.rev_parse(f"{unit.sha}^{{tree}}")
+            if not expected:
+                commit = await self._fetch_unit(unit)
+                expected = await self.mono_repo.rev_parse(f"{commit}^{{tree}}")
+                await self.mono_repo.delete_ref(get_import_ref(unit.prefix))
+            status = classify_prefix(expected, actual, upstream_moved)
+
+        if status in FAILED_STATUSES:
+            logger.warning(
+                "Prefix %s does not match %s %s: %s",
+                unit.prefix,
+                unit.repo.url,
+                unit.branch.name,
+                status,
+            )
+        return PrefixCheck(
+            prefix=unit.prefix,
+            url=unit.repo.url,
+            branch=unit.branch.name,
+            expected=expected,
+            actual=actual,
+            status=status,
+        )
+
+    async def _update_and_record(self, unit: ImportUnit) -> str:
+        """Merges the new head of an already imported branch and records it in the state file"""
+        tracing.current_unit.set((unit.repo.url, unit.branch.name))
+        head_lock_wait.set(0.0)
+        started = time.monotonic()
+        logger.info(
+            "Updating %s from %s to %s",
+            unit.prefix,
+            self.state.get(unit.prefix).sha[:7] or "unknown",
+            unit.sha[:7],
+        )
+        if self.config.import_engine == "history":
+            commit = await self._history_add_branch(unit)
+        else:
+            commit = await self._fetch_unit(unit)
+            source = await self._analyze_tip(unit, commit)
+            async with self._holding_head():
+                await self._merge_update(unit, source)
+            await self.mono_repo.delete_ref(get_import_ref(unit.prefix))
+        self.durations.record(unit.prefix, time.monotonic() - started - head_lock_wait.get())
+        await self.state.record(unit.prefix, unit.repo.url, unit.branch.name, commit)
+        return commit
+
+    @contextlib.asynccontextmanager
+    async def _holding_head(self):
+        """Holds the HEAD lock, adding the time spent waiting for it to `head_lock_wait`.
+
+        Units queue for HEAD behind each other, so without this the recorded duration of
+        a unit, and the cost planning based on it, would grow with the concurrency.
+        """
+        queued_at = time.monotonic()
+        async with self._head_lock:
+            head_lock_wait.set(head_lock_wait.get() + time.monotonic() - queued_at)
+            yield
+
+    async def _merge_update(self, unit: ImportUnit, source: str) -> None:
+        """Merges the new tip of a unit into its prefix, undoing the merge when it conflicts.
 
-        total_branches = len(branch_list)
-        logger.info("Processing repository: %s (%s branches)", repo.url, total_branches)
+        A failed merge leaves HEAD where it was and the state file on the previous tip,
+        so the unit is retried by the next sync once the conflict is resolved upstream.
+        """
+        try:
+            await self.mono_repo.subtree_merge(unit.prefix, source, True)
+            conflicts = await self.mono_repo.unmerged_paths()
+            if conflicts:
+                raise Exception(
+                    f"Merging {unit.repo.url} {unit.branch.name} into {unit.prefix} left "
+                    f"conflicts in {len(conflicts)} files: {', '.join(conflicts[:10])}"
+                )
+        except Exception:
+            logger.error("Sync of %s failed, aborting its merge", unit.prefix)
+            await self.mono_repo.reset_hard()
+            raise
+
+    async def _skip_completed_units(self, units: List[ImportUnit]) -> List[ImportUnit]:
+        """Drops the units a previous run already imported, according to the state file and HEAD.
+
+        A crash in the middle of a subtree add leaves the index, the worktree and maybe
+        the index lock behind, so the checkout is reset to HEAD and the prefixes still to
+        import are cleaned before anything is imported again.
+        """
+        await self.state.load()
+        pending = [unit for unit in units if not self.state.is_complete(unit.prefix)]
+
+        index_lock = self.mono_repo.repo_path / ".git" / "index.lock"
+        if await aiofiles.os.path.isfile(index_lock):
+            logger.warning("Removing %s left behind by the interrupted run", index_lock)
+            await aiofiles.os.remove(index_lock)
+        await self.mono_repo.reset_hard()
+        await self.mono_repo.clean([unit.prefix for unit in pending])
+
+        # An import can land in HEAD right before a crash, without reaching the state file
+        present = set(await self.mono_repo.list_tree_paths("HEAD", [unit.prefix for unit in pending]))
+        for unit in pending:
+            if unit.prefix in present:
+                logger.warning("Prefix %s is in HEAD but not in the state file, skipping it", unit.prefix)
+                await self.state.record(unit.prefix, unit.repo.url, unit.branch.name, "")
+
+        pending = [unit for unit in pending if unit.prefix not in present]
+        logger.info(
+            "Resuming run: %s of %s imports already completed", len(units) - len(pending), len(units)
+        )
+        return pending
+
+    async def _import_and_record(self, unit: ImportUnit) -> str:
+        """Imports a unit and records its completion and its duration, without lock waits"""
+        head_lock_wait.set(0.0)
+        started = time.monotonic()
+        sha = await self.import_unit(unit)
+        self.durations.record(unit.prefix, time.monotonic() - started - head_lock_wait.get())
+        await self.state.record(unit.prefix, unit.repo.url, unit.branch.name, sha)
+        return sha
+
+    async def import_unit(self, unit: ImportUnit) -> str:
+        """Imports a unit with the configured engine and returns the imported source commit"""
+        tracing.current_unit.set((unit.repo.url, unit.branch.name))
+        if self.config.import_engine == "plumbing":
+            return await self._plumbing_add_branch(unit)
+        if self.config.import_engine == "history":
+            return await self._history_add_branch(unit)
+        return await self._subtree_add_branch(unit)
+
+    async def _fetch_unit(self, unit: ImportUnit) -> str:
+        """Fetches the branch of a unit into its private import ref and returns the commit.
 
-        branch_idx = 0
-        while branch_idx < len(branch_list):
-            batch_end = min(branch_idx + 5, total_branches)
-            branches = branch_list[branch_idx:batch_end]
+        Squashed imports only need the tree of the tip commit, so the configured depth,
+        date or object filter bound what is transferred into the output repo. With tip
+        dedupe a unit whose tip another unit already fetched only points its ref at it.
+        """
+        import_ref = get_import_ref(unit.prefix)
+        if self.tips is None:
+            return await self._fetch_tip(unit, import_ref)
+
+        commit, shared = await self.tips.fetch(
+            get_tip_key(unit), unit.repo.url, lambda: self._fetch_tip(unit, import_ref)
+        )
+        if shared:
+            logger.debug("Reusing fetched tip %s for %s", commit[:7], unit.prefix)
+            await self.mono_repo.update_ref(import_ref, commit)
+        return commit
+
+    async def _fetch_tip(self, unit: ImportUnit, import_ref: str) -> str:
+        """Fetches the branch of a unit, through its mirror when caching is enabled"""
+        if self.mirror_cache:
+            unit.source = await self._get_source(unit.repo.url)
+        await self.retry.run(
+            unit.host,
+            f"Fetching {unit.repo.url}:{unit.branch.name}",
+            lambda: self.mono_repo.fetch(
+                unit.source,
+                f"+refs/heads/{unit.branch.name}:{import_ref}",
+                **get_fetch_options(unit.repo, unit.branch),
+            ),
+        )
+        return await self.mono_repo.rev_parse(import_ref)
+
+    async def _subtree_add_branch(self, unit: ImportUnit) -> str:
+        """Copies a single branch of a repo into its prefix using subtree add.
+
+        The branch is fetched concurrently into a private ref first, only the subtree add
+        itself runs one at a time since it works on the shared index and HEAD.
+        """
+        logger.debug(
+            "Preparing subtree add: %s:%s -> %s", unit.repo.url, unit.branch.name, unit.prefix
+        )
+        commit = await self._fetch_unit(unit)
+        source = await self._analyze_tip(unit, commit)
+        async with self._holding_head():
+            await self.mono_repo.subtree_add(unit.prefix, None, source, True)
+        await self.mono_repo.delete_ref(get_import_ref(unit.prefix))
+        return commit
+
+    async def _plumbing_add_branch(self, unit: ImportUnit) -> str:
+        """Imports a single branch as a squashed subtree using plumbing commands only.
+
+        The fetch and the prefixed tree are built without any lock in a private ref and
+        index, only the final merge into HEAD is serialized. The commits carry the same
+        trailers as `git subtree add --squash`, so `git subtree` keeps working on them.
+        """
+        logger.info(
+            "Importing %s:%s -> %s with plumbing", unit.repo.url, unit.branch.name, unit.prefix
+        )
+        commit = await self._fetch_unit(unit)
+        source = await self._analyze_tip(unit, commit)
+        tree = await self.mono_repo.rev_parse(f"{source}^{{tree}}")
 
-            logger.debug(
-                "Processing branch batch for %s: %s-%s of %s", repo.url, branch_idx + 1, batch_end, total_branches
+        with tempfile.TemporaryDirectory(prefix="mono-merger-") as tmp_dir:
+            index_file = os.path.join(tmp_dir, "index")
+            await self.mono_repo.read_tree(tree, prefix=f"{unit.prefix}/", index_file=index_file)
+            prefixed_tree = await self.mono_repo.write_tree(index_file=index_file)
+
+        squash_commit = await self.mono_repo.commit_tree(
+            tree,
+            f"Squashed '{unit.prefix}/' content from commit {source[:7]}\n\n"
+            f"git-subtree-dir: {unit.prefix}\n"
+            f"git-subtree-split: {source}",
+        )
+        await self._merge_into_head(unit.prefix, prefixed_tree, squash_commit)
+        await self.mono_repo.delete_ref(get_import_ref(unit.prefix))
+        logger.info("Plumbing import completed for %s:%s", unit.repo.url, unit.branch.name)
+        return commit
+
+    async def _analyze_tip(self, unit: ImportUnit, commit: str, filter_tree: bool = True) -> str:
+        """Sizes up the tree of a fetched tip, enforces its budget and filters its files.
+
+        Returns the commit to import, the fetched one unless `filter_tree` is set and the
+        path or size filters drop files, then a commit of the tree without them.
+        """
+        budget, max_blob_size = get_size_options(unit.repo, unit.branch)
+        if not (self.config.analysis.enabled or budget is not None or has_file_filters(unit)):
+            return commit
+
+        # sizing the blobs a partial fetch left out would fetch each of them
+        partial = "filter_spec" in get_fetch_options(unit.repo, unit.branch)
+        report, dropped = analyze_blobs(
+            unit.prefix,
+            await list_blobs(self.mono_repo, commit, present_only=partial),
+            self.config.analysis.top,
+            include=unit.branch.include_paths,
+            exclude=unit.branch.exclude_paths,
+            max_blob_size=max_blob_size,
+            budget=budget,
+        )
+        self.size_reports.append(report)
+        logger.info("Size of %s", describe_report(report))
+        if report.unsized and (budget is not None or max_blob_size is not None):
+            logger.warning(
+                "The size budget and blob size limit of %s only cover the %s of its %s files "
+                "its partial fetch brought in",
+                unit.prefix,
+                report.files - report.unsized,
+                report.files,
+            )
+        if report.oversized:
+            logger.warning(
+                "Leaving %s files over %s out of %s, the largest is %s (%s)",
+                len(report.oversized),
+                format_size(max_blob_size),
+                unit.prefix,
+                report.oversized[0].path,
+                format_size(report.oversized[0].size),
+            )
+        if report.over_budget:
+            message = (
+                f"{unit.prefix} is {format_size(report.total)} unpacked, "
+                f"over its size budget of {format_size(budget)}"
+            )
+            if self.config.analysis.on_budget == "fail":
+                raise Exception(message)
+            logger.warning(message)
+
+        if not filter_tree or not dropped:
+            return commit
+        with tempfile.TemporaryDirectory(prefix="mono-merger-") as tmp_dir:
+            index_file = os.path.join(tmp_dir, "index")
+            await self.mono_repo.read_tree(commit, index_file=index_file)
+            await self.mono_repo.remove_paths(dropped, index_file=index_file)
+            tree = await self.mono_repo.write_tree(index_file=index_file)
+        return await self.mono_repo.commit_tree(
+            tree, f"Filtered tree of {commit} for '{unit.prefix}/'\n\nLeft out {len(dropped)} files"
+        )
+
+    async def _report_sizes(self) -> None:
+        """Logs the largest prefixes of the run and writes every size report next to the state"""
+        if not self.size_reports:
+            return
+        logger.info(
+            "Largest imports:\n%s", format_size_summary(self.size_reports, self.config.analysis.top)
+        )
+        await save_size_reports(self.mono_repo.repo_path / ".git" / "mono-merger" / "sizes.json", self.size_reports)
+
+    async def _merge_into_head(self, prefix: str, prefixed_tree: str, squash_commit: str) -> None:
+        """Overlays a prefixed tree onto HEAD and records it as a subtree merge commit"""
+        async with self._holding_head():
+            head = await self.mono_repo.rev_parse("HEAD")
+            with tempfile.TemporaryDirectory(prefix="mono-merger-") as tmp_dir:
+                index_file = os.path.join(tmp_dir, "index")
+                await self.mono_repo.read_tree("HEAD", prefixed_tree, index_file=index_file)
+                merged_tree = await self.mono_repo.write_tree(index_file=index_file)
+
+            merge_commit = await self.mono_repo.commit_tree(
+                merged_tree,
+                f"Add '{prefix}/' from commit '{squash_commit}'\n\n"
+                f"git-subtree-dir: {prefix}\n"
+                f"git-subtree-mainline: {head}\n"
+                f"git-subtree-split: {squash_commit}",
+                head,
+                squash_commit,
             )
+            await self.mono_repo.update_ref("HEAD", merge_commit, head)
+
+    async def _history_add_branch(self, unit: ImportUnit) -> str:
+        """Imports the full history of a branch, rewritten to live under its prefix.
 
-            tasks = []
-            for branch in branches:
-                prefix = f"{branch.domain}/{get_repo_name(repo.url)}/{branch.name}"
-                print(prefix)
-                logger.debug(
-                    "Preparing subtree add: %s:%s -> %s", repo.url, branch.name, prefix
+        The fetched branch is streamed from fast-export through a path rewriting generator
+        into fast-import, without any checkout. The marks of the previous import of the
+        prefix make the rewrite incremental, importing a branch again only exports and
+        rewrites the commits that are new since then.
+        """
+        logger.info(
+            "Importing history of %s:%s -> %s", unit.repo.url, unit.branch.name, unit.prefix
+        )
+        commit = await self._fetch_unit(unit)
+        await self._analyze_tip(unit, commit, filter_tree=False)
+        _, max_blob_size = get_size_options(unit.repo, unit.branch)
+        large_blobs = set()
+        if max_blob_size is not None:
+            large_blobs = await list_large_blobs(
+                self.mono_repo, get_import_ref(unit.prefix), max_blob_size + 1
+            )
+            if large_blobs:
+                logger.warning(
+                    "Leaving %s blobs over %s out of the history of %s",
+                    len(large_blobs),
+                    format_size(max_blob_size),
+                    unit.prefix,
                 )
 
-                task = self.mono_repo.subtree_add(prefix, repo.url, branch.name, True)
-                tasks.append(task)
+        history_ref = get_history_ref(unit.prefix)
+        marks = HistoryMarks(
+            get_marks_dir(self.mono_repo.repo_path, unit.prefix),
+            json.dumps([unit.branch.include_paths, unit.branch.exclude_paths, max_blob_size]),
+        )
+        await self.mono_repo.delete_ref(history_ref)
+        try:
+            await self._rewrite_history(unit, history_ref, large_blobs, marks)
+        except GitCommandError:
+            if not marks.incremental:
+                raise
+            # the marks can name commits that are gone, e.g. pruned after a failed import
+            logger.warning("Incremental history import of %s failed, importing all of it", unit.prefix)
+            await marks.clear()
+            await self._rewrite_history(unit, history_ref, large_blobs, marks)
+        tip = await self.mono_repo.rev_parse(history_ref)
 
-            await asyncio.gather(*tasks)
+        async with self._holding_head():
+            head = await self.mono_repo.rev_parse("HEAD")
+            subtree = await self.mono_repo.rev_parse(f"{tip}:{unit.prefix}")
+            with tempfile.TemporaryDirectory(prefix="mono-merger-") as tmp_dir:
+                index_file = os.path.join(tmp_dir, "index")
+                await self.mono_repo.read_tree("HEAD", index_file=index_file)
+                await self.mono_repo.rm_cached(unit.prefix, index_file=index_file)
+                # every path can be filtered out, leaving nothing at the prefix
+                if subtree:
+                    await self.mono_repo.read_tree(subtree, prefix=f"{unit.prefix}/", index_file=index_file)
+                merged_tree = await self.mono_repo.write_tree(index_file=index_file)
 
-            logger.info(
-                "Completed branch batch for %s: %s branches added", repo.url, len(branches)
+            merge_commit = await self.mono_repo.commit_tree(
+                merged_tree,
+                f"Import history of '{unit.prefix}/' from {unit.repo.url} {unit.branch.name}\n\n"
+                f"Source commit: {commit}",
+                head,
+                tip,
             )
-            branch_idx += 5
+            await self.mono_repo.update_ref("HEAD", merge_commit, head)
 
+        # only now that HEAD keeps the rewritten commits can later imports build on them
+        await marks.save()
+        await self.mono_repo.delete_ref(history_ref)
+        await self.mono_repo.delete_ref(get_import_ref(unit.prefix))
+        logger.info("History import completed for %s:%s", unit.repo.url, unit.branch.name)
+        return commit
+
+    async def _rewrite_history(
+        self, unit: ImportUnit, history_ref: str, large_blobs: Set[str], marks: HistoryMarks
+    ) -> None:
+        """Rewrites the fetched branch of a unit under its prefix into `history_ref`"""
+        await self.mono_repo.rewrite_history(
+            get_import_ref(unit.prefix),
+            lambda stream: rewrite_fast_export(
+                stream,
+                unit.prefix,
+                history_ref,
+                include=unit.branch.include_paths,
+                exclude=unit.branch.exclude_paths,
+                drop_blobs=large_blobs,
+            ),
+            marks=marks,
+        )
+
+    async def _import_via_staging(self, units: List[ImportUnit]) -> None:
+        """Builds groups of units in parallel staging repos and merges them with one commit"""
+        groups = group_staging_units(units, self.config.staging.group_size)
+        if not groups:
+            logger.info("Nothing to import, skipping staging")
+            return
+
+        # the workers have no mirror cache of their own, they read the mirrors directly
+        await self._resolve_sources(units)
+        staging_root = self.mono_repo.repo_path / ".git" / "mono-merger" / "staging"
+        await aiofiles.os.makedirs(staging_root, exist_ok=True)
+        workers = self.config.staging.workers or os.cpu_count() or 1
         logger.info(
-            "Completed processing repository: %s (all %s branches)", repo.url, total_branches
+            "Building %s staging repositories with %s worker processes", len(groups), workers
         )
+
+        # only staging runs need a process pool, so it is not loaded with the module
+        import multiprocessing  # pylint: disable=import-outside-toplevel
+        from concurrent.futures import ProcessPoolExecutor  # pylint: disable=import-outside-toplevel
+
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        pool, build_staging_repo, self.config, str(staging_root / name), group
+                    )
+                    for name, group in groups.items()
+                )
+            )
+
+        sources = {name: str(staging_root / name) for name in groups}
+        logger.debug("Staging heads: %s", {name: head for name, (head, _) in zip(groups, results)})
+        await self._assemble(sources)
+
+        for group, (_, shas) in zip(groups.values(), results):
+            for unit, sha in zip(group, shas):
+                await self.state.record(unit.prefix, unit.repo.url, unit.branch.name, sha)
+        await asyncio.to_thread(shutil.rmtree, staging_root, ignore_errors=True)
+
+    async def export_bundle(self, path: str) -> None:
+        """Writes the output repo to a bundle, with the state of its imports next to it"""
+        await self.mono_repo.bundle_create(path, "HEAD")
+        await self.state.load()
+        await self.state.save_as(get_bundle_state_path(path))
+        logger.info("Shard bundle with %s imports written to %s", len(self.state.units), path)
+
+    async def assemble_bundles(self, bundles: List[str]) -> None:
+        """Combines shard bundles into the output repo with a single merge commit.
+
+        The output repo and the shards are expected to share their root commit, see
+        `prepare_mono_repo`, a shard with a root of its own adds that root to the history.
+        """
+        if not bundles:
+            raise Exception("No shard bundles given to assemble")
+
+        sources = {f"shard-{idx:04d}": str(Path(bundle).resolve()) for idx, bundle in enumerate(bundles)}
+        await self._assemble(sources)
+
+        await self.state.load()
+        for bundle in bundles:
+            shard_state = MergeState(get_bundle_state_path(bundle))
+            await shard_state.load()
+            if not shard_state.units:
+                logger.warning("No state found next to %s, sync will re-import its branches", bundle)
+            await self.state.merge(shard_state.units.values())
+
+    async def _assemble(self, sources: Dict[str, str]) -> None:
+        """Fetches the HEAD of every source repo and records them all in a single merge commit.
+
+        The sources are expected to hold disjoint prefixes on top of the output HEAD, so
+        their trees are overlaid onto HEAD instead of being merged file by file.
+        """
+        refs = {name: f"refs/mono-merger/staging/{name}" for name in sources}
+        for name, path in sources.items():
+            await self.mono_repo.fetch(path, f"+HEAD:{refs[name]}")
+        tips = [await self.mono_repo.rev_parse(ref) for ref in refs.values()]
+
+        async with self._head_lock:
+            head = await self.mono_repo.rev_parse("HEAD")
+            merged_tree = head
+            with tempfile.TemporaryDirectory(prefix="mono-merger-") as tmp_dir:
+                index_file = os.path.join(tmp_dir, "index")
+                # read-tree overlays at most 8 trees per call
+                for idx in range(0, len(tips), 7):
+                    await self.mono_repo.read_tree(
+                        merged_tree, *tips[idx:idx + 7], index_file=index_file
+                    )
+                    merged_tree = await self.mono_repo.write_tree(index_file=index_file)
+
+            merge_commit = await self.mono_repo.commit_tree(
+                merged_tree,
+                f"Merge {len(tips)} staged imports\n\n"
+                + "\n".join(f"{name}: {tip}" for name, tip in zip(sources, tips)),
+                head,
+                *tips,
+            )
+            await self.mono_repo.update_ref("HEAD", merge_commit, head)
+
+        for ref in refs.values():
+            await self.mono_repo.delete_ref(ref)
+        await self.mono_repo.reset_hard()
+        logger.info("Assembled %s staged imports into %s", len(tips), self.mono_repo.repo_path)
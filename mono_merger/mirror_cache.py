@@ -0,0 +1,67 @@
+import asyncio
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+import aiofiles.os
+
+from mono_merger.config import logger
+from mono_merger.async_git import AsyncGitRepo
+
+
+def get_mirror_name(url: str) -> str:
+    """Builds a stable, filesystem safe directory name for a repo URL"""
+    tail = url.strip().rstrip("/").split("/")[-1].split(":")[-1]
+    digest = hashlib.sha1(url.strip().encode()).hexdigest()[:12]
+    return f"{tail.removesuffix('.git')}-{digest}.git"
+
+
+@dataclass
+class CacheStats:
+    """Hit/miss counters for the mirror cache"""
+
+    hits: int = 0
+    misses: int = 0
+
+
+class MirrorCache:
+    """Keeps one bare mirror per source URL so branches are fetched over the network once"""
+
+    def __init__(self, cache_dir: str):
+        self.mirror_dir = Path(cache_dir).resolve() / "mirrors"
+        self.stats = CacheStats()
+        self._ready: Dict[str, Path] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        logger.debug("MirrorCache initialized with path: %s", self.mirror_dir)
+
+    def mirror_path(self, url: str) -> Path:
+        """Returns the location of the mirror for a URL"""
+        return self.mirror_dir / get_mirror_name(url)
+
+    async def ensure(self, url: str) -> str:
+        """Clones or refreshes the mirror for a URL once per run and returns its path"""
+        lock = self._locks.setdefault(url, asyncio.Lock())
+        async with lock:
+            if url in self._ready:
+                return str(self._ready[url])
+
+            path = self.mirror_path(url)
+            if await aiofiles.os.path.isdir(path):
+                logger.info("Mirror cache hit for %s, fetching updates", url)
+                await AsyncGitRepo(str(path)).remote_update()
+                self.stats.hits += 1
+            else:
+                logger.info("Mirror cache miss for %s, cloning mirror", url)
+                await aiofiles.os.makedirs(self.mirror_dir, exist_ok=True)
+                await AsyncGitRepo(str(self.mirror_dir)).clone_mirror(url, str(path))
+                self.stats.misses += 1
+
+            self._ready[url] = path
+            return str(path)
+
+    def log_stats(self) -> None:
+        """Reports the cache effectiveness for this run"""
+        logger.info(
+            "Mirror cache stats: %s hits, %s misses", self.stats.hits, self.stats.misses
+        )
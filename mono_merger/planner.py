@@ -0,0 +1,163 @@
+import asyncio
+import heapq
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import aiofiles
+import aiofiles.os
+
+from mono_merger.config import logger
+
+# Rough costs used when a unit has never been imported before
+BASE_UNIT_SECONDS = 2.0
+SECONDS_PER_REF = 0.01
+BYTES_PER_SECOND = 20 * 1024 * 1024
+
+
+@dataclass
+class UnitEstimate:
+    """Estimated import time of a unit and what the estimate is based on"""
+
+    prefix: str
+    url: str
+    branch: str
+    seconds: float
+    basis: str
+
+
+def directory_size(path: Path) -> int:
+    """Total size in bytes of the files below a path"""
+    total = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total += os.lstat(os.path.join(dir_path, file_name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def estimate_makespan(durations: Sequence[float], workers: int) -> float:
+    """Wall time of running the durations in order, each on the first worker to free up"""
+    finish_times = [0.0] * max(1, min(workers, len(durations)))
+    for duration in durations:
+        heapq.heapreplace(finish_times, finish_times[0] + duration)
+    return max(finish_times)
+
+
+class DurationHistory:
+    """Import durations of earlier runs, keyed by prefix"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.durations: Dict[str, float] = {}
+
+    async def load(self) -> None:
+        """Reads the recorded durations, starting empty when there are none"""
+        if not await aiofiles.os.path.isfile(self.path):
+            return
+        try:
+            async with aiofiles.open(self.path, "r", encoding="utf-8") as file:
+                self.durations = json.loads(await file.read())
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable duration history %s: %s", self.path, e)
+            self.durations = {}
+
+    def get(self, prefix: str) -> Optional[float]:
+        """Returns the last import duration of a prefix, if any"""
+        return self.durations.get(prefix)
+
+    def record(self, prefix: str, seconds: float) -> None:
+        """Remembers how long the import of a prefix took"""
+        self.durations[prefix] = round(seconds, 3)
+
+    async def save(self) -> None:
+        """Atomically writes the durations back"""
+        await aiofiles.os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as file:
+            await file.write(json.dumps(self.durations, indent=2, sort_keys=True))
+        await asyncio.to_thread(os.replace, tmp_path, self.path)
+
+
+class CostPlanner:
+    """Estimates the cost of import units so the most expensive ones can start first.
+
+    A unit imported before is expected to take as long as it did last time. Otherwise
+    the estimate grows with the size of the repo's mirror, when one is cached, and with
+    the number of branches the repo has.
+    """
+
+    def __init__(self, history: DurationHistory, discovery=None, mirror_cache=None):
+        self.history = history
+        self.discovery = discovery
+        self.mirror_cache = mirror_cache
+
+    async def estimate(self, units: List) -> List[UnitEstimate]:
+        """Returns an estimate for every unit, in the order of the units"""
+        urls = sorted({unit.repo.url for unit in units})
+        sizes = dict(zip(urls, await asyncio.gather(*(self._mirror_size(url) for url in urls))))
+
+        estimates = []
+        for unit in units:
+            seconds = self.history.get(unit.prefix)
+            if seconds is not None:
+                basis = "history"
+            else:
+                refs = self._ref_count(unit.repo.url)
+                seconds = BASE_UNIT_SECONDS + refs * SECONDS_PER_REF
+                basis = "default"
+                if sizes[unit.repo.url]:
+                    seconds += sizes[unit.repo.url] / BYTES_PER_SECOND
+                    basis = "mirror size"
+            estimates.append(
+                UnitEstimate(
+                    prefix=unit.prefix,
+                    url=unit.repo.url,
+                    branch=unit.branch.name,
+                    seconds=seconds,
+                    basis=basis,
+                )
+            )
+        return estimates
+
+    @staticmethod
+    def order(units: List, estimates: List[UnitEstimate]) -> List:
+        """Sorts units by decreasing estimated cost, keeping config order between equals"""
+        ranked = sorted(zip(units, estimates), key=lambda pair: pair[1].seconds, reverse=True)
+        return [unit for unit, _ in ranked]
+
+    def _ref_count(self, url: str) -> int:
+        """Number of branches of a repo according to the discovery cache, 0 if unknown"""
+        if self.discovery is None:
+            return 0
+        return len(self.discovery.known_heads(url) or {})
+
+    async def _mirror_size(self, url: str) -> int:
+        """Size of the repo's mirror, 0 without a cached mirror"""
+        if self.mirror_cache is None:
+            return 0
+        path = self.mirror_cache.mirror_path(url)
+        if not await aiofiles.os.path.isdir(path):
+            return 0
+        return await asyncio.to_thread(directory_size, path)
+
+
+def format_plan(estimates: List[UnitEstimate], workers: int) -> str:
+    """Renders a plan as a table of prefixes followed by the estimated total time"""
+    lines = [f"{'#':>4}  {'estimate':>9}  {'basis':<11}  prefix  (source)"]
+    for idx, estimate in enumerate(estimates, start=1):
+        lines.append(
+            f"{idx:>4}  {estimate.seconds:>8.1f}s  {estimate.basis:<11}  "
+            f"{estimate.prefix}  ({estimate.url} {estimate.branch})"
+        )
+    total = sum(estimate.seconds for estimate in estimates)
+    makespan = estimate_makespan([estimate.seconds for estimate in estimates], workers)
+    lines.append(
+        f"{len(estimates)} imports, {total:.1f}s of work, "
+        f"about {makespan:.1f}s with {workers} workers"
+    )
+    return "\n".join(lines)
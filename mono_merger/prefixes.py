@@ -0,0 +1,97 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Path components that git or the filesystem do not accept inside a tree
+INVALID_COMPONENTS = frozenset(("", ".", "..", ".git"))
+
+DUPLICATE = "duplicate"
+NESTED = "nested"
+INVALID = "invalid"
+
+
+@dataclass
+class PrefixConflict:
+    """Two import targets that cannot both exist, or a target that is not a valid path"""
+
+    kind: str
+    prefix: str
+    owner: str
+    other_prefix: str = ""
+    other_owner: str = ""
+
+    def describe(self) -> str:
+        """One line explanation of the conflict"""
+        if self.kind == INVALID:
+            return f"invalid prefix {self.prefix} ({self.owner})"
+        if self.kind == DUPLICATE:
+            return f"{self.prefix} is the target of both {self.other_owner} and {self.owner}"
+        return (
+            f"{self.prefix} ({self.owner}) and {self.other_prefix} ({self.other_owner}) "
+            "are nested in each other"
+        )
+
+
+@dataclass(slots=True)
+class _Node:
+    children: Dict[str, "_Node"] = field(default_factory=dict)
+    owner: Optional[str] = None
+    prefix: Optional[str] = None
+
+
+# one entry point, a class only to keep the prefixes inserted so far
+class PrefixTrie:  # pylint: disable=too-few-public-methods
+    """Trie of import prefixes by path component.
+
+    A prefix conflicts with an identical one and with any prefix above or below it,
+    since a subtree cannot be both a directory of another import and an import of its
+    own (the private refs named after the prefixes clash the same way).
+    """
+
+    def __init__(self):
+        self.root = _Node()
+
+    def insert(self, prefix: str, owner: str) -> List[PrefixConflict]:
+        """Adds a prefix and returns its conflicts with the prefixes added before"""
+        components = prefix.split("/")
+        if not INVALID_COMPONENTS.isdisjoint(components):
+            return [PrefixConflict(INVALID, prefix, owner)]
+
+        conflicts = []
+        node = self.root
+        for depth, component in enumerate(components, start=1):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = _Node()
+            node = child
+            if node.owner is not None and depth < len(components):
+                conflicts.append(PrefixConflict(NESTED, prefix, owner, node.prefix, node.owner))
+
+        if node.owner is not None:
+            conflicts.append(PrefixConflict(DUPLICATE, prefix, owner, node.prefix, node.owner))
+            return conflicts
+        if node.children:
+            conflicts.extend(
+                PrefixConflict(NESTED, prefix, owner, nested.prefix, nested.owner)
+                for nested in self._owned_below(node)
+            )
+        node.owner, node.prefix = owner, prefix
+        return conflicts
+
+    @staticmethod
+    def _owned_below(node: _Node) -> Iterable[_Node]:
+        """Nodes below a node that are prefixes themselves"""
+        stack = list(node.children.values())
+        while stack:
+            child = stack.pop()
+            if child.owner is not None:
+                yield child
+            stack.extend(child.children.values())
+
+
+def find_prefix_conflicts(targets: Iterable[Tuple[str, str]]) -> List[PrefixConflict]:
+    """Checks (prefix, owner) pairs in one pass and returns every conflict between them"""
+    trie = PrefixTrie()
+    conflicts = []
+    for prefix, owner in targets:
+        conflicts.extend(trie.insert(prefix, owner))
+    return conflicts
@@ -0,0 +1,77 @@
+import asyncio
+import random
+import re
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from mono_merger.config import RetryConfig, logger
+from mono_merger.async_git import GitCommandError
+from mono_merger.scheduler import WorkScheduler
+
+T = TypeVar("T")
+
+# The server asks us to slow down
+THROTTLE_PATTERN = re.compile(
+    r"rate limit|too many requests|\b429\b|abuse detection|try again later", re.IGNORECASE
+)
+# The network or the server failed, the same call may well succeed a moment later
+TRANSIENT_PATTERN = re.compile(
+    r"\b50[0234]\b|connection (?:reset|refused|timed out|closed)|could not resolve host"
+    r"|remote end hung up|early eof|rpc failed|temporarily unavailable|unexpected disconnect"
+    r"|operation timed out|ssl_read|gnutls|broken pipe",
+    re.IGNORECASE,
+)
+
+CONGESTION = "congestion"
+TRANSIENT = "transient"
+
+
+def classify_failure(error: BaseException) -> Optional[str]:
+    """Tells throttling and timeouts (congestion) and network hiccups (transient) from real errors"""
+    if not isinstance(error, GitCommandError):
+        return None
+    if error.timed_out or THROTTLE_PATTERN.search(error.stderr):
+        return CONGESTION
+    if TRANSIENT_PATTERN.search(error.stderr):
+        return TRANSIENT
+    return None
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter, so retries of many units do not line up"""
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+# one entry point, a class only to share the retry config and scheduler between units
+class RemoteRetry:  # pylint: disable=too-few-public-methods
+    """Retries remote git operations that fail transiently and reports congestion per host"""
+
+    def __init__(self, config: RetryConfig, scheduler: Optional[WorkScheduler] = None):
+        self.config = config
+        self.scheduler = scheduler
+
+    async def run(self, host: str, description: str, operation: Callable[[], Awaitable[T]]) -> T:
+        """Runs an operation, retrying it with backoff while it fails transiently"""
+        for attempt in range(self.config.attempts):
+            try:
+                result = await operation()
+            except GitCommandError as e:
+                kind = classify_failure(e)
+                if kind == CONGESTION and self.scheduler is not None:
+                    self.scheduler.record_congestion(host)
+                if kind is None or attempt + 1 >= self.config.attempts:
+                    raise
+
+                delay = backoff_delay(attempt, self.config.base_delay, self.config.max_delay)
+                logger.warning(
+                    "%s failed with %s error (attempt %s of %s), retrying in %.1fs",
+                    description,
+                    kind,
+                    attempt + 1,
+                    self.config.attempts,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+            else:
+                if self.scheduler is not None:
+                    self.scheduler.record_success(host)
+                return result
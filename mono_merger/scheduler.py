@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from mono_merger.config import logger
+from mono_merger import tracing
+
+DECREASE_INTERVAL = 5.0
+# Host of local directories, bundles and file:// URLs
+LOCAL_HOST = "local"
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class WorkScheduler:
+    """Runs units of work from a queue under a global and a per-host concurrency limit.
+
+    A unit is started as soon as a global slot and a slot for its host are free, so a
+    slow unit only ever holds up its own slot instead of a whole batch.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        per_host: int,
+        host_limits: Optional[Dict[str, int]] = None,
+        adaptive: bool = False,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.per_host = max(1, per_host)
+        self.host_limits: Dict[str, int] = dict(host_limits or {})
+        self.adaptive = adaptive
+        # reduced limits of throttled hosts, grown back towards the configured limit
+        self._windows: Dict[str, float] = {}
+        self._last_decrease: Dict[str, float] = {}
+        logger.debug(
+            "WorkScheduler initialized with %s workers, %s per host, overrides: %s, adaptive: %s",
+            self.max_workers,
+            self.per_host,
+            self.host_limits,
+            self.adaptive,
+        )
+
+    def configured_limit(self, host: str) -> int:
+        """Returns the configured concurrency limit of a host.
+
+        Local sources are no server to protect, they only share the global limit unless
+        `local` has a limit of its own.
+        """
+        if host == LOCAL_HOST and host not in self.host_limits:
+            return self.max_workers
+        return max(1, self.host_limits.get(host, self.per_host))
+
+    def host_limit(self, host: str) -> int:
+        """Returns how many units may run concurrently against a host right now"""
+        limit = self.configured_limit(host)
+        if host in self._windows:
+            return max(1, min(limit, int(self._windows[host])))
+        return limit
+
+    def record_success(self, host: str) -> None:
+        """Additive increase, a throttled host gets one slot back per window of healthy calls"""
+        window = self._windows.get(host)
+        if not self.adaptive or window is None:
+            return
+        window += 1 / window
+        if window >= self.configured_limit(host):
+            del self._windows[host]
+            logger.info("Concurrency for %s is back to %s", host, self.configured_limit(host))
+        else:
+            self._windows[host] = window
+
+    def record_congestion(self, host: str) -> None:
+        """Multiplicative decrease, halves the concurrency of a host that throttles or times out.
+
+        Calls failing together report the same congestion, so a host is halved at most
+        once per DECREASE_INTERVAL seconds.
+        """
+        if not self.adaptive:
+            return
+        now = time.monotonic()
+        if now - self._last_decrease.get(host, float("-inf")) < DECREASE_INTERVAL:
+            return
+        self._last_decrease[host] = now
+        window = max(1.0, self._windows.get(host, self.configured_limit(host)) / 2)
+        self._windows[host] = window
+        logger.warning("Reducing concurrency for %s to %s after throttling", host, int(window))
+
+    async def run(
+        self,
+        units: Iterable[T],
+        handler: Callable[[T], Awaitable[R]],
+        key: Callable[[T], str],
+    ) -> List[R]:
+        """Runs the handler for every unit and returns the results in input order.
+
+        On the first failure no new units are started, the ones in flight are allowed to
+        finish and the error is raised.
+        """
+        pending = list(enumerate(units))
+        pending.reverse()
+        queued_at = time.monotonic()
+        results: List[R] = [None] * len(pending)
+        running: Dict[asyncio.Task, str] = {}
+        active: Counter = Counter()
+        first_error: Optional[BaseException] = None
+
+        while running or (pending and first_error is None):
+            if first_error is None:
+                self._dispatch(
+                    pending, running, active, results=results, handler=handler, key=key, queued_at=queued_at
+                )
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                active[running.pop(task)] -= 1
+                if task.exception() is not None and first_error is None:
+                    first_error = task.exception()
+                    logger.error(
+                        "Work unit failed, waiting for %s running units before stopping: %s",
+                        len(running),
+                        first_error,
+                    )
+
+        if first_error is not None:
+            raise first_error
+        return results
+
+    def _dispatch(self, pending, running, active, *, results, handler, key, queued_at) -> None:
+        """Starts the next units, in order, whose host still has a free slot"""
+        skipped = []
+        while pending and len(running) < self.max_workers:
+            idx, unit = pending.pop()
+            host = key(unit)
+            if active[host] >= self.host_limit(host):
+                skipped.append((idx, unit))
+                continue
+
+            active[host] += 1
+            task = asyncio.create_task(self._run_unit(idx, unit, handler, results, queued_at))
+            running[task] = host
+
+        pending.extend(reversed(skipped))
+
+    @staticmethod
+    async def _run_unit(idx, unit, handler, results, queued_at) -> None:
+        # each unit runs in its own task, so the context variable only covers this unit
+        tracing.queue_wait.set(time.monotonic() - queued_at)
+        results[idx] = await handler(unit)
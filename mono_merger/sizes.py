@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Iterable, List, Optional, Sequence, Set, Tuple
+
+import aiofiles
+import aiofiles.os
+
+from mono_merger.async_git import AsyncGitRepo
+from mono_merger.history import path_selected, unquote_path
+
+
+@dataclass(slots=True)
+class BlobEntry:
+    """A file of an imported tree with its size in bytes"""
+
+    path: str
+    sha: str
+    size: int
+
+
+@dataclass
+class SizeReport:  # pylint: disable=too-many-instance-attributes
+    """Unpacked size and largest files of what a branch adds at its prefix"""
+
+    # one field per key of a prefix in sizes.json
+
+    prefix: str
+    files: int
+    total: int
+    largest: List[BlobEntry] = field(default_factory=list)
+    oversized: List[BlobEntry] = field(default_factory=list)
+    filtered: int = 0
+    # files a partial fetch left out, counted in `files` but not in `total`
+    unsized: int = 0
+    budget: Optional[int] = None
+
+    @property
+    def over_budget(self) -> bool:
+        return self.budget is not None and self.total > self.budget
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def format_size(size: int) -> str:
+    """Human readable size in powers of 1024"""
+    value = float(size)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{size} B"
+
+
+async def list_blobs(
+    repo: AsyncGitRepo, treeish: str, *, present_only: bool = False
+) -> List[Tuple[str, str, Optional[int]]]:
+    """Path, object id and size of every file in a tree.
+
+    `ls-tree -l` fetches every blob a partial fetch left out, one at a time, to size
+    it. With `present_only` only the blobs in the repository are sized, the others
+    are listed with a size of None.
+    """
+    if not present_only:
+        return [
+            (path, sha, int(size))
+            for path, sha, size in await _list_tree(repo, "ls-tree", "-r", "-l", treeish)
+        ]
+
+    missing = set(await repo.missing_objects(f"{treeish}^{{tree}}"))
+    blobs = await _list_tree(repo, "ls-tree", "-r", treeish)
+    sizes = await repo.object_sizes([sha for _, sha, _ in blobs if sha not in missing])
+    return [(path, sha, sizes.get(sha)) for path, sha, _ in blobs]
+
+
+async def _list_tree(repo: AsyncGitRepo, *args: str) -> List[Tuple[str, str, str]]:
+    """Path, object id and the size column, if listed, of the blobs of an ls-tree listing"""
+    blobs = []
+    for line in (await repo.run_git_command(*args, timeout=1800)).splitlines():
+        info, _, raw_path = line.partition("\t")
+        _, object_type, sha, *size = info.split()
+        if object_type == "blob":
+            path = unquote_path(raw_path.encode()).decode(errors="surrogateescape")
+            blobs.append((path, sha, size[0] if size else ""))
+    return blobs
+
+
+async def list_large_blobs(repo: AsyncGitRepo, rev: str, min_size: int) -> Set[str]:
+    """Ids of the blobs of at least `min_size` bytes in the history of a revision"""
+    omitted = await repo.run_git_command(
+        "rev-list", "--objects", "--no-object-names", f"--filter=blob:limit={min_size}",
+        "--filter-print-omitted", rev, timeout=1800,
+    )
+    return {line[1:] for line in omitted.splitlines() if line.startswith("~")}
+
+
+def analyze_blobs(
+    prefix: str,
+    blobs: Iterable[Tuple[str, str, Optional[int]]],
+    top: int,
+    *,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = (),
+    max_blob_size: Optional[int] = None,
+    budget: Optional[int] = None,
+) -> Tuple[SizeReport, List[str]]:
+    """Sizes up the files of a tree that pass the path and size filters.
+
+    Files of unknown size, left out by a partial fetch, are only filtered by path.
+    Returns the report and the paths the filters leave out of the import.
+    """
+    kept: List[BlobEntry] = []
+    oversized: List[BlobEntry] = []
+    dropped: List[str] = []
+    unsized = 0
+    for path, sha, size in blobs:
+        if not path_selected(path, include, exclude):
+            dropped.append(path)
+        elif size is None:
+            unsized += 1
+        elif max_blob_size is not None and size > max_blob_size:
+            oversized.append(BlobEntry(path, sha, size))
+            dropped.append(path)
+        else:
+            kept.append(BlobEntry(path, sha, size))
+
+    report = SizeReport(
+        prefix=prefix,
+        files=len(kept) + unsized,
+        total=sum(blob.size for blob in kept),
+        largest=heapq.nlargest(top, kept, key=lambda blob: blob.size),
+        oversized=sorted(oversized, key=lambda blob: blob.size, reverse=True),
+        filtered=len(dropped) - len(oversized),
+        unsized=unsized,
+        budget=budget,
+    )
+    return report, dropped
+
+
+def describe_report(report: SizeReport) -> str:
+    """One line summary of a prefix, its size and its largest files"""
+    largest = ", ".join(f"{blob.path} ({format_size(blob.size)})" for blob in report.largest)
+    return (
+        f"{report.prefix}: {report.files} files, {format_size(report.total)} unpacked"
+        + (f", largest: {largest}" if largest else "")
+        + (f", {report.unsized} files not fetched yet and not sized" if report.unsized else "")
+    )
+
+
+def format_size_summary(reports: List[SizeReport], top: int) -> str:
+    """Table of the `top` largest prefixes of a run"""
+    largest = heapq.nlargest(top, reports, key=lambda report: report.total)
+    width = max([len(report.prefix) for report in largest] + [6])
+    lines = [f"{'PREFIX':<{width}}  {'FILES':>8}  {'UNPACKED':>10}  LARGEST FILE"]
+    for report in largest:
+        biggest = report.largest[0] if report.largest else None
+        lines.append(
+            f"{report.prefix:<{width}}  {report.files:>8}  {format_size(report.total):>10}  "
+            + (f"{biggest.path} ({format_size(biggest.size)})" if biggest else "-")
+        )
+    lines.append(
+        f"{len(reports)} prefixes, {format_size(sum(report.total for report in reports))} unpacked in total"
+    )
+    return "\n".join(lines)
+
+
+async def save_size_reports(path: Path, reports: List[SizeReport]) -> None:
+    """Atomically writes the reports of a run, largest prefix first"""
+    await aiofiles.os.makedirs(path.parent, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    ordered = sorted(reports, key=lambda report: report.total, reverse=True)
+    async with aiofiles.open(tmp_path, "w", encoding="utf-8") as file:
+        await file.write(json.dumps({"prefixes": [report.to_dict() for report in ordered]}, indent=2))
+    await asyncio.to_thread(os.replace, tmp_path, path)
@@ -0,0 +1,110 @@
+import asyncio
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import aiofiles
+import aiofiles.os
+
+from mono_merger.config import logger
+
+
+@dataclass
+class UnitState:
+    """A completed import of one branch at its prefix"""
+
+    prefix: str
+    url: str
+    branch: str
+    sha: str
+    completed_at: float
+
+
+class MergeState:
+    """Persistent record of the completed imports of an output repo, used to resume runs.
+
+    The state file is a journal with one JSON line per completed import, appended as
+    imports finish so that recording one costs the same however many came before it.
+    A later line for a prefix replaces the earlier ones, loading compacts the file.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.units: Dict[str, UnitState] = {}
+        self._lock = asyncio.Lock()
+
+    @classmethod
+    def for_repo(cls, repo_path: Path) -> "MergeState":
+        """Returns the state stored inside the .git directory of an output repo"""
+        return cls(Path(repo_path) / ".git" / "mono-merger" / "state.jsonl")
+
+    async def load(self) -> None:
+        """Reads the state file, starting empty when there is none"""
+        if not await aiofiles.os.path.isfile(self.path):
+            logger.debug("No state file at %s", self.path)
+            self.units = {}
+            return
+
+        async with aiofiles.open(self.path, "r", encoding="utf-8") as file:
+            lines = [line for line in (await file.read()).splitlines() if line.strip()]
+        self.units = {}
+        for number, line in enumerate(lines, 1):
+            try:
+                unit = UnitState(**json.loads(line))
+            except (ValueError, TypeError):
+                # a crash in the middle of an append leaves the last line cut short
+                logger.warning("Skipping unreadable line %s of %s", number, self.path)
+                continue
+            self.units[unit.prefix] = unit
+        logger.info("Loaded state with %s completed imports from %s", len(self.units), self.path)
+
+        if len(lines) > len(self.units):
+            async with self._lock:
+                await self.save()
+
+    def get(self, prefix: str) -> Optional[UnitState]:
+        """Returns the completed import at a prefix, if any"""
+        return self.units.get(prefix)
+
+    def is_complete(self, prefix: str) -> bool:
+        """Checks whether the import at a prefix already finished"""
+        return prefix in self.units
+
+    async def record(self, prefix: str, url: str, branch: str, sha: str) -> None:
+        """Marks an import as completed and appends it to the state file"""
+        async with self._lock:
+            unit = UnitState(prefix=prefix, url=url, branch=branch, sha=sha, completed_at=time.time())
+            self.units[prefix] = unit
+            await self._append([unit])
+
+    async def merge(self, units: Iterable[UnitState]) -> None:
+        """Adds completed imports recorded elsewhere, e.g. by a shard, and persists them"""
+        async with self._lock:
+            units = list(units)
+            self.units.update((unit.prefix, unit) for unit in units)
+            await self._append(units)
+
+    async def save_as(self, path: Path) -> None:
+        """Writes a copy of the state to another file"""
+        copy = MergeState(path)
+        copy.units = dict(self.units)
+        await copy.save()
+
+    async def save(self) -> None:
+        """Atomically rewrites the state file with a single line per import"""
+        payload = "".join(json.dumps(asdict(unit)) + "\n" for unit in self.units.values())
+        await aiofiles.os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        async with aiofiles.open(tmp_path, "w", encoding="utf-8") as file:
+            await file.write(payload)
+        await asyncio.to_thread(os.replace, tmp_path, self.path)
+
+    async def _append(self, units: List[UnitState]) -> None:
+        """Appends imports to the state file with a single write"""
+        payload = "".join(json.dumps(asdict(unit)) + "\n" for unit in units)
+        await aiofiles.os.makedirs(self.path.parent, exist_ok=True)
+        async with aiofiles.open(self.path, "a", encoding="utf-8") as file:
+            await file.write(payload)
@@ -0,0 +1,217 @@
+import json
+import math
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import aiofiles
+
+from mono_merger.config import logger
+
+# Set by the code driving a unit of work, read when a git command completes
+current_unit: ContextVar[Tuple[Optional[str], Optional[str]]] = ContextVar(
+    "current_unit", default=(None, None)
+)
+queue_wait: ContextVar[float] = ContextVar("queue_wait", default=0.0)
+
+GROUPED_SUBCOMMANDS = ("subtree", "remote", "multi-pack-index", "commit-graph", "bundle")
+
+
+@dataclass
+class CommandRecord:  # pylint: disable=too-many-instance-attributes
+    """Measurements of a single git invocation"""
+
+    # one field per column of the trace and the summary table
+
+    subcommand: str
+    url: Optional[str]
+    branch: Optional[str]
+    queue_wait: float
+    start: float
+    duration: float
+    exit_code: int
+    output_bytes: int
+
+
+def get_subcommand(args: Sequence[str]) -> str:
+    """Names a git invocation by its subcommand, e.g. `fetch` or `subtree add`"""
+    if not args:
+        return "git"
+    if args[0] in GROUPED_SUBCOMMANDS and len(args) > 1:
+        return f"{args[0]} {args[1]}"
+    return args[0]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a list of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = min(max(1, math.ceil(fraction * len(ordered))), len(ordered))
+    return ordered[rank - 1]
+
+
+class GitTracer:
+    """Collects a record per git command for trace export and an end of run summary"""
+
+    def __init__(self):
+        self.records: List[CommandRecord] = []
+        self.origin = time.monotonic()
+
+    def record(
+        self,
+        args: Sequence[str],
+        start: float,
+        duration: float,
+        *,
+        exit_code: int,
+        output_bytes: int,
+    ) -> None:
+        """Stores a completed command along with the unit of work it belongs to"""
+        url, branch = current_unit.get()
+        self.records.append(
+            CommandRecord(
+                subcommand=get_subcommand(args),
+                url=url,
+                branch=branch,
+                queue_wait=queue_wait.get(),
+                start=start - self.origin,
+                duration=duration,
+                exit_code=exit_code,
+                output_bytes=output_bytes,
+            )
+        )
+
+    def _lanes(self) -> List[int]:
+        """Assigns every record to the first free lane, so overlapping commands stack up"""
+        lanes: List[int] = [0] * len(self.records)
+        lane_ends: List[float] = []
+        for idx in sorted(range(len(self.records)), key=lambda i: self.records[i].start):
+            record = self.records[idx]
+            lane = next(
+                (lane for lane, end in enumerate(lane_ends) if end <= record.start),
+                len(lane_ends),
+            )
+            if lane == len(lane_ends):
+                lane_ends.append(0.0)
+            lane_ends[lane] = record.start + record.duration
+            lanes[idx] = lane
+        return lanes
+
+    def concurrency_timeline(self) -> List[Tuple[float, int]]:
+        """Number of git processes running after every start or end of a command"""
+        edges = sorted(
+            [(record.start, 1) for record in self.records]
+            + [(record.start + record.duration, -1) for record in self.records],
+            key=lambda edge: (edge[0], edge[1]),
+        )
+        running = 0
+        timeline = []
+        for timestamp, delta in edges:
+            running += delta
+            timeline.append((timestamp, running))
+        return timeline
+
+    def to_chrome_trace(self) -> dict:
+        """Exports the records in the Chrome trace event format, readable by Perfetto"""
+        events = [
+            {
+                "name": record.subcommand,
+                "cat": "git",
+                "ph": "X",
+                "ts": round(record.start * 1e6),
+                "dur": round(record.duration * 1e6),
+                "pid": 1,
+                "tid": lane,
+                "args": {
+                    "url": record.url,
+                    "branch": record.branch,
+                    "queue_wait_s": round(record.queue_wait, 3),
+                    "exit_code": record.exit_code,
+                    "output_bytes": record.output_bytes,
+                },
+            }
+            for record, lane in zip(self.records, self._lanes())
+        ]
+        events.extend(
+            {
+                "name": "running git processes",
+                "ph": "C",
+                "ts": round(timestamp * 1e6),
+                "pid": 1,
+                "args": {"running": running},
+            }
+            for timestamp, running in self.concurrency_timeline()
+        )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    async def write_chrome_trace(self, path: str) -> None:
+        """Writes the Chrome/Perfetto trace file"""
+        async with aiofiles.open(path, "w", encoding="utf-8") as file:
+            await file.write(json.dumps(self.to_chrome_trace()))
+        logger.info("Wrote trace of %s git commands to %s", len(self.records), path)
+
+    def summary(self, top: int = 10) -> dict:
+        """Slowest repos, latency percentiles per subcommand and concurrency over the run"""
+        by_subcommand: Dict[str, List[float]] = defaultdict(list)
+        by_repo: Dict[str, float] = defaultdict(float)
+        for record in self.records:
+            by_subcommand[record.subcommand].append(record.duration)
+            if record.url:
+                by_repo[record.url] += record.duration
+
+        timeline = self.concurrency_timeline()
+        span = (
+            max(record.start + record.duration for record in self.records)
+            - min(record.start for record in self.records)
+            if self.records
+            else 0.0
+        )
+        busy = sum(record.duration for record in self.records)
+        return {
+            "commands": len(self.records),
+            "subcommands": {
+                name: {
+                    "count": len(durations),
+                    "p50": percentile(durations, 0.5),
+                    "p95": percentile(durations, 0.95),
+                    "max": max(durations),
+                    "total": sum(durations),
+                }
+                for name, durations in sorted(by_subcommand.items())
+            },
+            "slowest_repos": sorted(by_repo.items(), key=lambda item: item[1], reverse=True)[:top],
+            "peak_concurrency": max((running for _, running in timeline), default=0),
+            "average_concurrency": busy / span if span else 0.0,
+        }
+
+    def log_summary(self) -> None:
+        """Logs the end of run summary"""
+        if not self.records:
+            logger.info("No git commands were traced")
+            return
+
+        summary = self.summary()
+        logger.info(
+            "Git command summary: %s commands, peak concurrency %s, average concurrency %.1f",
+            summary["commands"],
+            summary["peak_concurrency"],
+            summary["average_concurrency"],
+        )
+        for name, stats in summary["subcommands"].items():
+            logger.info(
+                "  %-18s count=%-6s p50=%.2fs p95=%.2fs max=%.2fs total=%.1fs",
+                name,
+                stats["count"],
+                stats["p50"],
+                stats["p95"],
+                stats["max"],
+                stats["total"],
+            )
+        for url, total in summary["slowest_repos"]:
+            logger.info("  slow repo: %s (%.1fs of git time)", url, total)
+
+
+tracer = GitTracer()
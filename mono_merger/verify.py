@@ -0,0 +1,47 @@
+from dataclasses import dataclass
+from typing import List
+
+# Outcomes of a prefix check
+MATCH = "ok"
+MISMATCH = "mismatch"
+STALE = "stale"
+MISSING = "missing"
+FILTERED = "filtered"
+FAILED_STATUSES = (MISMATCH, STALE, MISSING)
+
+
+@dataclass
+class PrefixCheck:
+    """Tree of a prefix in the output HEAD compared with the tree of its upstream branch tip"""
+
+    prefix: str
+    url: str
+    branch: str
+    expected: str
+    actual: str
+    status: str
+
+
+def classify_prefix(expected: str, actual: str, upstream_moved: bool) -> str:
+    """Tells a matching prefix from one that is missing, outdated or different"""
+    if not actual:
+        return MISSING
+    if actual == expected:
+        return MATCH
+    return STALE if upstream_moved else MISMATCH
+
+
+def format_report(checks: List[PrefixCheck]) -> str:
+    """Renders the prefixes that failed verification followed by a count per status"""
+    lines = [
+        f"{check.status:<9} {check.prefix}  ({check.url} {check.branch}) "
+        f"expected {check.expected[:12] or '-'}, found {check.actual[:12] or '-'}"
+        for check in checks
+        if check.status in FAILED_STATUSES
+    ]
+    counts = {}
+    for check in checks:
+        counts[check.status] = counts.get(check.status, 0) + 1
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    lines.append(f"{len(checks)} prefixes verified: {summary or 'none'}")
+    return "\n".join(lines)
@@ -27,6 +27,8 @@ def mock_async_git(sample_config) -> AsyncGitRepo:
     mock_async_git_svc.init = AsyncMock(
         return_value="Initialized empty Git repository in .git/"
     )
+    mock_async_git_svc.promisor_remotes = AsyncMock(return_value=[])
+    mock_async_git_svc.is_shallow = AsyncMock(return_value=False)
     return mock_async_git_svc
 
 
@@ -1,7 +1,15 @@
 import asyncio
-from unittest.mock import AsyncMock
+from unittest.mock import ANY, AsyncMock, Mock
 import pytest
-from mono_merger.async_git import AsyncGitRepo
+from mono_merger.async_git import (
+    AsyncGitRepo,
+    BatchBackend,
+    BatchProcess,
+    FATAL_ERR_EXIT_CODE,
+    GitCommandError,
+    STDERR_TAIL_LINES,
+    STREAM_LINE_LIMIT,
+)
 
 
 @pytest.mark.asyncio
@@ -27,7 +35,7 @@ async def test_commit(mocker, sample_config):
     mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
     mock_async_git = AsyncGitRepo(sample_config.output_dir)
     await mock_async_git.commit("myCommitMsg")
-    mock_run_git_command.assert_called_once_with("commit", "-m", "myCommitMsg")
+    mock_run_git_command.assert_called_once_with("commit", "-m", "myCommitMsg", env=None)
 
 
 @pytest.mark.asyncio
@@ -52,14 +60,22 @@ async def test_subtree_add(mocker, sample_config):
     )
 
 
+def _mock_process(stdout: bytes, stderr: bytes = b"", returncode: int = 0):
+    process = AsyncMock()
+    process.stdout = asyncio.StreamReader()
+    process.stdout.feed_data(stdout)
+    process.stdout.feed_eof()
+    process.stderr = asyncio.StreamReader()
+    process.stderr.feed_data(stderr)
+    process.stderr.feed_eof()
+    process.returncode = returncode
+    return process
+
+
 @pytest.mark.asyncio
 async def test_run_git_command(mocker, sample_config):
-    mock_process = AsyncMock()
-    mock_process.communicate.return_value = (b"success", b"")
-    mock_process.returncode = 0
-
     mock_create_subprocess = mocker.patch("asyncio.create_subprocess_exec")
-    mock_create_subprocess.return_value = mock_process
+    mock_create_subprocess.return_value = _mock_process(b"success\n")
 
     mock_async_git = AsyncGitRepo(sample_config.output_dir)
     result = await mock_async_git._run_git_command("status")
@@ -71,4 +87,325 @@ async def test_run_git_command(mocker, sample_config):
         cwd=mock_async_git.repo_path,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
+        env=None,
+        limit=STREAM_LINE_LIMIT,
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_git_command_fatal_error_keeps_stderr_tail(mocker, sample_config):
+    stderr = b"".join(f"line {idx}\n".encode() for idx in range(STDERR_TAIL_LINES + 10))
+    mocker.patch("asyncio.create_subprocess_exec").return_value = _mock_process(
+        b"", stderr, FATAL_ERR_EXIT_CODE
+    )
+
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    with pytest.raises(Exception) as exc_info:
+        await mock_async_git._run_git_command("fetch")
+
+    assert "line 0\n" not in str(exc_info.value)
+    assert f"line {STDERR_TAIL_LINES + 9}" in str(exc_info.value)
+
+
+@pytest.mark.asyncio
+async def test_run_git_command_raises_on_any_non_zero_exit(mocker, sample_config):
+    mocker.patch("asyncio.create_subprocess_exec").return_value = _mock_process(
+        b"", b"CONFLICT (content): Merge conflict in a.txt\n", 1
+    )
+
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    with pytest.raises(GitCommandError) as exc_info:
+        await mock_async_git._run_git_command("merge", "feature")
+
+    assert exc_info.value.returncode == 1
+    assert "Merge conflict in a.txt" in exc_info.value.stderr
+
+
+@pytest.mark.asyncio
+async def test_run_git_command_accepts_expected_exit_codes(mocker, sample_config):
+    mocker.patch("asyncio.create_subprocess_exec").return_value = _mock_process(b"", b"", 1)
+
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    result = await mock_async_git.run_git_command("rev-parse", "--verify", "--quiet", "x", ok_returncodes=(0, 1))
+
+    assert result == ""
+
+
+@pytest.mark.asyncio
+async def test_stream_git_command_reports_progress(mocker, sample_config):
+    mocker.patch("asyncio.create_subprocess_exec").return_value = _mock_process(
+        b"a\nb\n", b"Receiving objects:  50% (1/2)\rReceiving objects: 100% (2/2)\n"
+    )
+    progress = []
+
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    lines = [
+        line
+        async for line in mock_async_git._stream_git_command("fetch", on_progress=progress.append)
+    ]
+
+    assert lines == ["a", "b"]
+    assert progress == ["Receiving objects:  50% (1/2)", "Receiving objects: 100% (2/2)"]
+
+
+@pytest.mark.asyncio
+async def test_list_branches(mocker, sample_config):
+    mocker.patch("asyncio.create_subprocess_exec").return_value = _mock_process(
+        b"abc123\trefs/heads/main\ndef456\trefs/heads/release/1.0\n"
+    )
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+
+    heads = await mock_async_git.list_branches("https://github.com/test/repo1.git")
+
+    assert heads == {"main": "abc123", "release/1.0": "def456"}
+
+
+@pytest.mark.asyncio
+async def test_clone_mirror(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.clone_mirror("https://github.com/test/repo1.git", "/cache/repo1.git")
+    mock_run_git_command.assert_called_once_with(
+        "clone",
+        "--mirror",
+        "--progress",
+        "https://github.com/test/repo1.git",
+        "/cache/repo1.git",
+        timeout=1800,
+        on_progress=ANY,
+    )
+
+
+@pytest.mark.asyncio
+async def test_remote_update(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.remote_update()
+    mock_run_git_command.assert_called_once_with(
+        "fetch", "--prune", "--progress", "origin", timeout=1800, on_progress=ANY
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.fetch("/cache/repo1.git", "+refs/heads/main:refs/mono-merger/imports/a")
+    mock_run_git_command.assert_called_once_with(
+        "fetch",
+        "--quiet",
+        "--no-tags",
+        "--no-write-fetch-head",
+        "/cache/repo1.git",
+        "+refs/heads/main:refs/mono-merger/imports/a",
+        timeout=600,
+    )
+
+
+@pytest.mark.asyncio
+async def test_fetch_history_options(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.fetch(
+        "https://github.com/test/repo1.git",
+        "+refs/heads/main:refs/mono-merger/imports/a",
+        depth=1,
+        shallow_since="2020-01-01",
+        filter_spec="blob:none",
+    )
+    mock_run_git_command.assert_called_once_with(
+        "fetch",
+        "--quiet",
+        "--no-tags",
+        "--no-write-fetch-head",
+        "--depth=1",
+        "--shallow-since=2020-01-01",
+        "--filter=blob:none",
+        "https://github.com/test/repo1.git",
+        "+refs/heads/main:refs/mono-merger/imports/a",
+        timeout=600,
     )
+
+
+@pytest.mark.asyncio
+async def test_read_tree_with_private_index(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.read_tree("abc123", prefix="domain1/repo1/main/", index_file="/tmp/index")
+    mock_run_git_command.assert_called_once_with(
+        "read-tree",
+        "--prefix=domain1/repo1/main/",
+        "abc123",
+        env={"GIT_INDEX_FILE": "/tmp/index"},
+    )
+
+
+@pytest.mark.asyncio
+async def test_commit_tree(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.commit_tree("tree1", "msg", "parent1", "parent2")
+    mock_run_git_command.assert_called_once_with(
+        "commit-tree", "tree1", "-m", "msg", "-p", "parent1", "-p", "parent2"
+    )
+
+
+@pytest.mark.asyncio
+async def test_subtree_merge(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.subtree_merge("domain1/repo1/main", "abc123", True)
+    mock_run_git_command.assert_called_once_with(
+        "subtree", "merge", "--prefix", "domain1/repo1/main", "abc123", "--squash", timeout=600
+    )
+
+
+@pytest.mark.asyncio
+async def test_rewrite_history(mocker, sample_config):
+    mock_pipe = mocker.patch.object(AsyncGitRepo, "_pipe_git_commands")
+    rewrite = mocker.Mock()
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.rewrite_history("refs/mono-merger/imports/a", rewrite)
+    mock_pipe.assert_called_once_with(
+        ["fast-export", "--no-data", "--use-done-feature", "--signed-tags=strip", "refs/mono-merger/imports/a"],
+        ["fast-import", "--quiet", "--force", "--done"],
+        rewrite,
+        timeout=3600,
+    )
+
+
+@pytest.mark.asyncio
+async def test_bundle_create(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.bundle_create("/tmp/shard-1-of-2.bundle", "HEAD")
+    mock_run_git_command.assert_called_once_with(
+        "bundle", "create", "--quiet", "/tmp/shard-1-of-2.bundle", "HEAD", timeout=1800
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_alternate_and_dissociate(mocker, temp_dir):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(temp_dir)
+    await mock_async_git.add_alternate("/cache/mirrors/repo1.git/objects")
+    await mock_async_git.add_alternate("/cache/mirrors/repo1.git/objects")
+    await mock_async_git.add_alternate("/cache/mirrors/repo2.git/objects")
+
+    alternates_path = temp_dir / ".git" / "objects" / "info" / "alternates"
+    assert alternates_path.read_text().splitlines() == [
+        "/cache/mirrors/repo1.git/objects",
+        "/cache/mirrors/repo2.git/objects",
+    ]
+
+    await mock_async_git.dissociate()
+    mock_run_git_command.assert_called_once_with("repack", "-a", "-d", "--quiet", timeout=3600)
+    assert not alternates_path.exists()
+
+
+@pytest.mark.asyncio
+async def test_repack(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "_run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    await mock_async_git.repack(window=250, depth=50, threads=4, bitmaps=True, aggressive=True)
+    mock_run_git_command.assert_called_once_with(
+        "repack",
+        "-a",
+        "-d",
+        "--quiet",
+        "-f",
+        "--window=250",
+        "--depth=50",
+        "--threads=4",
+        "--write-bitmap-index",
+        timeout=3600,
+    )
+
+
+@pytest.mark.asyncio
+async def test_count_objects(mocker, sample_config):
+    mocker.patch.object(
+        AsyncGitRepo,
+        "_run_git_command",
+        return_value="count: 12\nsize: 48\nin-pack: 900\npacks: 3\nsize-pack: 622\nalternate: /cache/objects",
+    )
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+    assert await mock_async_git.count_objects() == {
+        "count": 12,
+        "size": 48,
+        "in-pack": 900,
+        "packs": 3,
+        "size-pack": 622,
+    }
+
+
+@pytest.mark.asyncio
+async def test_subprocess_backend_ref_operations(mocker, sample_config):
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "run_git_command", return_value="")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir)
+
+    await mock_async_git.rev_parse("HEAD")
+    await mock_async_git.update_ref("HEAD", "new", "old")
+    await mock_async_git.delete_ref("refs/x")
+
+    assert mock_run_git_command.call_args_list == [
+        mocker.call("rev-parse", "--verify", "--quiet", "HEAD", ok_returncodes=(0, 1)),
+        mocker.call("update-ref", "HEAD", "new", "old"),
+        mocker.call("update-ref", "-d", "refs/x"),
+    ]
+
+
+def test_unknown_backend(sample_config):
+    with pytest.raises(Exception, match="Unknown git backend"):
+        AsyncGitRepo(sample_config.output_dir, backend="libgit2")
+
+
+@pytest.mark.asyncio
+async def test_batch_backend_lookups(mocker, sample_config):
+    mock_request = mocker.patch.object(BatchProcess, "request")
+    mock_run_git_command = mocker.patch.object(AsyncGitRepo, "run_git_command")
+    mock_async_git = AsyncGitRepo(sample_config.output_dir, backend="batch")
+    assert isinstance(mock_async_git.backend, BatchBackend)
+
+    mock_request.return_value = ["abc123 commit 230"]
+    assert await mock_async_git.rev_parse("HEAD") == "abc123"
+    mock_request.assert_called_with("HEAD\n", 1)
+
+    mock_request.return_value = ["HEAD:a b missing"]
+    assert await mock_async_git.rev_parse("HEAD:a b") == ""
+
+    mock_request.return_value = ["def456 tree 66", "HEAD:b missing"]
+    assert await mock_async_git.list_tree_paths("HEAD", ["a", "b"]) == ["a"]
+    mock_request.assert_called_with("HEAD:a\nHEAD:b\n", 2)
+    mock_run_git_command.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_batch_backend_ref_transactions(mocker, sample_config):
+    mock_request = mocker.patch.object(BatchProcess, "request", return_value=["start: ok", "commit: ok"])
+    mock_async_git = AsyncGitRepo(sample_config.output_dir, backend="batch")
+
+    await mock_async_git.update_ref("HEAD", "new", "old")
+    await mock_async_git.delete_ref("refs/x")
+
+    assert mock_request.call_args_list == [
+        mocker.call("start\nupdate HEAD new old\ncommit\n", 2),
+        mocker.call("start\ndelete refs/x\ncommit\n", 2),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_batch_process_failed_transaction(mocker, temp_dir):
+    process = _mock_process(b"start: ok\n", b"fatal: cannot lock ref 'HEAD'\n", FATAL_ERR_EXIT_CODE)
+    process.stdin = Mock()
+    process.stdin.drain = AsyncMock()
+    mock_create_subprocess = mocker.patch("asyncio.create_subprocess_exec", return_value=process)
+
+    batch = BatchProcess(temp_dir, "update-ref", "--stdin")
+    with pytest.raises(GitCommandError) as exc_info:
+        await batch.request("start\nupdate HEAD new old\ncommit\n", 2)
+
+    assert exc_info.value.returncode == FATAL_ERR_EXIT_CODE
+    assert "cannot lock ref" in exc_info.value.stderr
+    process.stdin.write.assert_called_once_with(b"start\nupdate HEAD new old\ncommit\n")
+    mock_create_subprocess.assert_called_once()
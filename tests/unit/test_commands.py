@@ -0,0 +1,177 @@
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+import pytest
+from mono_merger.commands import assemble, bootstrap, dry_run, main, sync, verify
+from mono_merger.verify import PrefixCheck
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.RepoMerger")
+async def test_main(mock_repo_merger_class, mock_async_git, sample_config):
+    mock_instance = AsyncMock()
+    mock_repo_merger_class.return_value = mock_instance
+
+    await main(sample_config, mock_async_git)
+
+    mock_repo_merger_class.assert_any_call(sample_config, mock_async_git)
+    mock_instance.prepare_mono_repo.assert_called_once()
+    mock_instance.clone_repo_branches.assert_called_once()
+    assert sample_config.output_dir.is_dir()
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.RepoMerger")
+async def test_main_plan_failure_leaves_no_output_dir(mock_repo_merger_class, mock_async_git, sample_config):
+    mock_instance = AsyncMock()
+    mock_instance.plan_units.side_effect = ValueError("prefix conflict")
+    mock_repo_merger_class.return_value = mock_instance
+
+    with pytest.raises(ValueError, match="prefix conflict"):
+        await main(sample_config, mock_async_git)
+
+    planning_git = mock_repo_merger_class.call_args_list[-1].args[1]
+    assert planning_git.repo_path == Path.cwd()
+    assert not sample_config.output_dir.exists()
+    mock_instance.prepare_mono_repo.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.main")
+@patch("mono_merger.commands.load_config_async")
+@patch("mono_merger.commands.AsyncGitRepo")
+async def test_bootstrap(
+    mock_async_git_repo_class,
+    mock_load_config_async,
+    mock_main,
+    sample_config,
+):
+    args = SimpleNamespace(config="mock_dir")
+    mock_load_config_async.return_value = sample_config
+
+    mock_async_git_instance = AsyncMock()
+    mock_async_git_repo_class.return_value = mock_async_git_instance
+
+    await bootstrap(args)
+    mock_async_git_repo_class.assert_called_once_with(sample_config.output_dir, backend="subprocess")
+    mock_async_git_instance.close.assert_awaited_once()
+    mock_main.assert_called_once_with(sample_config, mock_async_git_instance)
+
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.RepoMerger")
+async def test_sync(mock_repo_merger_class, mock_async_git, sample_config):
+    mock_instance = AsyncMock()
+    mock_repo_merger_class.return_value = mock_instance
+
+    await sync(sample_config, mock_async_git)
+
+    mock_repo_merger_class.assert_called_once_with(sample_config, mock_async_git)
+    mock_instance.sync_repo_branches.assert_called_once()
+    mock_instance.prepare_mono_repo.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.sync")
+@patch("mono_merger.commands.main")
+@patch("mono_merger.commands.load_config_async")
+@patch("mono_merger.commands.AsyncGitRepo")
+async def test_bootstrap_sync(
+    mock_async_git_repo_class,
+    mock_load_config_async,
+    mock_main,
+    mock_sync,
+    sample_config,
+):
+    args = SimpleNamespace(config="mock_dir", command="sync")
+    mock_load_config_async.return_value = sample_config
+    mock_async_git_repo_class.return_value = AsyncMock()
+
+    await bootstrap(args)
+    mock_sync.assert_called_once_with(sample_config, mock_async_git_repo_class.return_value)
+    mock_main.assert_not_called()
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.format_plan")
+@patch("mono_merger.commands.RepoMerger")
+async def test_dry_run(mock_repo_merger_class, mock_format_plan, mock_async_git, sample_config, capsys):
+    mock_instance = AsyncMock()
+    mock_repo_merger_class.return_value = mock_instance
+    mock_format_plan.return_value = "plan"
+
+    await dry_run(sample_config, mock_async_git)
+
+    mock_instance.plan_run.assert_called_once()
+    mock_instance.prepare_mono_repo.assert_not_called()
+    mock_instance.clone_repo_branches.assert_not_called()
+    assert capsys.readouterr().out == "plan\n"
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.RepoMerger")
+async def test_main_shard(mock_repo_merger_class, mock_async_git, sample_config):
+    mock_instance = AsyncMock()
+    mock_repo_merger_class.return_value = mock_instance
+    sample_config.shard_index, sample_config.shard_count = 1, 2
+    sample_config.bundle_file = "/tmp/shard-1.bundle"
+
+    await main(sample_config, mock_async_git)
+
+    mock_instance.prepare_mono_repo.assert_called_once_with(shared_root=True)
+    mock_instance.clone_repo_branches.assert_called_once()
+    mock_instance.export_bundle.assert_called_once_with("/tmp/shard-1.bundle")
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.assemble")
+@patch("mono_merger.commands.load_config_async")
+@patch("mono_merger.commands.AsyncGitRepo")
+async def test_bootstrap_assemble(
+    mock_async_git_repo_class,
+    mock_load_config_async,
+    mock_assemble,
+    sample_config,
+):
+    args = SimpleNamespace(
+        config="mock_dir", command="assemble", bundles=["a.bundle", "b.bundle"]
+    )
+    mock_load_config_async.return_value = sample_config
+    mock_async_git_repo_class.return_value = AsyncMock()
+
+    await bootstrap(args)
+    mock_assemble.assert_called_once_with(
+        sample_config, mock_async_git_repo_class.return_value, ["a.bundle", "b.bundle"]
+    )
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.RepoMerger")
+async def test_assemble(mock_repo_merger_class, mock_async_git, sample_config):
+    mock_instance = AsyncMock()
+    mock_repo_merger_class.return_value = mock_instance
+
+    await assemble(sample_config, mock_async_git, ["a.bundle"])
+
+    mock_instance.prepare_mono_repo.assert_called_once_with(shared_root=True)
+    mock_instance.assemble_bundles.assert_called_once_with(["a.bundle"])
+
+
+@pytest.mark.asyncio
+@patch("mono_merger.commands.RepoMerger")
+async def test_verify_reports_mismatches(mock_repo_merger_class, mock_async_git, sample_config, capsys):
+    mock_instance = AsyncMock()
+    mock_instance.verify_repo_branches.return_value = [
+        PrefixCheck("domain1/repo1/main", "url", "main", "tree1", "tree1", "ok"),
+        PrefixCheck("domain1/repo2/develop", "url", "develop", "tree3", "tree4", "mismatch"),
+    ]
+    mock_repo_merger_class.return_value = mock_instance
+
+    with pytest.raises(Exception, match="1 of 2 prefixes"):
+        await verify(sample_config, mock_async_git)
+
+    output = capsys.readouterr().out
+    assert "domain1/repo2/develop" in output
+    assert "domain1/repo1/main" not in output
+    assert "2 prefixes verified: 1 mismatch, 1 ok" in output
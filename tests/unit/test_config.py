@@ -0,0 +1,172 @@
+import pytest
+
+from mono_merger.cli import parse_args
+from mono_merger.config import (
+    AppConfig,
+    is_local_source,
+    load_config_async,
+    merge_manifests,
+    parse_size,
+)
+
+
+def _write(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    return path
+
+
+@pytest.mark.asyncio
+async def test_load_config_with_includes(temp_dir):
+    main = _write(
+        temp_dir / "repos.yaml",
+        "output_dir: /tmp/mono\n"
+        "domain_mapping: {domain1: services/domain1}\n"
+        "include: [teams/*.yaml]\n"
+        "repos:\n"
+        "  - url: https://github.com/test/repo1.git\n"
+        "    branches: [{name: main, domain: domain1}]\n",
+    )
+    _write(
+        temp_dir / "teams" / "a.yaml",
+        "domain_mapping: {domain2: services/domain2}\n"
+        "repos:\n"
+        "  - url: https://github.com/test/repo2.git\n"
+        "    branches: [{name: main, domain: domain2}]\n",
+    )
+    _write(
+        temp_dir / "teams" / "b.yaml",
+        "repos:\n"
+        "  - url: https://github.com/test/repo3.git\n"
+        "    branches: [{name: develop, domain: domain1}]\n",
+    )
+
+    config = await load_config_async(str(main))
+
+    assert [repo.url for repo in config.repos] == [
+        "https://github.com/test/repo1.git",
+        "https://github.com/test/repo2.git",
+        "https://github.com/test/repo3.git",
+    ]
+    assert config.domain_mapping == {"domain1": "services/domain1", "domain2": "services/domain2"}
+    # repeated domains share one string
+    assert config.repos[0].branches[0].domain is config.repos[2].branches[0].domain
+
+
+@pytest.mark.asyncio
+async def test_load_config_rejects_settings_in_includes(temp_dir):
+    main = _write(temp_dir / "repos.yaml", "output_dir: /tmp/mono\ndomain_mapping: {}\ninclude: part.yaml\n")
+    _write(temp_dir / "part.yaml", "output_dir: /tmp/other\nrepos: []\n")
+
+    with pytest.raises(ValueError, match="may only set"):
+        await load_config_async(str(main))
+
+
+@pytest.mark.asyncio
+async def test_load_config_rejects_include_cycles(temp_dir):
+    main = _write(temp_dir / "repos.yaml", "output_dir: /tmp/mono\ndomain_mapping: {}\ninclude: part.yaml\n")
+    _write(temp_dir / "part.yaml", "include: repos.yaml\n")
+
+    with pytest.raises(ValueError, match="included more than once"):
+        await load_config_async(str(main))
+
+
+@pytest.mark.asyncio
+async def test_load_config_missing_include(temp_dir):
+    main = _write(temp_dir / "repos.yaml", "output_dir: /tmp/mono\ndomain_mapping: {}\ninclude: missing.yaml\n")
+
+    with pytest.raises(FileNotFoundError):
+        await load_config_async(str(main))
+
+
+def test_merge_manifests_conflicting_domains():
+    with pytest.raises(ValueError, match="mapped to both"):
+        merge_manifests({"domain_mapping": {"d": "a"}}, [{"domain_mapping": {"d": "b"}}])
+
+
+def test_is_local_source():
+    assert is_local_source("/srv/sources/repo1.bundle")
+    assert is_local_source("sources/repo1")
+    assert is_local_source("~/sources/repo1.git")
+    assert not is_local_source("https://github.com/test/repo1.git")
+    assert not is_local_source("git@github.com:test/repo1.git")
+    assert not is_local_source("file:///srv/git/repo1.git")
+
+
+@pytest.mark.asyncio
+async def test_load_config_resolves_local_sources(temp_dir):
+    main = _write(
+        temp_dir / "repos.yaml",
+        "output_dir: /tmp/mono\n"
+        "domain_mapping: {}\n"
+        "include: [teams/a.yaml]\n"
+        "repos:\n"
+        "  - url: bundles/repo1.bundle\n"
+        "    branches: [{name: main, domain: domain1}]\n"
+        "  - url: /srv/clones/repo2\n"
+        "    branches: [{name: main, domain: domain1}]\n",
+    )
+    _write(
+        temp_dir / "teams" / "a.yaml",
+        "repos:\n"
+        "  - url: ../clones/repo3\n"
+        "    branches: [{name: main, domain: domain1}]\n"
+        "  - url: git@github.com:test/repo4.git\n"
+        "    branches: [{name: main, domain: domain1}]\n",
+    )
+
+    config = await load_config_async(str(main))
+
+    assert [repo.url for repo in config.repos] == [
+        str(temp_dir.resolve() / "bundles" / "repo1.bundle"),
+        "/srv/clones/repo2",
+        str(temp_dir.resolve() / "clones" / "repo3"),
+        "git@github.com:test/repo4.git",
+    ]
+
+
+def test_parse_size():
+    assert parse_size(1048576) == 1048576
+    assert parse_size("512K") == 512 * 1024
+    assert parse_size("50MB") == 50 * 1024**2
+    assert parse_size("1.5GiB") == int(1.5 * 1024**3)
+    with pytest.raises(ValueError):
+        parse_size("big")
+
+
+def test_size_options_and_analysis():
+    config = AppConfig.from_dict(
+        {
+            "output_dir": "/tmp/mono",
+            "domain_mapping": {},
+            "analysis": {"top": 5, "on_budget": "fail"},
+            "repos": [
+                {
+                    "url": "https://github.com/test/repo1.git",
+                    "size_budget": "1G",
+                    "max_blob_size": "10M",
+                    "branches": [{"name": "main", "domain": "domain1", "max_blob_size": "50M"}],
+                }
+            ],
+        }
+    )
+
+    (repo,) = config.repos
+    assert (repo.size_budget, repo.max_blob_size) == (1024**3, 10 * 1024**2)
+    assert (repo.branches[0].size_budget, repo.branches[0].max_blob_size) == (None, 50 * 1024**2)
+    assert (config.analysis.enabled, config.analysis.top, config.analysis.on_budget) == (True, 5, "fail")
+
+    with pytest.raises(ValueError, match="on_budget"):
+        AppConfig.from_dict(
+            {"output_dir": "/tmp/mono", "domain_mapping": {}, "repos": [], "analysis": {"on_budget": "ignore"}}
+        )
+
+
+def test_parse_args_dry_run_only_plans_merges(capsys):
+    assert parse_args(["--config", "config.yaml", "--dry-run"]).dry_run
+    assert parse_args(["merge", "--config", "config.yaml", "--dry-run"]).dry_run
+
+    for command in ("sync", "verify", "assemble"):
+        with pytest.raises(SystemExit):
+            parse_args([command, "--config", "config.yaml", "--dry-run"])
+        assert f"cannot be combined with {command}" in capsys.readouterr().err
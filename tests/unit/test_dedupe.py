@@ -0,0 +1,60 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock
+
+from mono_merger.dedupe import TipIndex
+
+
+def test_summarize_counts_distinct_tips():
+    keys = [("sha1", ()), ("sha1", ()), ("sha2", ()), ("", ()), ("sha1", (("depth", 1),))]
+    assert TipIndex.summarize(keys) == (4, 3)
+
+
+@pytest.mark.asyncio
+async def test_fetch_shares_a_tip():
+    tips = TipIndex()
+    fetch = AsyncMock(return_value="sha1")
+
+    results = await asyncio.gather(
+        tips.fetch(("sha1", ()), "repo1", fetch),
+        tips.fetch(("sha1", ()), "repo2", fetch),
+        tips.fetch(("sha1", ()), "repo2", fetch),
+    )
+
+    assert results == [("sha1", False), ("sha1", True), ("sha1", True)]
+    assert fetch.await_count == 1
+    assert (tips.fetches, tips.skipped, tips.shared_urls - tips.fetched_urls) == (1, 2, {"repo2"})
+
+
+@pytest.mark.asyncio
+async def test_fetch_without_tip_is_not_shared():
+    tips = TipIndex()
+    fetch = AsyncMock(return_value="sha1")
+
+    assert await tips.fetch(("", ()), "repo1", fetch) == ("sha1", False)
+    assert await tips.fetch(("", ()), "repo1", fetch) == ("sha1", False)
+    assert fetch.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_fetch_falls_back_when_the_tip_moved():
+    tips = TipIndex()
+    moved = AsyncMock(return_value="sha1new")
+    own = AsyncMock(return_value="sha1")
+
+    assert await tips.fetch(("sha1", ()), "repo1", moved) == ("sha1new", False)
+    assert await tips.fetch(("sha1", ()), "repo2", own) == ("sha1", False)
+    own.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_failed_fetch_is_retried_by_the_next_unit():
+    tips = TipIndex()
+    failing = AsyncMock(side_effect=RuntimeError("boom"))
+    fetch = AsyncMock(return_value="sha1")
+
+    with pytest.raises(RuntimeError):
+        await tips.fetch(("sha1", ()), "repo1", failing)
+    assert await tips.fetch(("sha1", ()), "repo1", fetch) == ("sha1", False)
+    assert tips.fetches == 1
@@ -0,0 +1,70 @@
+from unittest.mock import Mock, AsyncMock
+
+import pytest
+
+from mono_merger.async_git import AsyncGitRepo
+from mono_merger.config import BranchConfig
+from mono_merger.discovery import (
+    BranchDiscovery,
+    branch_matches,
+    is_branch_pattern,
+    select_branches,
+)
+
+
+def test_branch_patterns():
+    assert is_branch_pattern("all")
+    assert is_branch_pattern("release/*")
+    assert is_branch_pattern(r"re:v\d+")
+    assert not is_branch_pattern("main")
+
+    assert branch_matches("release/*", "release/1.0")
+    assert not branch_matches("release/*", "hotfix/1.0")
+    assert branch_matches(r"re:release/\d+\.\d+", "release/1.0")
+    assert not branch_matches(r"re:release/\d+", "release/1.0")
+
+
+def test_select_branches_with_exclude():
+    selector = BranchConfig(name="release/*", domain="domain1", exclude=["release/*-rc", "re:.*/old"])
+    names = ["main", "release/1.0", "release/2.0-rc", "release/old"]
+    assert select_branches(selector, names) == ["release/1.0"]
+
+
+@pytest.fixture
+def mock_git():
+    git = Mock(spec=AsyncGitRepo)
+    git.list_branches = AsyncMock(return_value={"main": "abc123"})
+    return git
+
+
+@pytest.mark.asyncio
+async def test_list_heads_uses_fresh_cache(mock_git, temp_dir):
+    url = "https://github.com/test/repo1.git"
+    discovery = BranchDiscovery(mock_git, str(temp_dir), ttl=600)
+    await discovery.load()
+    assert await discovery.list_heads(url) == {"main": "abc123"}
+    await discovery.save()
+
+    cached = BranchDiscovery(mock_git, str(temp_dir), ttl=600)
+    await cached.load()
+    assert await cached.list_heads(url) == {"main": "abc123"}
+    assert await cached.list_heads(url, use_cache=False) == {"main": "abc123"}
+
+    assert mock_git.list_branches.call_count == 2
+    assert (cached.hits, cached.misses) == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_list_heads_without_ttl(mock_git, temp_dir):
+    discovery = BranchDiscovery(mock_git, str(temp_dir), ttl=0)
+    await discovery.list_heads("https://github.com/test/repo1.git")
+    await discovery.list_heads("https://github.com/test/repo1.git")
+    assert mock_git.list_branches.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_list_heads_reads_local_sources_directly(mock_git, temp_dir):
+    discovery = BranchDiscovery(mock_git, str(temp_dir), ttl=600)
+    await discovery.list_heads("/srv/bundles/repo1.bundle")
+    await discovery.list_heads("/srv/bundles/repo1.bundle")
+    assert mock_git.list_branches.call_count == 2
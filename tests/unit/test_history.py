@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from mono_merger.history import (
+    HistoryMarks,
+    path_selected,
+    quote_path,
+    rewrite_fast_export,
+    unquote_path,
+)
+
+
+def test_quote_round_trip():
+    assert unquote_path(b'"we\\"ird\\tname\\303\\251.txt"') == 'we"ird\tnameé.txt'.encode()
+    assert quote_path(b'src/we"ird\tname.txt') == b'"src/we\\"ird\\tname.txt"'
+    assert quote_path(b"src/plain name.txt") == b"src/plain name.txt"
+    assert unquote_path(quote_path(b'"a\nb')) == b'"a\nb'
+
+
+def test_path_selected():
+    assert path_selected("src/app.py", [], [])
+    assert path_selected("src/app.py", ["src"], [])
+    assert not path_selected("docs/index.md", ["src/"], [])
+    assert not path_selected("src/app.min.js", [], ["*.min.js"])
+    assert not path_selected("src/vendor/lib.py", ["src"], ["src/vendor"])
+
+
+async def _rewrite(stream_bytes: bytes, **filters) -> bytes:
+    stream = asyncio.StreamReader()
+    stream.feed_data(stream_bytes)
+    stream.feed_eof()
+    chunks = [
+        chunk
+        async for chunk in rewrite_fast_export(
+            stream, "domain1/repo1/main", "refs/mono-merger/history/x", **filters
+        )
+    ]
+    return b"".join(chunks)
+
+
+@pytest.mark.asyncio
+async def test_rewrite_fast_export():
+    message = b"fix\nM 100644 abc fake.txt\n"
+    source = (
+        b"feature done\n"
+        b"reset refs/mono-merger/imports/domain1/repo1/main\n"
+        b"commit refs/mono-merger/imports/domain1/repo1/main\n"
+        b"mark :1\n"
+        b"committer a <a@a> 1700000000 +0000\n"
+        b"data %d\n%s" % (len(message), message)
+        + b"deleteall\n"
+        b"M 100644 1111111111111111111111111111111111111111 src/app.py\n"
+        b'M 100644 2222222222222222222222222222222222222222 "docs/we\\"ird.md"\n'
+        b"D src/old.py\n"
+        b"\n"
+        b"done\n"
+    )
+
+    rewritten = await _rewrite(source, exclude=["docs"])
+
+    assert rewritten == (
+        b"feature done\n"
+        b"reset refs/mono-merger/history/x\n"
+        b"commit refs/mono-merger/history/x\n"
+        b"mark :1\n"
+        b"committer a <a@a> 1700000000 +0000\n"
+        b"data %d\n%s" % (len(message), message)
+        + b"deleteall\n"
+        b"M 100644 1111111111111111111111111111111111111111 domain1/repo1/main/src/app.py\n"
+        b"D domain1/repo1/main/src/old.py\n"
+        b"\n"
+        b"done\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_rewrite_fast_export_rejects_renames():
+    with pytest.raises(Exception):
+        await _rewrite(b"R src/a.py src/b.py\n")
+
+
+@pytest.mark.asyncio
+async def test_rewrite_fast_export_drops_blobs():
+    source = (
+        b"M 100644 1111111111111111111111111111111111111111 src/app.py\n"
+        b"M 100644 2222222222222222222222222222222222222222 vendor/tool.bin\n"
+    )
+
+    rewritten = await _rewrite(source, drop_blobs={"2222222222222222222222222222222222222222"})
+
+    assert rewritten == b"M 100644 1111111111111111111111111111111111111111 domain1/repo1/main/src/app.py\n"
+
+
+@pytest.mark.asyncio
+async def test_history_marks_apply_to_the_same_settings_only(temp_dir):
+    marks = HistoryMarks(temp_dir / "marks", "settings-a")
+    assert not await marks.load()
+    assert marks.fast_export_args(False) == [f"--export-marks={marks.source}.new"]
+
+    for path in (marks.source, marks.rewritten):
+        path.with_name(path.name + ".new").write_text(":1 1111111111111111111111111111111111111111\n")
+    await marks.save()
+
+    assert await marks.load()
+    assert marks.fast_import_args(True) == [
+        f"--import-marks={marks.rewritten}",
+        f"--export-marks={marks.rewritten}.new",
+    ]
+    assert not await HistoryMarks(temp_dir / "marks", "settings-b").load()
+
+    await marks.clear()
+    assert not await marks.load()
@@ -0,0 +1,71 @@
+import logging
+
+from mono_merger.config import LogConfig
+from mono_merger.log_pipeline import LogPipeline, LogVolumeFilter, truncate_message
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def _logger(name):
+    target = logging.getLogger(f"mono-merger-test.{name}")
+    target.setLevel(logging.INFO)
+    target.propagate = False
+    handler = ListHandler()
+    target.handlers = [handler]
+    return target, handler
+
+
+def test_truncate_message():
+    assert truncate_message("short", 10) == "short"
+    assert truncate_message("x" * 100, 0) == "x" * 100
+    truncated = truncate_message("a" * 50 + "b" * 50, 20)
+    assert truncated.startswith("a" * 10) and truncated.endswith("b" * 10)
+    assert "[80 characters omitted]" in truncated
+
+
+def test_volume_filter_truncates_and_enforces_budget():
+    target, handler = _logger("budget")
+    volume_filter = LogVolumeFilter(max_message=20, budget=100)
+    target.addFilter(volume_filter)
+
+    target.info("output: %s", "x" * 1000)
+    target.info("second message that crosses the budget")
+    target.info("dropped")
+    target.warning("kept")
+
+    assert "characters omitted" in handler.messages[0]
+    assert "log budget" not in handler.messages[0]
+    assert "log budget reached" in handler.messages[1]
+    assert handler.messages[2:] == ["kept"]
+    assert volume_filter.dropped == 1
+
+
+def test_pipeline_moves_handlers_behind_queue():
+    target, handler = _logger("queue")
+
+    pipeline = LogPipeline(LogConfig(), target).start()
+    assert handler not in target.handlers
+    target.info("through the queue")
+    pipeline.stop()
+
+    assert target.handlers == [handler]
+    assert handler.messages == ["through the queue"]
+    assert not target.filters
+
+
+def test_pipeline_without_queue():
+    target, handler = _logger("direct")
+
+    pipeline = LogPipeline(LogConfig(queued=False), target).start()
+    assert target.handlers == [handler]
+    target.info("direct")
+    pipeline.stop()
+
+    assert handler.messages == ["direct"]
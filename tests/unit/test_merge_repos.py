@@ -1,7 +1,25 @@
-from unittest.mock import AsyncMock
+import asyncio
+import dataclasses
+import subprocess
+import time
+from unittest.mock import ANY
+
 import pytest
 
-from mono_merger.merge_repos import RepoMerger, get_repo_name
+from mono_merger.async_git import AsyncGitRepo, GitCommandError
+from mono_merger.config import BranchConfig, RepoConfig
+from mono_merger.history import rewrite_fast_export
+from mono_merger.state import MergeState
+from mono_merger.merge_repos import (
+    RepoMerger,
+    get_bundle_path,
+    get_fetch_options,
+    get_repo_host,
+    get_repo_name,
+    get_shard_repos,
+    get_unit_prefix,
+    group_staging_units,
+)
 
 
 @pytest.mark.asyncio
@@ -23,36 +41,754 @@ async def test_prepare_mono_repo(mock_async_git, sample_config, mock_aiofiles):
 
     mock_async_git.init.assert_called()
     mock_async_git.add.assert_called_with("README.md")
-    mock_async_git.commit.assert_called_with("first commit")
+    mock_async_git.commit.assert_called_with("first commit", env=None)
 
 
 @pytest.mark.asyncio
-async def test_clone_repo_branches(mock_async_git, sample_config, mocker):
-    # Mock the call to subtree_add
-    mock_subtree_add = mocker.patch.object(
-        RepoMerger, "_subtree_add_branches", new_callable=AsyncMock
-    )
+async def test_clone_repo_branches(mock_async_git, sample_config):
+    mock_async_git.rev_parse.return_value = "abc123"
     mono_merger = RepoMerger(sample_config, mock_async_git)
     await mono_merger.clone_repo_branches()
 
-    assert mock_subtree_add.call_count == len(sample_config.repos)
+    total_branches = sum(len(repo.branches) for repo in sample_config.repos)
+    assert mock_async_git.subtree_add.call_count == total_branches
 
     for repo in sample_config.repos:
-        mock_subtree_add.assert_any_call(repo)
+        for branch in repo.branches:
+            prefix = f"{sample_config.domain_mapping[branch.domain]}/{get_repo_name(repo.url)}/{branch.name}"
+            mock_async_git.fetch.assert_any_call(
+                repo.url, f"+refs/heads/{branch.name}:refs/mono-merger/imports/{prefix}"
+            )
+            mock_async_git.subtree_add.assert_any_call(prefix, None, "abc123", True)
+            assert mono_merger.state.get(prefix).sha == "abc123"
 
 
 @pytest.mark.asyncio
-async def test_subtree_add_branches(mock_async_git, sample_config, mocker):
+async def test_clone_repo_branches_resume(mock_async_git, sample_config):
+    sample_config.resume = True
+    mock_async_git.rev_parse.return_value = "abc123"
+    mock_async_git.list_tree_paths.return_value = ["services/domain2/repo1/feature"]
     mono_merger = RepoMerger(sample_config, mock_async_git)
+    await mono_merger.state.record("services/domain1/repo1/main", "https://github.com/test/repo1.git", "main", "old123")
 
-    for repo in sample_config.repos:
-        await mono_merger._subtree_add_branches(repo)
+    await mono_merger.clone_repo_branches()
+
+    mock_async_git.list_tree_paths.assert_called_once_with(
+        "HEAD", ["services/domain2/repo1/feature", "services/domain1/repo2/develop"]
+    )
+    mock_async_git.reset_hard.assert_called_once_with()
+    mock_async_git.clean.assert_called_once_with(
+        ["services/domain2/repo1/feature", "services/domain1/repo2/develop"]
+    )
+    mock_async_git.subtree_add.assert_called_once_with("services/domain1/repo2/develop", None, "abc123", True)
+    assert mono_merger.state.get("services/domain1/repo1/main").sha == "old123"
+    assert mono_merger.state.get("services/domain2/repo1/feature").sha == ""
+
+
+@pytest.mark.asyncio
+async def test_prepare_mono_repo_resume(mock_async_git, sample_config):
+    sample_config.resume = True
+    (sample_config.output_dir / ".git").mkdir(parents=True)
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.prepare_mono_repo()
+
+    mock_async_git.init.assert_not_called()
+    mock_async_git.commit.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_plan_repo_units_all_branches(mock_async_git, sample_config):
+    mock_async_git.list_branches.return_value = {"main": "abc123", "release/1.0": "def456"}
+    repo = RepoConfig(
+        url="git@github.com:test/repo3.git",
+        branches=[BranchConfig(name="all", domain="domain3")],
+    )
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    units = await mono_merger._plan_repo_units(repo)
+
+    mock_async_git.list_branches.assert_called_once_with(repo.url)
+    assert [unit.prefix for unit in units] == [
+        "domain3/repo3/main",
+        "domain3/repo3/release/1.0",
+    ]
+    assert all(unit.host == "github.com" for unit in units)
+
+
+@pytest.mark.asyncio
+async def test_plan_repo_units_patterns(mock_async_git, sample_config):
+    mock_async_git.list_branches.return_value = {
+        "main": "abc123",
+        "release/1.0": "def456",
+        "release/2.0-rc": "fed654",
+        "v10": "aaa111",
+    }
+    repo = RepoConfig(
+        url="git@github.com:test/repo3.git",
+        branches=[
+            BranchConfig(name="release/1.0", domain="domain1"),
+            BranchConfig(name="release/*", domain="domain3", exclude=["*-rc"]),
+            BranchConfig(name=r"re:v\d+", domain="domain2"),
+        ],
+    )
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    units = await mono_merger._plan_repo_units(repo)
+
+    mock_async_git.list_branches.assert_called_once_with(repo.url)
+    assert [unit.prefix for unit in units] == [
+        "services/domain1/repo3/release/1.0",
+        "services/domain2/repo3/v10",
+    ]
+    assert [unit.sha for unit in units] == ["def456", "aaa111"]
+
+
+def test_get_fetch_options():
+    repo = RepoConfig(
+        url="https://github.com/test/repo1.git",
+        branches=[],
+        depth=1,
+        filter="blob:none",
+    )
+    assert get_fetch_options(repo, BranchConfig(name="main", domain="domain1")) == {
+        "depth": 1,
+        "filter_spec": "blob:none",
+    }
+    assert get_fetch_options(
+        repo, BranchConfig(name="main", domain="domain1", depth=50, shallow_since="2020-01-01")
+    ) == {"depth": 50, "shallow_since": "2020-01-01", "filter_spec": "blob:none"}
+
+
+def _git(*args, cwd):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+
+def _make_source_repo(path, commits):
+    path.mkdir(parents=True)
+    _git("init", "--quiet", "--initial-branch=main", cwd=path)
+    for idx in range(commits):
+        (path / "version.txt").write_text(f"{path.name} {idx}\n")
+        _git("add", "version.txt", cwd=path)
+        _git("commit", "--quiet", "-m", f"commit {idx}", cwd=path)
+    return str(path)
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_shallow(sample_config, temp_dir, monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "mono-merger")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "mono-merger@example.com")
+    sample_config.repos = [
+        RepoConfig(
+            url=_make_source_repo(temp_dir / "sources" / f"repo{idx}", 3),
+            branches=[BranchConfig(name="main", domain="domain1")],
+            depth=1,
+        )
+        for idx in range(6)
+    ]
+    mono_repo = AsyncGitRepo(sample_config.output_dir)
+    mono_merger = RepoMerger(sample_config, mono_repo)
+    shallow_file = sample_config.output_dir / ".git" / "shallow"
+    shallow_commits = []
+    prune = mono_repo.prune
+
+    async def reading_prune():
+        shallow_commits.extend(shallow_file.read_text().split())
+        return await prune()
+
+    monkeypatch.setattr(mono_repo, "prune", reading_prune)
+
+    await mono_merger.prepare_mono_repo()
+    await mono_merger.clone_repo_branches()
+
+    for idx in range(6):
+        prefix = f"services/domain1/repo{idx}/main"
+        assert (sample_config.output_dir / prefix / "version.txt").read_text() == f"repo{idx} 2\n"
+        assert mono_merger.state.is_complete(prefix)
+    # every shallow fetch brought in a single commit, pruned once its import ref was gone
+    assert len(shallow_commits) == 6
+    assert not shallow_file.exists()
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_resume_after_interrupted_subtree_add(sample_config, temp_dir, monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "mono-merger")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "mono-merger@example.com")
+    sample_config.repos = [
+        RepoConfig(
+            url=_make_source_repo(temp_dir / "sources" / "repo1", 2),
+            branches=[BranchConfig(name="main", domain="domain1")],
+        )
+    ]
+    mono_merger = RepoMerger(sample_config, AsyncGitRepo(sample_config.output_dir))
+    await mono_merger.prepare_mono_repo()
+
+    # a subtree add killed halfway: files staged and written at the prefix, the index locked
+    output = sample_config.output_dir
+    prefix = output / "services/domain1/repo1/main"
+    prefix.mkdir(parents=True)
+    (prefix / "version.txt").write_text("half written\n")
+    (prefix / "stray.txt").write_text("stray\n")
+    _git("add", "services", cwd=output)
+    (output / "README.md").write_text("changed\n")
+    (output / ".git" / "index.lock").write_text("")
+
+    sample_config.resume = True
+    await RepoMerger(sample_config, AsyncGitRepo(output)).clone_repo_branches()
+
+    assert (prefix / "version.txt").read_text() == "repo1 1\n"
+    assert not (prefix / "stray.txt").exists()
+    assert _git("status", "--porcelain", cwd=output) == ""
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_partial_leaves_a_full_clone(sample_config, temp_dir, monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "mono-merger")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "mono-merger@example.com")
+    source = temp_dir / "sources" / "repo1"
+    _make_source_repo(source, 3)
+    _git("config", "uploadpack.allowFilter", "true", cwd=source)
+    sample_config.repos = [
+        RepoConfig(
+            url=str(source),
+            branches=[BranchConfig(name="main", domain="domain1")],
+            depth=2,
+            filter="blob:none",
+        )
+    ]
+    sample_config.analysis.enabled = True
+    mono_merger = RepoMerger(sample_config, AsyncGitRepo(sample_config.output_dir))
+
+    await mono_merger.prepare_mono_repo()
+    await mono_merger.clone_repo_branches()
+
+    # sizing the tip left its blob to the checkout instead of fetching it on its own
+    assert (mono_merger.size_reports[0].files, mono_merger.size_reports[0].unsized) == (1, 1)
+
+    git_dir = sample_config.output_dir / ".git"
+    assert not (git_dir / "shallow").exists()
+    assert not list((git_dir / "objects" / "pack").glob("*.promisor"))
+    assert "promisor" not in (git_dir / "config").read_text()
+    assert _git("config", "core.repositoryformatversion", cwd=sample_config.output_dir) == "0"
+    # the output repo stands on its own once the source is gone
+    subprocess.run(["rm", "-rf", str(source)], check=True)
+    _git("fsck", "--full", "--no-dangling", cwd=sample_config.output_dir)
+    _git("clone", "--quiet", str(sample_config.output_dir), str(temp_dir / "clone"), cwd=temp_dir)
+    assert (temp_dir / "clone" / "services/domain1/repo1/main/version.txt").read_text() == "repo1 2\n"
+
+
+@pytest.mark.asyncio
+async def test_plan_units_rejects_partial_history_imports(mock_async_git, sample_config):
+    sample_config.import_engine = "history"
+    sample_config.repos[1].filter = "blob:none"
+
+    with pytest.raises(Exception, match="repo2.git develop"):
+        await RepoMerger(sample_config, mock_async_git).plan_units()
+
+
+@pytest.mark.asyncio
+async def test_sync_history_exports_only_new_commits(sample_config, temp_dir, monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "mono-merger")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "mono-merger@example.com")
+    source = temp_dir / "sources" / "repo1"
+    sample_config.import_engine = "history"
+    sample_config.repos = [
+        RepoConfig(url=_make_source_repo(source, 3), branches=[BranchConfig(name="main", domain="domain1")])
+    ]
+    exported_commits = []
+
+    async def counting_rewrite(stream, *args, **kwargs):
+        async for chunk in rewrite_fast_export(stream, *args, **kwargs):
+            if chunk.startswith(b"commit refs/"):
+                exported_commits.append(chunk)
+            yield chunk
+
+    monkeypatch.setattr("mono_merger.merge_repos.rewrite_fast_export", counting_rewrite)
+    mono_merger = RepoMerger(sample_config, AsyncGitRepo(sample_config.output_dir))
+    await mono_merger.prepare_mono_repo()
+    await mono_merger.clone_repo_branches()
+    imported_tip = _git("rev-parse", "HEAD^2", cwd=sample_config.output_dir)
+
+    for idx in range(3, 5):
+        (source / "version.txt").write_text(f"repo1 {idx}\n")
+        _git("commit", "--quiet", "-am", f"commit {idx}", cwd=source)
+    exported_commits.clear()
+    await RepoMerger(sample_config, AsyncGitRepo(sample_config.output_dir)).sync_repo_branches()
+
+    assert len(exported_commits) == 2
+    assert _git("rev-parse", "HEAD^2~2", cwd=sample_config.output_dir) == imported_tip
+    prefix = sample_config.output_dir / "services/domain1/repo1/main"
+    assert (prefix / "version.txt").read_text() == "repo1 4\n"
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_alternates(mock_async_git, sample_config, temp_dir, mocker):
+    sample_config.cache_dir = str(temp_dir / "cache")
+    sample_config.alternates.enabled = True
+    mock_async_git.rev_parse.return_value = "abc123"
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    mocker.patch.object(
+        mono_merger.mirror_cache, "ensure", side_effect=lambda url: f"/cache/{get_repo_name(url)}.git"
+    )
+
+    await mono_merger.clone_repo_branches()
+
+    mock_async_git.add_alternate.assert_any_call("/cache/repo1.git/objects")
+    mock_async_git.add_alternate.assert_any_call("/cache/repo2.git/objects")
+    mock_async_git.fetch.assert_any_call(
+        "/cache/repo1.git", "+refs/heads/main:refs/mono-merger/imports/services/domain1/repo1/main"
+    )
+    mock_async_git.dissociate.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+async def test_finalize_repo(mock_async_git, sample_config):
+    sample_config.finalize.enabled = True
+    sample_config.finalize.window = 250
+    mock_async_git.count_objects.return_value = {"count": 10, "in-pack": 0}
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.finalize_repo()
+
+    mock_async_git.repack.assert_called_once_with(
+        window=250, depth=None, threads=None, bitmaps=True, local=False, aggressive=False
+    )
+    mock_async_git.prune.assert_called_once_with()
+    mock_async_git.write_commit_graph.assert_called_once_with()
+    mock_async_git.write_multi_pack_index.assert_called_once_with(bitmap=True)
+    mock_async_git.dissociate.assert_not_called()
+    mock_async_git.walk_history.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_finalize_repo_disabled(mock_async_git, sample_config):
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.finalize_repo()
+
+    mock_async_git.repack.assert_not_called()
+    mock_async_git.dissociate.assert_not_called()
+
+
+def test_get_repo_host():
+    assert get_repo_host("https://github.com/test/repo1.git") == "github.com"
+    assert get_repo_host("ssh://git@gitlab.example.com:2222/test/repo1.git") == "gitlab.example.com"
+    assert get_repo_host("git@github.com:test/repo1.git") == "github.com"
+    assert get_repo_host("file:///srv/git/repo1.git") == "local"
+    assert get_repo_host("/srv/git/repo1.git") == "local"
+    assert get_repo_host("/srv/bundles/repo1.bundle") == "local"
+
+
+def test_get_repo_name_of_local_sources():
+    assert get_repo_name("/srv/bundles/repo1.bundle") == "repo1"
+    assert get_repo_name("/srv/clones/repo1/") == "repo1"
+    assert get_repo_name("/srv/clones/repo1.git") == "repo1"
+    assert get_repo_name("/srv/clones/repo1/.git") == "repo1"
+    assert get_repo_name("/srv/clones/repo1/.git/") == "repo1"
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_plumbing(mock_async_git, sample_config):
+    sample_config.import_engine = "plumbing"
+    mock_async_git.rev_parse.return_value = "abc123"
+    mock_async_git.write_tree.return_value = "tree123"
+    mock_async_git.commit_tree.return_value = "commit123"
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.clone_repo_branches()
 
     total_branches = sum(len(repo.branches) for repo in sample_config.repos)
-    assert mock_async_git.subtree_add.call_count == total_branches
+    mock_async_git.subtree_add.assert_not_called()
+    assert mock_async_git.fetch.call_count == total_branches
+    assert mock_async_git.update_ref.call_count == total_branches
+    mock_async_git.fetch.assert_any_call(
+        "https://github.com/test/repo1.git",
+        "+refs/heads/main:refs/mono-merger/imports/services/domain1/repo1/main",
+    )
+    mock_async_git.update_ref.assert_any_call("HEAD", "commit123", "abc123")
+    mock_async_git.reset_hard.assert_called_once_with()
 
-    for repo in sample_config.repos:
-        for branch in repo.branches:
-            mock_async_git.subtree_add.assert_any_call(
-                f"{branch.domain}/{get_repo_name(repo.url)}/{branch.name}", repo.url, branch.name, True
-            )
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_history(mock_async_git, sample_config, mocker):
+    sample_config.import_engine = "history"
+    marks = mocker.patch("mono_merger.merge_repos.HistoryMarks").return_value
+    marks.save = mocker.AsyncMock()
+    mock_async_git.rev_parse.return_value = "abc123"
+    mock_async_git.write_tree.return_value = "tree123"
+    mock_async_git.commit_tree.return_value = "commit123"
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.clone_repo_branches()
+
+    total_branches = sum(len(repo.branches) for repo in sample_config.repos)
+    mock_async_git.subtree_add.assert_not_called()
+    assert mock_async_git.rewrite_history.call_count == total_branches
+    mock_async_git.rewrite_history.assert_any_call(
+        "refs/mono-merger/imports/services/domain1/repo1/main", ANY, marks=marks
+    )
+    assert marks.save.await_count == total_branches
+    mock_async_git.rm_cached.assert_any_call("services/domain1/repo1/main", index_file=ANY)
+    mock_async_git.commit_tree.assert_any_call("tree123", ANY, "abc123", "abc123")
+    mock_async_git.update_ref.assert_any_call("HEAD", "commit123", "abc123")
+    mock_async_git.delete_ref.assert_any_call("refs/mono-merger/history/services/domain1/repo1/main")
+    mock_async_git.reset_hard.assert_called_once_with()
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_records_durations_without_lock_waits(mock_async_git, sample_config):
+    sample_config.concurrency.max_workers = 3
+    sample_config.concurrency.per_host = 3
+    mock_async_git.rev_parse.return_value = "abc123"
+
+    async def slow_subtree_add(*_args):
+        await asyncio.sleep(0.1)
+
+    mock_async_git.subtree_add.side_effect = slow_subtree_add
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    started = time.monotonic()
+    await mono_merger.clone_repo_branches()
+
+    # the subtree adds ran one at a time, but each unit only spent its own 0.1s on them
+    assert time.monotonic() - started >= 0.3
+    assert len(mono_merger.durations.durations) == 3
+    assert all(seconds < 0.2 for seconds in mono_merger.durations.durations.values())
+
+
+@pytest.mark.asyncio
+async def test_resolve_sources_mirrors_each_repo_once(mock_async_git, sample_config, temp_dir, mocker):
+    sample_config.cache_dir = str(temp_dir / "cache")
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    ensure = mocker.patch.object(
+        mono_merger.mirror_cache, "ensure", side_effect=lambda url: f"/cache/{get_repo_name(url)}.git"
+    )
+    units = await mono_merger.plan_units()
+
+    await mono_merger._resolve_sources(units)
+
+    assert ensure.call_count == 2
+    assert {unit.prefix: unit.source for unit in units} == {
+        "services/domain1/repo1/main": "/cache/repo1.git",
+        "services/domain2/repo1/feature": "/cache/repo1.git",
+        "services/domain1/repo2/develop": "/cache/repo2.git",
+    }
+
+
+@pytest.mark.asyncio
+async def test_group_staging_units(mock_async_git, sample_config):
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    units = [
+        unit
+        for repo in sample_config.repos
+        for unit in await mono_merger._plan_repo_units(repo)
+    ]
+
+    by_domain = group_staging_units(units, 0)
+    assert {name: [unit.prefix for unit in group] for name, group in by_domain.items()} == {
+        "domain1": ["services/domain1/repo1/main", "services/domain1/repo2/develop"],
+        "domain2": ["services/domain2/repo1/feature"],
+    }
+
+    shards = group_staging_units(units, 2)
+    assert list(shards) == ["shard-0000", "shard-0001"]
+    assert [len(group) for group in shards.values()] == [2, 1]
+
+
+@pytest.mark.asyncio
+async def test_assemble(mock_async_git, sample_config):
+    tips = {
+        "refs/mono-merger/staging/domain1": "tip1",
+        "refs/mono-merger/staging/domain2": "tip2",
+        "HEAD": "head1",
+    }
+    mock_async_git.rev_parse.side_effect = lambda rev: tips[rev]
+    mock_async_git.write_tree.return_value = "tree1"
+    mock_async_git.commit_tree.return_value = "merge1"
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger._assemble({"domain1": "/staging/domain1", "domain2": "/staging/domain2"})
+
+    mock_async_git.fetch.assert_any_call("/staging/domain1", "+HEAD:refs/mono-merger/staging/domain1")
+    mock_async_git.fetch.assert_any_call("/staging/domain2", "+HEAD:refs/mono-merger/staging/domain2")
+    assert mock_async_git.read_tree.call_args.args == ("head1", "tip1", "tip2")
+    commit_args = mock_async_git.commit_tree.call_args.args
+    assert commit_args[0] == "tree1"
+    assert commit_args[2:] == ("head1", "tip1", "tip2")
+    mock_async_git.update_ref.assert_called_once_with("HEAD", "merge1", "head1")
+
+
+def test_get_shard_repos(sample_config):
+    repos = [RepoConfig(url=f"https://github.com/test/repo{idx}.git", branches=[]) for idx in range(5)]
+    shards = [get_shard_repos(list(reversed(repos)), index, 2) for index in (1, 2)]
+
+    assert [repo.url for repo in shards[0]] == [repos[idx].url for idx in (0, 2, 4)]
+    assert [repo.url for repo in shards[1]] == [repos[idx].url for idx in (1, 3)]
+    assert get_shard_repos(repos, 1, 1) == repos
+
+    sample_config.shard_index, sample_config.shard_count = 2, 4
+    assert get_bundle_path(sample_config) == f"{sample_config.output_dir}-shard-2-of-4.bundle"
+
+
+@pytest.mark.asyncio
+async def test_assemble_bundles(mock_async_git, sample_config, temp_dir):
+    mock_async_git.rev_parse.return_value = "abc123"
+    shard_state = MergeState(temp_dir / "shard1.bundle.state.jsonl")
+    await shard_state.record("services/domain1/repo1/main", "https://github.com/test/repo1.git", "main", "sha1")
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.assemble_bundles([str(temp_dir / "shard1.bundle"), str(temp_dir / "shard2.bundle")])
+
+    mock_async_git.fetch.assert_any_call(
+        str(temp_dir / "shard1.bundle"), "+HEAD:refs/mono-merger/staging/shard-0000"
+    )
+    mock_async_git.fetch.assert_any_call(
+        str(temp_dir / "shard2.bundle"), "+HEAD:refs/mono-merger/staging/shard-0001"
+    )
+    assert mono_merger.state.get("services/domain1/repo1/main").sha == "sha1"
+
+
+@pytest.mark.asyncio
+async def test_assemble_bundles_shares_the_shard_root(sample_config, temp_dir, monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "mono-merger")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "mono-merger@example.com")
+    sample_config.repos = [
+        RepoConfig(
+            url=_make_source_repo(temp_dir / "sources" / f"repo{idx}", 1),
+            branches=[BranchConfig(name="main", domain="domain1")],
+        )
+        for idx in range(4)
+    ]
+    bundles = []
+    for idx in (1, 2):
+        # shards run on different machines at different times
+        for name in ("AUTHOR", "COMMITTER"):
+            monkeypatch.setenv(f"GIT_{name}_DATE", f"{1700000000 + idx * 60} +0000")
+        shard_config = dataclasses.replace(
+            sample_config, output_dir=temp_dir / f"shard{idx}", shard_index=idx, shard_count=2
+        )
+        shard = RepoMerger(shard_config, AsyncGitRepo(shard_config.output_dir))
+        await shard.prepare_mono_repo(shared_root=True)
+        await shard.clone_repo_branches()
+        bundles.append(str(temp_dir / f"shard{idx}.bundle"))
+        await shard.export_bundle(bundles[-1])
+
+    mono_merger = RepoMerger(sample_config, AsyncGitRepo(sample_config.output_dir))
+    await mono_merger.prepare_mono_repo(shared_root=True)
+    await mono_merger.assemble_bundles(bundles)
+
+    output = sample_config.output_dir
+    roots = _git("log", "--max-parents=0", "--format=%s", "HEAD", cwd=output).splitlines()
+    assert roots.count("first commit") == 1
+    for idx in range(4):
+        assert (output / f"services/domain1/repo{idx}/main/version.txt").is_file()
+
+
+@pytest.mark.asyncio
+async def test_sync_repo_branches(mock_async_git, sample_config):
+    mock_async_git.list_branches.side_effect = lambda url: {
+        "https://github.com/test/repo1.git": {"main": "sha1", "feature": "sha2new"},
+        "https://github.com/test/repo2.git": {"develop": "sha3"},
+    }[url]
+    mock_async_git.rev_parse.return_value = "sha2new"
+    mock_async_git.unmerged_paths.return_value = []
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    await mono_merger.state.record("services/domain1/repo1/main", "https://github.com/test/repo1.git", "main", "sha1")
+    await mono_merger.state.record("services/domain2/repo1/feature", "https://github.com/test/repo1.git", "feature", "sha2")
+
+    await mono_merger.sync_repo_branches()
+
+    mock_async_git.subtree_merge.assert_called_once_with("services/domain2/repo1/feature", "sha2new", True)
+    mock_async_git.subtree_add.assert_called_once_with("services/domain1/repo2/develop", None, "sha2new", True)
+    assert mono_merger.state.get("services/domain2/repo1/feature").sha == "sha2new"
+    assert mono_merger.state.get("services/domain1/repo1/main").sha == "sha1"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "merge_error, unmerged",
+    [
+        (GitCommandError("Automatic merge failed", returncode=1), ["app.py"]),
+        (None, ["app.py"]),
+    ],
+)
+async def test_sync_repo_branches_aborts_conflicting_merge(mock_async_git, sample_config, merge_error, unmerged):
+    sample_config.repos = sample_config.repos[:1]
+    mock_async_git.list_branches.return_value = {"main": "sha1new", "feature": "sha2"}
+    mock_async_git.rev_parse.return_value = "sha1new"
+    mock_async_git.subtree_merge.side_effect = merge_error
+    mock_async_git.unmerged_paths.return_value = unmerged
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    await mono_merger.state.record("services/domain1/repo1/main", "https://github.com/test/repo1.git", "main", "sha1")
+    await mono_merger.state.record("services/domain2/repo1/feature", "https://github.com/test/repo1.git", "feature", "sha2")
+
+    with pytest.raises(Exception):
+        await mono_merger.sync_repo_branches()
+
+    mock_async_git.reset_hard.assert_called_once_with()
+    assert mono_merger.state.get("services/domain1/repo1/main").sha == "sha1"
+    await mono_merger.state.load()
+    assert mono_merger.state.get("services/domain1/repo1/main").sha == "sha1"
+
+
+@pytest.mark.asyncio
+async def test_sync_repo_branches_without_state(mock_async_git, sample_config):
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    with pytest.raises(Exception, match="run a full merge first"):
+        await mono_merger.sync_repo_branches()
+
+
+@pytest.mark.asyncio
+async def test_verify_repo_branches(mock_async_git, sample_config):
+    mock_async_git.list_branches.side_effect = lambda url: {
+        "https://github.com/test/repo1.git": {"main": "sha1", "feature": "sha2"},
+        "https://github.com/test/repo2.git": {"develop": "sha3"},
+    }[url]
+    trees = {
+        "HEAD:services/domain1/repo1/main": "tree1",
+        "sha1^{tree}": "tree1",
+        "HEAD:services/domain2/repo1/feature": "tree2old",
+        "sha2^{tree}": "tree2",
+        "HEAD:services/domain1/repo2/develop": "",
+        "sha3^{tree}": "tree3",
+    }
+    mock_async_git.rev_parse.side_effect = lambda rev: trees[rev]
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    await mono_merger.state.record("services/domain2/repo1/feature", "https://github.com/test/repo1.git", "feature", "sha2")
+
+    checks = await mono_merger.verify_repo_branches()
+
+    assert {check.prefix: check.status for check in checks} == {
+        "services/domain1/repo1/main": "ok",
+        "services/domain2/repo1/feature": "mismatch",
+        "services/domain1/repo2/develop": "missing",
+    }
+    mock_async_git.fetch.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_verify_fetches_unknown_tips(mock_async_git, sample_config):
+    sample_config.repos = sample_config.repos[:1]
+    sample_config.repos[0].branches = sample_config.repos[0].branches[:1]
+    mock_async_git.list_branches.return_value = {"main": "sha1new"}
+    # the tip is only known once it has been fetched
+    trees = {
+        "HEAD:services/domain1/repo1/main": iter(["tree1"]),
+        "sha1new^{tree}": iter(["", "tree1new"]),
+        "refs/mono-merger/imports/services/domain1/repo1/main": iter(["sha1new"]),
+    }
+    mock_async_git.rev_parse.side_effect = lambda rev: next(trees[rev])
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    await mono_merger.state.record("services/domain1/repo1/main", "https://github.com/test/repo1.git", "main", "sha1")
+
+    (check,) = await mono_merger.verify_repo_branches()
+
+    assert (check.status, check.expected, check.actual) == ("stale", "tree1new", "tree1")
+    mock_async_git.fetch.assert_called_once_with(
+        "https://github.com/test/repo1.git", "+refs/heads/main:refs/mono-merger/imports/services/domain1/repo1/main"
+    )
+    mock_async_git.delete_ref.assert_called_once_with("refs/mono-merger/imports/services/domain1/repo1/main")
+
+
+@pytest.mark.asyncio
+async def test_plan_units_rejects_conflicting_prefixes(mock_async_git, sample_config):
+    sample_config.repos[0].branches.append(BranchConfig(name="main/hotfix", domain="domain1"))
+    sample_config.repos.append(
+        RepoConfig(url="https://github.com/other/repo2.git", branches=[BranchConfig(name="develop", domain="domain1")])
+    )
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    with pytest.raises(Exception, match="2 conflicting import prefixes"):
+        await mono_merger.plan_units()
+    mock_async_git.fetch.assert_not_called()
+
+
+def test_get_unit_prefix_applies_domain_mapping():
+    branch = BranchConfig(name="release/1.0", domain="payments")
+    assert (
+        get_unit_prefix({"payments": "services/payments/"}, "git@host:org/api.git", branch)
+        == "services/payments/api/release/1.0"
+    )
+    assert get_unit_prefix({}, "git@host:org/api.git", branch) == "payments/api/release/1.0"
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_dedupes_tips(mock_async_git, sample_config):
+    sample_config.dedupe = True
+    mock_async_git.list_branches.side_effect = lambda url: {
+        "https://github.com/test/repo1.git": {"main": "sha1", "feature": "sha1"},
+        "https://github.com/test/repo2.git": {"develop": "sha1"},
+    }[url]
+    mock_async_git.rev_parse.return_value = "sha1"
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.clone_repo_branches()
+
+    mock_async_git.fetch.assert_called_once()
+    assert mock_async_git.update_ref.await_count == 2
+    assert mock_async_git.subtree_add.call_count == 3
+    assert (mono_merger.tips.fetches, mono_merger.tips.skipped) == (1, 2)
+    for prefix in ("services/domain1/repo1/main", "services/domain2/repo1/feature", "services/domain1/repo2/develop"):
+        mock_async_git.subtree_add.assert_any_call(prefix, None, "sha1", True)
+        assert mono_merger.state.get(prefix).sha == "sha1"
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_reads_local_sources_directly(mock_async_git, sample_config, temp_dir, mocker):
+    sample_config.cache_dir = str(temp_dir / "cache")
+    sample_config.repos = sample_config.repos[:1]
+    sample_config.repos[0].url = "/srv/bundles/repo1.bundle"
+    mock_async_git.rev_parse.return_value = "abc123"
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+    ensure = mocker.patch.object(mono_merger.mirror_cache, "ensure")
+
+    await mono_merger.clone_repo_branches()
+
+    ensure.assert_not_called()
+    mock_async_git.fetch.assert_any_call(
+        "/srv/bundles/repo1.bundle", "+refs/heads/main:refs/mono-merger/imports/services/domain1/repo1/main"
+    )
+    mock_async_git.subtree_add.assert_any_call("services/domain2/repo1/feature", None, "abc123", True)
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_filters_large_files(mock_async_git, sample_config, mocker):
+    sample_config.repos = sample_config.repos[:1]
+    sample_config.repos[0].branches = sample_config.repos[0].branches[:1]
+    sample_config.repos[0].max_blob_size = 1024
+    mock_async_git.rev_parse.return_value = "abc123"
+    mocker.patch(
+        "mono_merger.merge_repos.list_blobs",
+        return_value=[("src/app.py", "a" * 40, 100), ("vendor/tool.bin", "b" * 40, 4096)],
+    )
+    mock_async_git.write_tree.return_value = "tree1"
+    mock_async_git.commit_tree.return_value = "filtered1"
+    mocker.patch("mono_merger.merge_repos.save_size_reports")
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    await mono_merger.clone_repo_branches()
+
+    mock_async_git.remove_paths.assert_called_once_with(["vendor/tool.bin"], index_file=ANY)
+    mock_async_git.subtree_add.assert_called_once_with("services/domain1/repo1/main", None, "filtered1", True)
+    assert mono_merger.state.get("services/domain1/repo1/main").sha == "abc123"
+    (report,) = mono_merger.size_reports
+    assert (report.total, [blob.path for blob in report.oversized]) == (100, ["vendor/tool.bin"])
+
+
+@pytest.mark.asyncio
+async def test_clone_repo_branches_fails_over_budget(mock_async_git, sample_config, mocker):
+    sample_config.analysis.on_budget = "fail"
+    sample_config.repos = sample_config.repos[:1]
+    sample_config.repos[0].size_budget = 1024
+    mock_async_git.rev_parse.return_value = "abc123"
+    mocker.patch("mono_merger.merge_repos.list_blobs", return_value=[("vendor/tool.bin", "b" * 40, 4096)])
+    mono_merger = RepoMerger(sample_config, mock_async_git)
+
+    with pytest.raises(Exception, match="over its size budget"):
+        await mono_merger.clone_repo_branches()
+    mock_async_git.subtree_add.assert_not_called()
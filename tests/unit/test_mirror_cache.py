@@ -0,0 +1,42 @@
+import pytest
+
+from mono_merger.async_git import AsyncGitRepo
+from mono_merger.mirror_cache import MirrorCache, get_mirror_name
+
+
+def test_get_mirror_name():
+    name = get_mirror_name("git@github.com:test/repo1.git")
+    assert name.startswith("repo1-")
+    assert name.endswith(".git")
+    assert name != get_mirror_name("git@github.com:other/repo1.git")
+
+
+@pytest.mark.asyncio
+async def test_ensure_clones_on_miss(mocker, temp_dir):
+    mock_clone = mocker.patch.object(AsyncGitRepo, "clone_mirror")
+    mock_update = mocker.patch.object(AsyncGitRepo, "remote_update")
+    cache = MirrorCache(temp_dir)
+    url = "https://github.com/test/repo1.git"
+
+    path = await cache.ensure(url)
+    await cache.ensure(url)
+
+    assert path == str(cache.mirror_path(url))
+    mock_clone.assert_called_once_with(url, path)
+    mock_update.assert_not_called()
+    assert (cache.stats.hits, cache.stats.misses) == (0, 1)
+
+
+@pytest.mark.asyncio
+async def test_ensure_updates_on_hit(mocker, temp_dir):
+    mock_clone = mocker.patch.object(AsyncGitRepo, "clone_mirror")
+    mock_update = mocker.patch.object(AsyncGitRepo, "remote_update")
+    cache = MirrorCache(temp_dir)
+    url = "https://github.com/test/repo1.git"
+    cache.mirror_path(url).mkdir(parents=True)
+
+    await cache.ensure(url)
+
+    mock_clone.assert_not_called()
+    mock_update.assert_called_once_with()
+    assert (cache.stats.hits, cache.stats.misses) == (1, 0)
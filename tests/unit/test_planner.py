@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+import pytest
+
+from mono_merger.config import BranchConfig, RepoConfig
+from mono_merger.planner import (
+    CostPlanner,
+    DurationHistory,
+    estimate_makespan,
+    format_plan,
+)
+
+
+def _unit(url: str, branch: str, prefix: str):
+    return SimpleNamespace(
+        repo=RepoConfig(url=url, branches=[]),
+        branch=BranchConfig(name=branch, domain="domain1"),
+        prefix=prefix,
+    )
+
+
+def test_estimate_makespan():
+    assert estimate_makespan([], 4) == 0.0
+    assert estimate_makespan([1.0, 1.0, 1.0, 1.0], 2) == 2.0
+    # a long unit started last finishes long after the others
+    assert estimate_makespan([1.0, 1.0, 1.0, 1.0, 4.0], 2) == 6.0
+    assert estimate_makespan([4.0, 1.0, 1.0, 1.0, 1.0], 2) == 4.0
+
+
+@pytest.mark.asyncio
+async def test_duration_history_round_trip(temp_dir):
+    history = DurationHistory(temp_dir / "durations.json")
+    history.record("domain1/repo1/main", 12.34567)
+    await history.save()
+
+    reloaded = DurationHistory(temp_dir / "durations.json")
+    await reloaded.load()
+    assert reloaded.get("domain1/repo1/main") == 12.346
+    assert reloaded.get("domain1/repo1/feature") is None
+
+
+@pytest.mark.asyncio
+async def test_estimate_and_order(temp_dir):
+    history = DurationHistory(temp_dir / "durations.json")
+    history.record("domain1/repo2/main", 30.0)
+    discovery = SimpleNamespace(
+        known_heads=lambda url: {f"b{idx}": "abc123" for idx in range(100)} if "repo1" in url else None
+    )
+    planner = CostPlanner(history, discovery)
+    units = [
+        _unit("https://github.com/test/repo3.git", "main", "domain1/repo3/main"),
+        _unit("https://github.com/test/repo1.git", "main", "domain1/repo1/main"),
+        _unit("https://github.com/test/repo2.git", "main", "domain1/repo2/main"),
+    ]
+
+    estimates = await planner.estimate(units)
+
+    assert [estimate.basis for estimate in estimates] == ["default", "default", "history"]
+    assert estimates[1].seconds > estimates[0].seconds
+    assert [unit.prefix for unit in planner.order(units, estimates)] == [
+        "domain1/repo2/main",
+        "domain1/repo1/main",
+        "domain1/repo3/main",
+    ]
+    assert "3 imports" in format_plan(estimates, 2)
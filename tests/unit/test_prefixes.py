@@ -0,0 +1,44 @@
+from mono_merger.prefixes import DUPLICATE, INVALID, NESTED, PrefixTrie, find_prefix_conflicts
+
+
+def test_distinct_prefixes_do_not_conflict():
+    assert find_prefix_conflicts(
+        [
+            ("services/a/repo/main", "a main"),
+            ("services/a/repo/feature-x", "a feature-x"),
+            ("services/a/repo2/main", "b main"),
+        ]
+    ) == []
+
+
+def test_duplicate_prefix():
+    (conflict,) = find_prefix_conflicts(
+        [("services/repo/main", "org1/repo main"), ("services/repo/main", "org2/repo main")]
+    )
+    assert conflict.kind == DUPLICATE
+    assert conflict.owner == "org2/repo main"
+    assert conflict.other_owner == "org1/repo main"
+    assert "target of both" in conflict.describe()
+
+
+def test_nested_prefixes_in_either_order():
+    for targets in (
+        [("d/repo/feature", "feature"), ("d/repo/feature/x", "feature/x")],
+        [("d/repo/feature/x", "feature/x"), ("d/repo/feature", "feature")],
+    ):
+        (conflict,) = find_prefix_conflicts(targets)
+        assert conflict.kind == NESTED
+        assert {conflict.prefix, conflict.other_prefix} == {"d/repo/feature", "d/repo/feature/x"}
+
+
+def test_all_conflicts_are_reported():
+    trie = PrefixTrie()
+    assert trie.insert("d/repo/a/1", "a/1") == []
+    assert trie.insert("d/repo/a/2", "a/2") == []
+    conflicts = trie.insert("d/repo/a", "a")
+    assert sorted(conflict.other_prefix for conflict in conflicts) == ["d/repo/a/1", "d/repo/a/2"]
+
+
+def test_invalid_prefix():
+    (conflict,) = find_prefix_conflicts([("../outside/repo/main", "main")])
+    assert conflict.kind == INVALID
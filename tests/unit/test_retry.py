@@ -0,0 +1,79 @@
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from mono_merger.async_git import GitCommandError
+from mono_merger.config import RetryConfig
+from mono_merger.retry import (
+    CONGESTION,
+    TRANSIENT,
+    RemoteRetry,
+    backoff_delay,
+    classify_failure,
+)
+from mono_merger.scheduler import WorkScheduler
+
+
+def test_classify_failure():
+    assert classify_failure(GitCommandError("x", stderr="error: RPC failed; HTTP 429")) == CONGESTION
+    assert classify_failure(GitCommandError("x", timed_out=True)) == CONGESTION
+    assert classify_failure(GitCommandError("x", stderr="fatal: early EOF")) == TRANSIENT
+    assert (
+        classify_failure(GitCommandError("x", stderr="fatal: Could not resolve host: example.com"))
+        == TRANSIENT
+    )
+    assert classify_failure(GitCommandError("x", stderr="fatal: repository not found")) is None
+    assert classify_failure(ValueError("boom")) is None
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 1.0, 8.0) <= min(8.0, 2**attempt)
+
+
+@pytest.mark.asyncio
+async def test_run_retries_transient_errors(mocker):
+    sleep = mocker.patch("mono_merger.retry.asyncio.sleep", new=AsyncMock())
+    operation = AsyncMock(
+        side_effect=[GitCommandError("x", stderr="fatal: the remote end hung up"), "done"]
+    )
+    retry = RemoteRetry(RetryConfig(attempts=3))
+
+    assert await retry.run("example.com", "Fetching", operation) == "done"
+    assert operation.await_count == 2
+    sleep.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_run_raises_permanent_errors_immediately(mocker):
+    sleep = mocker.patch("mono_merger.retry.asyncio.sleep", new=AsyncMock())
+    operation = AsyncMock(side_effect=GitCommandError("x", stderr="fatal: not a git repository"))
+    retry = RemoteRetry(RetryConfig(attempts=3))
+
+    with pytest.raises(GitCommandError):
+        await retry.run("example.com", "Fetching", operation)
+    assert operation.await_count == 1
+    sleep.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_run_gives_up_after_attempts(mocker):
+    mocker.patch("mono_merger.retry.asyncio.sleep", new=AsyncMock())
+    operation = AsyncMock(side_effect=GitCommandError("x", stderr="fatal: early EOF"))
+    retry = RemoteRetry(RetryConfig(attempts=3))
+
+    with pytest.raises(GitCommandError):
+        await retry.run("example.com", "Fetching", operation)
+    assert operation.await_count == 3
+
+
+@pytest.mark.asyncio
+async def test_run_reports_congestion_to_scheduler(mocker):
+    mocker.patch("mono_merger.retry.asyncio.sleep", new=AsyncMock())
+    scheduler = Mock(spec=WorkScheduler)
+    operation = AsyncMock(side_effect=[GitCommandError("x", stderr="HTTP 429"), "done"])
+    retry = RemoteRetry(RetryConfig(attempts=2), scheduler)
+
+    await retry.run("example.com", "Fetching", operation)
+
+    scheduler.record_congestion.assert_called_once_with("example.com")
+    scheduler.record_success.assert_called_once_with("example.com")
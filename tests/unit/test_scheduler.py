@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+
+from mono_merger.scheduler import WorkScheduler
+
+
+@pytest.mark.asyncio
+async def test_run_respects_limits():
+    scheduler = WorkScheduler(max_workers=3, per_host=2, host_limits={"slow": 1})
+    running = {"total": 0, "fast": 0, "slow": 0}
+    peaks = {"total": 0, "fast": 0, "slow": 0}
+
+    async def handler(unit):
+        host, idx = unit
+        for name in ("total", host):
+            running[name] += 1
+            peaks[name] = max(peaks[name], running[name])
+        await asyncio.sleep(0.01)
+        for name in ("total", host):
+            running[name] -= 1
+        return idx
+
+    units = [("slow" if idx % 2 else "fast", idx) for idx in range(10)]
+    results = await scheduler.run(units, handler, key=lambda unit: unit[0])
+
+    assert results == list(range(10))
+    assert peaks == {"total": 3, "fast": 2, "slow": 1}
+
+
+@pytest.mark.asyncio
+async def test_run_stops_on_failure():
+    scheduler = WorkScheduler(max_workers=1, per_host=1)
+    started = []
+
+    async def handler(unit):
+        started.append(unit)
+        if unit == 1:
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await scheduler.run(range(5), handler, key=lambda unit: "host")
+
+    assert started == [0, 1]
+
+
+def test_adaptive_limit_halves_and_recovers(mocker):
+    scheduler = WorkScheduler(max_workers=8, per_host=4, adaptive=True)
+    clock = mocker.patch("mono_merger.scheduler.time.monotonic", return_value=100.0)
+
+    scheduler.record_congestion("example.com")
+    assert scheduler.host_limit("example.com") == 2
+    # failures reported together only count once
+    scheduler.record_congestion("example.com")
+    assert scheduler.host_limit("example.com") == 2
+
+    clock.return_value = 200.0
+    scheduler.record_congestion("example.com")
+    assert scheduler.host_limit("example.com") == 1
+    assert scheduler.host_limit("other.com") == 4
+
+    for _ in range(20):
+        scheduler.record_success("example.com")
+    assert scheduler.host_limit("example.com") == 4
+
+
+def test_non_adaptive_limit_is_fixed():
+    scheduler = WorkScheduler(max_workers=8, per_host=4)
+
+    scheduler.record_congestion("example.com")
+
+    assert scheduler.host_limit("example.com") == 4
+
+
+def test_local_sources_share_the_global_limit():
+    assert WorkScheduler(max_workers=8, per_host=2).host_limit("local") == 8
+    assert WorkScheduler(max_workers=8, per_host=2, host_limits={"local": 3}).host_limit("local") == 3
@@ -0,0 +1,124 @@
+import json
+import subprocess
+
+import pytest
+
+from mono_merger.async_git import AsyncGitRepo
+from mono_merger.sizes import (
+    analyze_blobs,
+    describe_report,
+    format_size,
+    format_size_summary,
+    list_blobs,
+    list_large_blobs,
+    save_size_reports,
+)
+
+BLOBS = [
+    ("src/app.py", "a" * 40, 2048),
+    ("src/util.py", "b" * 40, 512),
+    ("vendor/tool.bin", "c" * 40, 50 * 1024**2),
+    ("docs/guide.md", "d" * 40, 4096),
+]
+
+
+@pytest.mark.asyncio
+async def test_list_blobs(mock_async_git):
+    mock_async_git.run_git_command.return_value = (
+        f"100644 blob {'a' * 40}    2048\tsrc/app.py\n"
+        f"160000 commit {'e' * 40}       -\tvendor/lib\n"
+        f'100644 blob {"d" * 40}    4096\t"docs/caf\\303\\251.md"'
+    )
+
+    blobs = await list_blobs(mock_async_git, "abc123")
+
+    assert blobs == [("src/app.py", "a" * 40, 2048), ("docs/caf\u00e9.md", "d" * 40, 4096)]
+    mock_async_git.run_git_command.assert_called_once_with("ls-tree", "-r", "-l", "abc123", timeout=1800)
+
+
+@pytest.mark.asyncio
+async def test_list_blobs_present_only_does_not_fetch_missing_blobs(temp_dir):
+    def git(*args, cwd):
+        return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout
+
+    source, output = temp_dir / "source", temp_dir / "output"
+    git("init", "--quiet", "--initial-branch=main", str(source), cwd=temp_dir)
+    git("config", "uploadpack.allowFilter", "true", cwd=source)
+    (source / "small.txt").write_text("small\n")
+    (source / "large.bin").write_bytes(b"x" * 4096)
+    git("add", ".", cwd=source)
+    git("-c", "user.name=a", "-c", "user.email=a@b", "commit", "--quiet", "-m", "files", cwd=source)
+    git("init", "--quiet", str(output), cwd=temp_dir)
+    repo = AsyncGitRepo(output)
+    await repo.fetch(str(source), "+refs/heads/main:refs/tip", filter_spec="blob:limit=1024")
+
+    blobs = dict((path, size) for path, _, size in await list_blobs(repo, "refs/tip", present_only=True))
+
+    assert blobs == {"large.bin": None, "small.txt": 6}
+    # the large blob is still only in the source
+    assert len(await repo.missing_objects("refs/tip")) == 1
+
+
+@pytest.mark.asyncio
+async def test_list_large_blobs(mock_async_git):
+    mock_async_git.run_git_command.return_value = f"{'a' * 40}\n~{'c' * 40}\n{'b' * 40}"
+
+    assert await list_large_blobs(mock_async_git, "abc123", 1024) == {"c" * 40}
+
+
+def test_format_size():
+    assert format_size(512) == "512 B"
+    assert format_size(2048) == "2.0 KiB"
+    assert format_size(50 * 1024**2) == "50.0 MiB"
+    assert format_size(3 * 1024**4) == "3072.0 GiB"
+
+
+def test_analyze_blobs():
+    report, dropped = analyze_blobs("services/repo1/main", BLOBS, top=2)
+
+    assert (report.files, report.total, dropped) == (4, 50 * 1024**2 + 6656, [])
+    assert [blob.path for blob in report.largest] == ["vendor/tool.bin", "docs/guide.md"]
+    assert not report.over_budget
+    assert describe_report(report).startswith("services/repo1/main: 4 files, 50.0 MiB unpacked, largest: vendor/tool.bin")
+
+
+def test_analyze_blobs_filters_and_budget():
+    report, dropped = analyze_blobs(
+        "services/repo1/main", BLOBS, top=10, exclude=["docs"], max_blob_size=1024**2, budget=2048
+    )
+
+    assert dropped == ["vendor/tool.bin", "docs/guide.md"]
+    assert [blob.path for blob in report.oversized] == ["vendor/tool.bin"]
+    assert (report.files, report.total, report.filtered) == (2, 2560, 1)
+    assert report.over_budget
+
+
+def test_analyze_blobs_of_a_partial_fetch():
+    blobs = BLOBS[:2] + [("vendor/tool.bin", "c" * 40, None), ("docs/guide.md", "d" * 40, None)]
+
+    report, dropped = analyze_blobs(
+        "services/repo1/main", blobs, top=10, exclude=["docs"], max_blob_size=1024**2
+    )
+
+    # a blob of unknown size cannot be judged by the size limit
+    assert dropped == ["docs/guide.md"]
+    assert (report.files, report.total, report.unsized) == (3, 2560, 1)
+    assert describe_report(report).endswith("1 files not fetched yet and not sized")
+
+
+@pytest.mark.asyncio
+async def test_size_summary_and_reports(temp_dir):
+    reports = [
+        analyze_blobs("services/small", BLOBS[:1], top=1)[0],
+        analyze_blobs("services/large", BLOBS, top=1)[0],
+    ]
+
+    summary = format_size_summary(reports, top=1)
+    assert "services/large" in summary and "services/small" not in summary
+    assert summary.endswith("2 prefixes, 50.0 MiB unpacked in total")
+
+    path = temp_dir / "mono-merger" / "sizes.json"
+    await save_size_reports(path, reports)
+    saved = json.loads(path.read_text(encoding="utf-8"))["prefixes"]
+    assert [report["prefix"] for report in saved] == ["services/large", "services/small"]
+    assert saved[0]["largest"][0]["path"] == "vendor/tool.bin"
@@ -0,0 +1,61 @@
+import pytest
+
+from mono_merger.state import MergeState
+
+
+@pytest.mark.asyncio
+async def test_record_and_load(temp_dir):
+    state = MergeState.for_repo(temp_dir)
+    await state.record("domain1/repo1/main", "https://github.com/test/repo1.git", "main", "abc123")
+
+    reloaded = MergeState.for_repo(temp_dir)
+    await reloaded.load()
+
+    assert reloaded.is_complete("domain1/repo1/main")
+    assert not reloaded.is_complete("domain1/repo1/feature")
+    unit = reloaded.get("domain1/repo1/main")
+    assert (unit.url, unit.branch, unit.sha) == ("https://github.com/test/repo1.git", "main", "abc123")
+
+
+@pytest.mark.asyncio
+async def test_load_without_state_file(temp_dir):
+    state = MergeState.for_repo(temp_dir)
+    await state.load()
+    assert state.units == {}
+
+
+@pytest.mark.asyncio
+async def test_merge_and_save_as(temp_dir):
+    shard = MergeState(temp_dir / "shard.state.jsonl")
+    await shard.record("domain1/repo1/main", "https://github.com/test/repo1.git", "main", "abc123")
+    await shard.save_as(temp_dir / "copy.state.jsonl")
+
+    copy = MergeState(temp_dir / "copy.state.jsonl")
+    await copy.load()
+    state = MergeState.for_repo(temp_dir)
+    await state.merge(copy.units.values())
+
+    reloaded = MergeState.for_repo(temp_dir)
+    await reloaded.load()
+    assert reloaded.get("domain1/repo1/main") == shard.get("domain1/repo1/main")
+
+
+@pytest.mark.asyncio
+async def test_record_appends_and_load_compacts(temp_dir):
+    state = MergeState.for_repo(temp_dir)
+    await state.record("domain1/repo1/main", "https://github.com/test/repo1.git", "main", "abc123")
+    await state.record("domain1/repo2/main", "https://github.com/test/repo2.git", "main", "def456")
+    await state.record("domain1/repo1/main", "https://github.com/test/repo1.git", "main", "fed789")
+    assert len(state.path.read_text().splitlines()) == 3
+
+    # a crash in the middle of an append leaves a partial last line
+    with state.path.open("a", encoding="utf-8") as file:
+        file.write('{"prefix": "domain1/repo3/main", "url"')
+
+    reloaded = MergeState.for_repo(temp_dir)
+    await reloaded.load()
+
+    assert reloaded.get("domain1/repo1/main").sha == "fed789"
+    assert reloaded.get("domain1/repo2/main").sha == "def456"
+    assert not reloaded.is_complete("domain1/repo3/main")
+    assert len(state.path.read_text().splitlines()) == 2
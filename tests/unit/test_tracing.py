@@ -0,0 +1,56 @@
+import json
+import pytest
+
+from mono_merger import tracing
+from mono_merger.tracing import GitTracer, get_subcommand, percentile
+
+
+def test_get_subcommand():
+    assert get_subcommand(["fetch", "--quiet", "origin"]) == "fetch"
+    assert get_subcommand(["subtree", "add", "--prefix", "a"]) == "subtree add"
+
+
+def test_percentile():
+    values = [float(value) for value in range(1, 101)]
+    assert percentile(values, 0.5) == 50.0
+    assert percentile(values, 0.95) == 95.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_record_uses_unit_context():
+    tracer = GitTracer()
+    tracing.current_unit.set(("https://github.com/test/repo1.git", "main"))
+    tracing.queue_wait.set(1.5)
+
+    tracer.record(["fetch", "origin"], tracer.origin + 2.0, 3.0, exit_code=0, output_bytes=42)
+
+    record = tracer.records[0]
+    assert (record.subcommand, record.url, record.branch) == (
+        "fetch",
+        "https://github.com/test/repo1.git",
+        "main",
+    )
+    assert (record.queue_wait, record.start, record.duration) == (1.5, 2.0, 3.0)
+    assert (record.exit_code, record.output_bytes) == (0, 42)
+
+
+def test_summary_and_chrome_trace():
+    tracer = GitTracer()
+    tracing.current_unit.set(("repo1", "main"))
+    tracer.record(["fetch"], tracer.origin, 4.0, exit_code=0, output_bytes=0)
+    tracer.record(["fetch"], tracer.origin + 1.0, 1.0, exit_code=0, output_bytes=0)
+    tracing.current_unit.set(("repo2", "main"))
+    tracer.record(["subtree", "add"], tracer.origin + 4.0, 2.0, exit_code=0, output_bytes=0)
+
+    summary = tracer.summary()
+    assert summary["commands"] == 3
+    assert summary["peak_concurrency"] == 2
+    assert summary["subcommands"]["fetch"]["count"] == 2
+    assert summary["subcommands"]["fetch"]["max"] == 4.0
+    assert summary["slowest_repos"][0] == ("repo1", 5.0)
+    assert summary["average_concurrency"] == pytest.approx(7.0 / 6.0)
+
+    trace = json.loads(json.dumps(tracer.to_chrome_trace()))
+    spans = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [event["tid"] for event in spans] == [0, 1, 0]
+    assert spans[2]["name"] == "subtree add"